@@ -1,11 +1,130 @@
 import os
 import datetime
-import hashlib
-import schedule
+import queue
 import threading
 import time
 from pathlib import Path
 from database import DatabaseHandler
+from settings import get_settings_store
+from duplicates import DuplicateFinder, HashCache, DEFAULT_WORKERS
+from scanner import DirectoryScanner, ScanPolicy, ScanVisitor
+from watcher import DirtyPathJournal, directory_watcher
+from scheduler import scheduler
+
+UNUSED_FILE_DAYS = 90
+FULL_SCAN_DAYS = 7  # incremental cleans still walk the whole root this often, e.g. to age out unused files
+CLEAN_RETRY_MINUTES = 10  # a scheduled clean that found another clean running is retried after this long
+
+
+class EmptyFolderVisitor(ScanVisitor):
+    # directories are left bottom-up, so a chain of empty folders collapses in a single walk
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+        self.removed = 0
+        self.elapsed = 0.0  # time spent removing folders, the walk is shared with the other visitors
+
+    def leave_directory(self, directory, entry_count, is_root):
+        if entry_count or is_root or os.path.islink(directory):
+            return False
+        started = time.perf_counter()
+        try:
+            print(f"Deleting empty folder: {directory}")
+            os.rmdir(directory)
+            self.removed += 1
+            return True
+        except OSError as e:
+            self.db_handler.log_error(f"Error cleaning empty folder {directory}: {str(e)}")
+            return False
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def report(self):
+        return f"Removed {self.removed} empty folders in {self.elapsed:.2f}s"
+
+
+class UnusedFileVisitor(ScanVisitor):
+    def __init__(self, db_handler, days=UNUSED_FILE_DAYS):
+        self.db_handler = db_handler
+        self.days = days
+        self.threshold = None
+
+    def start(self, root_directory):
+        self.threshold = (datetime.datetime.now() - datetime.timedelta(days=self.days)).timestamp()
+
+    def visit_file(self, file_path, st):
+        if st.st_atime >= self.threshold:
+            return False
+        try:
+            os.remove(file_path)
+            return True
+        except OSError as e:
+            self.db_handler.log_error(f"Error cleaning unused file {file_path}: {str(e)}")
+            return False
+
+
+class DuplicateFileVisitor(ScanVisitor):
+    def __init__(self, db_handler, duplicate_finder):
+        self.db_handler = db_handler
+        self.duplicate_finder = duplicate_finder
+
+    def start(self, root_directory):
+        self.duplicate_finder.start(root_directory)
+        if self.scanner.targets is not None:
+            # only part of the root is walked, so files from earlier scans are compared too;
+            # they come first in the walk order and are therefore the copies that are kept
+            self.remove_duplicates(
+                duplicate for path, st in self.duplicate_finder.known_files(skip=self.is_rescanned)
+                for duplicate in self.duplicate_finder.add_file(path, st))
+
+    def is_rescanned(self, path):
+        for directory, recursive in self.scanner.targets:
+            if os.path.dirname(path) == directory or (recursive and path.startswith(os.path.join(directory, ''))):
+                return True
+        return False
+
+    def visit_file(self, file_path, st):
+        self.remove_duplicates(self.duplicate_finder.add_file(file_path, st))
+        return False
+
+    def finish(self):
+        self.remove_duplicates(self.duplicate_finder.finish(self.scanner.cancel_event))
+
+    def close(self):
+        self.duplicate_finder.close()
+
+    def remove_duplicates(self, duplicates):
+        for original_path, duplicate_path in duplicates:
+            if not os.path.isfile(original_path):
+                continue  # the copy that would be kept is gone, so this one is not a duplicate any more
+            try:
+                os.remove(duplicate_path)
+                self.scanner.entry_removed(duplicate_path)
+            except OSError as e:
+                self.db_handler.log_error(f"Error cleaning duplicate file {duplicate_path}: {str(e)}")
+
+
+class AutoCleanWorker(threading.Thread):
+    # runs a clean off the UI thread; the UI polls `events` for ('progress' | 'done' | 'cancelled' | 'error', data)
+    def __init__(self, auto_clean_handler, force=True):
+        super().__init__(daemon=True)
+        self.auto_clean_handler = auto_clean_handler
+        self.force = force
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        try:
+            self.auto_clean_handler.activate_selected_AC(force=self.force,
+                                                         progress=lambda p: self.events.put(('progress', p)),
+                                                         cancel_event=self.cancel_event)
+            self.events.put(('cancelled' if self.cancel_event.is_set() else 'done', None))
+        except Exception as e:
+            self.auto_clean_handler.db_handler.log_error(f"Error running AutoClean: {str(e)}")
+            self.events.put(('error', str(e)))
+
+    def cancel(self):
+        self.cancel_event.set()
+
 
 class AutoCleanHandler:
     def __init__(self):
@@ -18,34 +137,39 @@ class AutoCleanHandler:
         self.clean_duplicate_files_flag = None
         self.clean_unused_files_flag = None
         self.clean_empty_folders_flag = None
+        self.hash_algorithm = 'md5'
+        self.hash_workers = DEFAULT_WORKERS
+        self.incremental_flag = False
         self.db_handler = DatabaseHandler()
+        self.settings = get_settings_store(self.db_handler)
+        self.hash_cache = HashCache(self.db_handler)
+        self.duplicate_finder = DuplicateFinder(self.db_handler, hash_cache=self.hash_cache)
         self.is_running = False
+        self.clean_lock = threading.Lock()
         self.load_settings()
 
     def load_settings(self):
         try:
-            settings = self.db_handler.get_autoclean_settings()
-            if settings:
-                self.clean_empty_folders_flag = settings['clean_empty_folders_flag']
-                self.clean_unused_files_flag = settings['clean_unused_files_flag']
-                self.clean_duplicate_files_flag = settings['clean_duplicate_files_flag']
-                self.clean_recycling_bin_flag = settings['clean_recycling_bin_flag']
-                self.clean_browser_history_flag = settings['clean_browser_history_flag']
-                self.frequency = settings['autoclean_frequency']
-                next_cleaning_time_str = settings['next_cleaning_time']
-                self.next_cleaning_time = datetime.datetime.fromisoformat(
-                    next_cleaning_time_str) if next_cleaning_time_str else None
-            else:
-                self.clean_empty_folders_flag = False
-                self.clean_unused_files_flag = False
-                self.clean_duplicate_files_flag = False
-                self.clean_recycling_bin_flag = False
-                self.clean_browser_history_flag = False
+            settings = self.settings.get_autoclean()
+            self.clean_empty_folders_flag = settings['clean_empty_folders_flag']
+            self.clean_unused_files_flag = settings['clean_unused_files_flag']
+            self.clean_duplicate_files_flag = settings['clean_duplicate_files_flag']
+            self.clean_recycling_bin_flag = settings['clean_recycling_bin_flag']
+            self.clean_browser_history_flag = settings['clean_browser_history_flag']
+            self.frequency = settings['autoclean_frequency']
+            next_cleaning_time_str = settings['next_cleaning_time']
+            self.next_cleaning_time = datetime.datetime.fromisoformat(
+                next_cleaning_time_str) if next_cleaning_time_str else None
+            self.hash_algorithm = settings['hash_algorithm'] or self.hash_algorithm
+            self.hash_workers = settings['hash_workers'] or self.hash_workers
+            self.incremental_flag = bool(settings['incremental_flag'])
+            self.duplicate_finder.configure(self.hash_algorithm, self.hash_workers)
         except Exception as e:
             self.db_handler.log_error(f"Error loading settings: {str(e)}")
 
     def save_settings(self):
-        self.db_handler.update_clean_flags(
+        # only updates the in-memory store, which writes to peanut.db shortly after
+        self.settings.update_autoclean(
             clean_empty_folders_flag=self.clean_empty_folders_flag,
             clean_unused_files_flag=self.clean_unused_files_flag,
             clean_duplicate_files_flag=self.clean_duplicate_files_flag,
@@ -55,10 +179,34 @@ class AutoCleanHandler:
             next_cleaning_time=self.next_cleaning_time.isoformat() if self.next_cleaning_time else None
         )
 
+    def set_hash_settings(self, algorithm=None, workers=None):
+        self.duplicate_finder.configure(algorithm, workers)
+        self.hash_algorithm = self.duplicate_finder.algorithm
+        self.hash_workers = self.duplicate_finder.workers
+        self.settings.update_autoclean(hash_algorithm=self.hash_algorithm, hash_workers=self.hash_workers)
+
+    def set_incremental(self, value):
+        self.incremental_flag = bool(value)
+        self.settings.update_autoclean(incremental_flag=self.incremental_flag)
+        if self.incremental_flag:
+            self.start_watching()
+        else:
+            self.stop_watching()
+
+    def start_watching(self):
+        for directory in self.get_directories():
+            directory_watcher.watch(f"autoclean:{directory}", directory,
+                                    DirtyPathJournal(self.db_handler, directory))
+
+    def stop_watching(self):
+        directory_watcher.unwatch_all("autoclean:")
+
     def set_clean_frequency(self, frequency):
         self.frequency = frequency
         self.update_next_cleaning_time()
         self.save_settings()
+        if self.is_running:
+            self.schedule_next_cleaning()
 
     def update_next_cleaning_time(self):
         now = datetime.datetime.now()
@@ -101,84 +249,143 @@ class AutoCleanHandler:
         self.clean_browser_history_flag = value
         self.save_settings()
 
-    def activate_selected_AC(self, force=False):
-        if force or (self.next_cleaning_time and datetime.datetime.now() >= self.next_cleaning_time):
+    def activate_selected_AC(self, force=False, progress=None, cancel_event=None):
+        if not (force or (self.next_cleaning_time and datetime.datetime.now() >= self.next_cleaning_time)):
+            return
+        # the scheduler and the Clean Now button must never clean at the same time
+        if not self.clean_lock.acquire(blocking=False):
+            print("Cleaning already in progress...")
+            return
+        try:
             print("Cleaning started...")
             self.previous_cleaning_time = datetime.datetime.now()
-            self.save_settings()
             self.update_next_cleaning_time()
             self.save_settings()
 
-            directories = [
-                r"C:\Users\nnawh\OneDrive\Desktop",
-                os.path.join(self.user_home_directory, 'Downloads'),
-                os.path.join(self.user_home_directory, 'Desktop'),
-                os.path.join(self.user_home_directory, 'AppData', 'Local', 'Temp')
-            ]
+            policies = self.get_policies()
 
+            # every enabled cleaner shares a single walk of each directory
+            visitors = []
+            unused_file_visitor = None
+            if self.clean_unused_files_flag:
+                unused_file_visitor = UnusedFileVisitor(self.db_handler)
+                visitors.append(unused_file_visitor)
+            if self.clean_duplicate_files_flag:
+                self.duplicate_finder.reset_stats()
+                self.hash_cache.reset_stats()
+                visitors.append(DuplicateFileVisitor(self.db_handler, self.duplicate_finder))
             if self.clean_empty_folders_flag:
-                for directory in directories:
-                    self.clean_empty_folders(directory)
+                empty_folder_visitor = EmptyFolderVisitor(self.db_handler)
+                visitors.append(empty_folder_visitor)
+
+            if visitors:
+                scanner = DirectoryScanner(self.db_handler, visitors, cancel_event=cancel_event)
+                if progress:
+                    scanner.on_progress = lambda s, directory: progress(self.progress_event(s, directory))
+                for policy, unused_days in policies:
+                    if scanner.cancelled:
+                        break
+                    directory = policy.root_directory
+                    scanner.policy = policy
+                    if unused_file_visitor:
+                        unused_file_visitor.days = unused_days
+                    if self.incremental_flag and not self.full_scan_due(directory):
+                        self.scan_incremental(directory, visitors, scanner)
+                    else:
+                        self.scan_full(directory, visitors, scanner)
 
-            if self.clean_unused_files_flag:
-                for directory in directories:
-                    self.clean_unused_files(directory)
+            if self.clean_empty_folders_flag:
+                print(empty_folder_visitor.report())
 
             if self.clean_duplicate_files_flag:
-                for directory in directories:
-                    self.clean_duplicate_files(directory)
+                self.hash_cache.evict()
+                print(f"Duplicate scan:\n{self.duplicate_finder.report()}")
+                print(self.hash_cache.report())
+
+            if cancel_event is not None and cancel_event.is_set():
+                print("Cleaning cancelled.")
+                return
 
             if self.clean_recycling_bin_flag:
                 self.clean_recycling_bin()
 
             if self.clean_browser_history_flag:
                 self.clean_browser_history()
+        finally:
+            self.db_handler.flush_logs()
+            self.clean_lock.release()
+
+    def get_policies(self):
+        # the AutoCleanPolicies table decides which folders are cleaned, what is skipped and how old is unused
+        return [(ScanPolicy(policy['root'], policy['include_globs'], policy['exclude_globs'], policy['max_depth'],
+                            policy['follow_symlinks']), policy['unused_days'] or UNUSED_FILE_DAYS)
+                for policy in self.db_handler.get_autoclean_policies()]
+
+    def get_directories(self):
+        return [policy.root_directory for policy, _ in self.get_policies()]
+
+    def full_scan_due(self, root_directory):
+        watching_since = directory_watcher.watching_since(f"autoclean:{root_directory}")
+        last_full_scan = self.db_handler.get_last_full_scan(root_directory)
+        if not watching_since or not last_full_scan or last_full_scan < watching_since:
+            return True  # changes made while nothing was watching were never journaled
+        return datetime.datetime.now() - last_full_scan >= datetime.timedelta(days=FULL_SCAN_DAYS)
+
+    def scan_full(self, root_directory, visitors, scanner):
+        started = datetime.datetime.now()
+        scanner.visitors = visitors
+        self.scan_directory(root_directory, visitors, scanner)
+        if not scanner.cancelled:
+            self.db_handler.update_last_full_scan(root_directory, started)
+            self.db_handler.clear_dirty_paths(root_directory, started.isoformat())
+
+    def scan_incremental(self, root_directory, visitors, scanner):
+        # unused files are found by age rather than by change, so they wait for the next full scan
+        started = datetime.datetime.now()
+        targets = []
+        for directory, recursive in sorted(self.db_handler.get_dirty_paths(root_directory)):
+            if scanner.policy is not None and not scanner.policy.allows_path(directory):
+                continue  # a change inside a pruned subtree, e.g. node_modules
+            if any(covered and directory.startswith(os.path.join(ancestor, '')) for ancestor, covered in targets):
+                continue  # already covered by a dirty ancestor
+            targets.append((directory, recursive))
+        print(f"Incremental clean of {root_directory}: {len(targets)} changed directories")
+        if targets:
+            scanner.visitors = [visitor for visitor in visitors if not isinstance(visitor, UnusedFileVisitor)]
+            self.scan_directory(root_directory, scanner.visitors, scanner, targets)
+        if not scanner.cancelled:
+            self.db_handler.clear_dirty_paths(root_directory, started.isoformat())
+
+    def progress_event(self, scanner, directory):
+        stats = self.duplicate_finder.stats
+        return {
+            'directory': directory,
+            'files_scanned': scanner.files_scanned,
+            'bytes_hashed': stats['partial']['bytes_read'] + stats['full']['bytes_read'],
+            'items_removed': scanner.items_removed
+        }
 
-    def clean_empty_folders(self, root_directory):
+    def scan_directory(self, root_directory, visitors, scanner=None, targets=None):
         try:
-            for root, dirs, _ in os.walk(root_directory):
-                for d in dirs:
-                    folder_path = os.path.join(root, d)
-                    if not os.listdir(folder_path):
-                        print(f"Deleting empty folder: {folder_path}")
-                        os.rmdir(folder_path)
+            (scanner or DirectoryScanner(self.db_handler, visitors)).scan(root_directory, targets)
         except Exception as e:
-            self.db_handler.log_error(f"Error cleaning empty folders in {root_directory}: {str(e)}")
+            self.db_handler.log_error(f"Error cleaning {root_directory}: {str(e)}")
 
+    def clean_empty_folders(self, root_directory):
+        empty_folder_visitor = EmptyFolderVisitor(self.db_handler)
+        self.scan_directory(root_directory, [empty_folder_visitor])
+        print(empty_folder_visitor.report())
+        return empty_folder_visitor.removed
 
     def clean_unused_files(self, root_directory):
-        try:
-            threshold = datetime.datetime.now() - datetime.timedelta(days=90)
-            for root, _, files in os.walk(root_directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if os.path.getatime(file_path) < threshold.timestamp():
-                        os.remove(file_path)
-        except Exception as e:
-            self.db_handler.log_error(f"Error cleaning unused files in {root_directory}: {str(e)}")
+        self.scan_directory(root_directory, [UnusedFileVisitor(self.db_handler)])
 
     def clean_duplicate_files(self, root_directory):
-        try:
-            seen_files = {}
-            for root, _, files in os.walk(root_directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_hash = self.hash_file(file_path)
-                    if file_hash in seen_files:
-                        os.remove(file_path)
-                    else:
-                        seen_files[file_hash] = file_path
-        except Exception as e:
-            self.db_handler.log_error(f"Error cleaning duplicate files in {root_directory}: {str(e)}")
-
+        self.scan_directory(root_directory, [DuplicateFileVisitor(self.db_handler, self.duplicate_finder)])
 
     def hash_file(self, file_path):
         try:
-            hash_md5 = hashlib.md5()
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+            return self.duplicate_finder.hash_full(file_path, os.path.getsize(file_path))
         except Exception as e:
             self.db_handler.log_error(f"Error hashing file {file_path}: {str(e)}")
             return None
@@ -215,27 +422,36 @@ class AutoCleanHandler:
 
     def run_auto_cleaning(self):
         if not self.is_running:
-            self.activate_selected_AC()
+            return
+        self.activate_selected_AC()
+        if self.next_cleaning_time and self.next_cleaning_time <= datetime.datetime.now():
+            # a Clean Now run held the lock; look again later instead of firing straight back
+            scheduler.at('autoclean:clean', time.time() + CLEAN_RETRY_MINUTES * 60, self.run_auto_cleaning)
+        else:
+            self.schedule_next_cleaning()
 
     def schedule_cleaning(self, frequency):
         self.set_clean_frequency(frequency)
-        schedule.every().day.at("05:00").do(self.run_auto_cleaning).tag('auto_clean')
+        self.schedule_next_cleaning()
 
-        def scheduler_thread():
-            while self.is_running:  # Keep checking if the scheduler is active
-                schedule.run_pending()
-                time.sleep(1)
-
-        # If a thread is already running, don't start a new one
-        if not hasattr(self, 'scheduler_thread') or not self.scheduler_thread.is_alive():
-            self.scheduler_thread = threading.Thread(target=scheduler_thread, daemon=True)
-            self.scheduler_thread.start()
+    def schedule_next_cleaning(self):
+        # one job at the persisted next_cleaning_time; if that passed while Peanut was closed it runs at once
+        if self.frequency and self.frequency != 'never' and not self.next_cleaning_time:
+            self.update_next_cleaning_time()
+            self.save_settings()
+        if self.next_cleaning_time:
+            scheduler.at('autoclean:clean', self.next_cleaning_time, self.run_auto_cleaning)
+        else:
+            scheduler.cancel('autoclean:clean')
 
     def pause_operations(self):
         self.is_running = False
-        schedule.clear('auto_clean')
+        scheduler.cancel_all('autoclean:')
+        self.stop_watching()
 
     def resume_operations(self):
         if not self.is_running:
             self.is_running = True
-            self.schedule_cleaning(self.frequency)
+            self.schedule_next_cleaning()
+            if self.incremental_flag:
+                self.start_watching()
@@ -1,13 +1,98 @@
 import os
-import shutil
-import schedule
+import time
+import threading
+from collections import deque
+from pathlib import Path
+from watchdog.events import FileSystemEventHandler
 from database import DatabaseHandler
+from settings import get_settings_store
+from journal import OperationJournal
+from watcher import directory_watcher
+from scheduler import scheduler
+
+DEBOUNCE_SECONDS = 2.0  # a file must be quiet this long before it is moved
+SETTLE_BATCH_SHARE = 0.25  # part of the debounce window by which a file may settle early to join a batch
+MAX_SETTLE_ATTEMPTS = 5  # retries for files that are still locked by the program writing them
+RECONCILE_MINUTES = 60  # full rescan that only catches events the watcher missed
+
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over every keyword of a source folder, so a file name is scanned once
+    # no matter how many rules share that folder
+    def __init__(self, redirects):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        # precedence: the longest keyword wins, ties go to the rule that was created first; an empty keyword
+        # matches every file, like `'' in file` always did, and so only applies when nothing else does
+        self.redirects = sorted(redirects, key=lambda r: (-len(r[1] or ''), r[0]))
+        for rank, redirect in enumerate(self.redirects):
+            self.add_keyword(redirect[1] or '', rank)
+        self.build_failure_links()
+
+    def add_keyword(self, keyword, rank):
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(rank)
+
+    def build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def matches(self, name):
+        ranks = set(self.output[0])
+        state = 0
+        for char in name:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            ranks.update(self.output[state])
+        return [self.redirects[rank] for rank in sorted(ranks)]
+
+
+class RedirectEventHandler(FileSystemEventHandler):
+    def __init__(self, auto_direct_handler):
+        self.auto_direct_handler = auto_direct_handler
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.auto_direct_handler.queue_file(event.src_path)
+
+    def on_modified(self, event):
+        # a file that is still being written keeps pushing its debounce window back
+        if not event.is_directory:
+            self.auto_direct_handler.queue_file(event.src_path, only_if_pending=True)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.auto_direct_handler.queue_file(event.dest_path)
+
 
 class AutoDirectHandler:
-    def __init__(self):
+    def __init__(self, watch=True):
+        self.watch = watch  # one-shot runs only reconcile and never start watchers
         self.db_handler = DatabaseHandler()
+        self.settings = get_settings_store(self.db_handler)
+        self.journal = OperationJournal(self.db_handler)
         self.redirects = self.db_handler.get_redirects()
         self.is_paused = False
+        self.pending_files = {}  # path -> (monotonic time it settles at, failed attempts)
+        self.pending_condition = threading.Condition()
+        self.settle_thread = None
         self.load_scheduled_redirects()
         self.file_mappings = []
         self.paused = False
@@ -22,36 +107,150 @@ class AutoDirectHandler:
     def clear_mappings(self):
         self.file_mappings = []
 
+    def resolve_directory(self, directory):
+        # the AutoDirect tab stores folder labels rather than paths for its source folders
+        home = str(Path.home())
+        if directory in ("Downloads", "Desktop"):
+            return os.path.join(home, directory)
+        if directory.lower().startswith("custom folder "):
+            return self.settings.get_custom_folder_path(directory.split()[-1]) or directory
+        return directory
+
     def load_scheduled_redirects(self):
-        schedule.clear()
+        # only AutoDirect's own jobs are replaced, AutoClean's schedule is left alone
+        scheduler.cancel_all('autodirect:')
         self.redirects = self.db_handler.get_redirects()
+        self.compile_redirects()
+        if not self.watch:
+            return
+        # one reconcile walk per source folder serves every rule reading from it
+        for from_directory in self.matchers:
+            # the first walk runs straight away for files that arrived while Peanut was not running
+            scheduler.every(f'autodirect:reconcile:{from_directory}', RECONCILE_MINUTES * 60,
+                            self.reconcile_directory, from_directory, first_run=time.time())
+        self.watch_redirects()
+
+    def compile_redirects(self):
+        by_source = {}
         for redirect in self.redirects:
-            schedule.every(10).minutes.do(self.check_redirect, redirect)
+            by_source.setdefault(self.resolve_directory(redirect[2]), []).append(redirect)
+        self.matchers = {from_directory: KeywordMatcher(redirects) for from_directory, redirects in by_source.items()}
 
-    def check_redirect(self, redirect):
+    def watch_redirects(self):
+        directory_watcher.unwatch_all("autodirect:")
+        for from_directory in self.matchers:
+            directory_watcher.watch(f"autodirect:{from_directory}", from_directory, RedirectEventHandler(self))
+
+    def queue_file(self, file_path, only_if_pending=False):
         if self.is_paused:
             return
+        with self.pending_condition:
+            if only_if_pending and file_path not in self.pending_files:
+                return
+            attempts = self.pending_files.get(file_path, (0, 0))[1]
+            self.pending_files[file_path] = (time.monotonic() + DEBOUNCE_SECONDS, attempts)
+            if self.settle_thread is None:
+                self.settle_thread = threading.Thread(target=self.settle_files, daemon=True, name='peanut-autodirect')
+                self.settle_thread.start()
+            self.pending_condition.notify()
 
-        keyword, from_directory, to_directory = redirect[1], redirect[2], redirect[3]
-        # if one of the files does not exist, skip this redirect and
-        if not os.path.exists(from_directory) or not os.path.exists(to_directory):
-            return
+    def settle_files(self):
+        # one worker moves every file that went quiet in the same debounce window as a single journaled batch;
+        # files that settle a moment later are taken along instead of becoming a batch of their own
+        while True:
+            with self.pending_condition:
+                now = time.monotonic()
+                deadline = min((deadline for deadline, _ in self.pending_files.values()), default=None)
+                if deadline is None or deadline > now:
+                    self.pending_condition.wait(None if deadline is None else deadline - now)
+                    continue
+                due = {path: attempts for path, (deadline, attempts) in self.pending_files.items()
+                       if deadline <= now + DEBOUNCE_SECONDS * SETTLE_BATCH_SHARE}
+                for path in due:
+                    del self.pending_files[path]
+            try:
+                self.route_files(due)
+            except Exception as e:
+                self.db_handler.log_error(f"Error redirecting {len(due)} files: {str(e)}")
 
-        # log action for later use in error handling and displaying error messages
-        for root, _, files in os.walk(from_directory):
+    def route_files(self, files):
+        # files maps each path to the number of times it could not be moved yet
+        if self.is_paused:
+            return {}
+        steps = []
+        planned = set()
+        for file_path in files:
+            matcher = self.matcher_for(file_path)
+            if matcher is None or not os.path.isfile(file_path):
+                continue
+            to_directory = self.destination_for(file_path, matcher)
+            if to_directory is not None:
+                dst_path = self.resolve_conflicts(os.path.join(to_directory, os.path.basename(file_path)), planned)
+                planned.add(dst_path)
+                steps.append(('move', file_path, dst_path))
+        if not steps:
+            return {}
+        operation_id, counts = self.journal.run("redirect", steps)
+        if counts.get('failed'):
+            for _, _, src_path, _ in self.db_handler.get_operation_steps(operation_id, 'failed'):
+                # usually still locked by the program writing it, tried again after another debounce window
+                if os.path.exists(src_path) and files.get(src_path, 0) + 1 < MAX_SETTLE_ATTEMPTS:
+                    with self.pending_condition:
+                        self.pending_files[src_path] = (time.monotonic() + DEBOUNCE_SECONDS, files[src_path] + 1)
+                        self.pending_condition.notify()
+        return counts
+
+    def matcher_for(self, file_path):
+        # the most specific source folder containing the file decides where it goes
+        for from_directory in sorted(self.matchers, key=len, reverse=True):
+            if file_path.startswith(os.path.join(from_directory, '')):
+                return self.matchers[from_directory]
+        return None
+
+    def destination_for(self, file_path, matcher):
+        for redirect in matcher.matches(os.path.basename(file_path)):
+            to_directory = redirect[3]
+            if not os.path.exists(to_directory):
+                continue
+            if file_path.startswith(os.path.join(to_directory, '')):
+                return None  # already where its best rule sends it
+            return to_directory
+        return None
+
+    def reconcile_directory(self, from_directory):
+        if self.is_paused or not os.path.exists(from_directory):
+            return {}
+        matcher = self.matchers[from_directory]
+        # the whole walk becomes one journaled operation, so an interrupted reconcile is resumed as a whole
+        steps = []
+        planned = set()
+        for root, dirs, files in os.walk(from_directory):
+            # a nested source folder belongs to its own rules, the same way matcher_for picks the deepest source
+            dirs[:] = [d for d in dirs if os.path.join(root, d) not in self.matchers]
             for file in files:
-                if keyword in file:
-                    src_path = os.path.join(root, file)
-                    dst_path = os.path.join(to_directory, file)
-                    dst_path = self.resolve_conflicts(dst_path)
-                    shutil.move(src_path, dst_path)
-                    self.db_handler.log_action("redirect", src_path, dst_path)
-
-    def resolve_conflicts(self, dst_path):
-        if os.path.exists(dst_path):
+                file_path = os.path.join(root, file)
+                try:
+                    to_directory = self.destination_for(file_path, matcher)
+                    if to_directory is not None:
+                        dst_path = self.resolve_conflicts(os.path.join(to_directory, file), planned)
+                        planned.add(dst_path)
+                        steps.append(('move', file_path, dst_path))
+                except Exception as e:
+                    self.db_handler.log_error(f"Error redirecting {file_path}: {str(e)}")
+        counts = {}
+        if steps:
+            _, counts = self.journal.run("redirect", steps)
+        self.db_handler.flush_logs()
+        return counts
+
+    def reconcile_all(self):
+        return {from_directory: self.reconcile_directory(from_directory) for from_directory in self.matchers}
+
+    def resolve_conflicts(self, dst_path, planned=()):
+        if os.path.exists(dst_path) or dst_path in planned:
             base, ext = os.path.splitext(dst_path)
             i = 1
-            while os.path.exists(f"{base} ({i}){ext}"):
+            while os.path.exists(f"{base} ({i}){ext}") or f"{base} ({i}){ext}" in planned:
                 i += 1
             dst_path = f"{base} ({i}){ext}"
         return dst_path
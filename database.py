@@ -1,15 +1,191 @@
+import os
+import time
+import atexit
 import sqlite3
 import datetime
+import threading
+
+LOG_BATCH_SIZE = 500  # buffered log rows that force a flush
+LOG_FLUSH_SECONDS = 1.0  # longest a log row waits in memory
+LOG_MAX_AGE_DAYS = 180  # log rows older than this are dropped at startup
+LOG_MAX_ROWS = 1000000  # newest rows kept per log table
+OPERATION_MAX_AGE_DAYS = 90  # finished journal operations older than this are dropped, long after staging is purged
+BUSY_TIMEOUT_SECONDS = 10.0
+CACHED_STATEMENTS = 256  # compiled statements kept per connection, enough for every query in this module
+CACHE_SIZE_KB = 8192
+# subtrees AutoClean never walks into unless a policy says otherwise
+DEFAULT_EXCLUDE_GLOBS = ['node_modules', '.git', '__pycache__', '.cache', '.venv']
+
+local_connections = threading.local()
+initialized_files = set()
+initialized_files_lock = threading.Lock()
+
+
+def connect(db_file):
+    # one long-lived connection per thread and database file; WAL lets the UI read while a scheduler thread writes
+    connections = getattr(local_connections, 'connections', None)
+    if connections is None:
+        connections = local_connections.connections = {}
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS, cached_statements=CACHED_STATEMENTS)
+        conn.execute('''PRAGMA journal_mode = WAL''')
+        conn.execute('''PRAGMA synchronous = NORMAL''')
+        conn.execute(f'''PRAGMA cache_size = -{CACHE_SIZE_KB}''')
+        conn.execute('''PRAGMA temp_store = MEMORY''')
+        connections[db_file] = conn
+    elif conn.in_transaction:
+        # an earlier call on this thread failed before it could commit; printed, since logging it would write
+        # through this same connection
+        print(f"Rolling back a transaction left open on {threading.current_thread().name} ({db_file})")
+        conn.rollback()
+    return conn
+
+
+class DelayedWrites:
+    # the debounced flushes of logs, settings, dirty paths and index updates all run on this one long-lived
+    # thread, so they reuse its connections instead of each threading.Timer opening and setting up a new one
+    def __init__(self):
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, key, delay, function, restart=True):
+        # restart pushes back a write that is already waiting, which is how bursts are debounced
+        with self.condition:
+            if key in self.pending and not restart:
+                return
+            self.pending[key] = (time.monotonic() + delay, function)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name='peanut-writer')
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, key):
+        with self.condition:
+            self.pending.pop(key, None)
+
+    def run(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                due = [key for key, (deadline, _) in self.pending.items() if deadline <= now]
+                if not due:
+                    deadline = min((deadline for deadline, _ in self.pending.values()), default=None)
+                    self.condition.wait(None if deadline is None else deadline - now)
+                    continue
+                functions = [self.pending.pop(key)[1] for key in due]
+            for function in functions:
+                try:
+                    function()
+                except Exception as e:
+                    print(f"Delayed write failed: {e}")
+
+
+# one writer thread per process, shared by every buffer and store
+delayed_writes = DelayedWrites()
+
+
+class LogBuffer:
+    # log rows are written in one transaction per batch instead of one commit per row
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.actions = []
+        self.errors = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def add_action(self, row):
+        self.add(self.actions, row)
+
+    def add_error(self, row):
+        self.add(self.errors, row)
+
+    def add(self, rows, row):
+        with self.lock:
+            rows.append(row)
+            full = len(self.actions) + len(self.errors) >= LOG_BATCH_SIZE
+            if not full:
+                delayed_writes.schedule(self, LOG_FLUSH_SECONDS, self.flush, restart=False)
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                actions, self.actions = self.actions, []
+                errors, self.errors = self.errors, []
+                delayed_writes.cancel(self)
+            if not actions and not errors:
+                return
+            # logging must never take down the operation it is logging, so failures are only printed
+            try:
+                conn = connect(self.db_file)
+                c = conn.cursor()
+                if errors:
+                    c.executemany('''INSERT INTO ErrorLogs (timestamp, description) VALUES (?, ?)''', errors)
+                if actions:
+                    c.executemany('''INSERT INTO ActionLogs (action_type, src_path, dst_path, timestamp, success)
+                                     VALUES (?, ?, ?, ?, ?)''', actions)
+                conn.commit()
+            except sqlite3.Error as e:
+                print(f"Failed to write {len(actions) + len(errors)} log rows: {e}")
+
+
+log_buffers = {}
+log_buffers_lock = threading.Lock()
+
+
+def get_log_buffer(db_file):
+    # every DatabaseHandler on the same file shares one buffer
+    with log_buffers_lock:
+        if db_file not in log_buffers:
+            log_buffers[db_file] = LogBuffer(db_file)
+        return log_buffers[db_file]
+
+
+@atexit.register
+def flush_all_logs():
+    for log_buffer in list(log_buffers.values()):
+        log_buffer.flush()
+
 
 class DatabaseHandler:
     def __init__(self):
         self.db_file = 'peanut.db'
-        self.create_tables()
+        # handlers are created by every tab and worker, but the schema only needs checking once per file
+        with initialized_files_lock:
+            if self.db_file not in initialized_files:
+                self.create_tables()
+                initialized_files.add(self.db_file)
+        self.log_buffer = get_log_buffer(self.db_file)
 
     def create_tables(self):
-        conn = sqlite3.connect(self.db_file)
+        # every migration moves the schema up one version; PRAGMA user_version records how far a file got
+        conn = connect(self.db_file)
         c = conn.cursor()
+        c.execute('''PRAGMA user_version''')
+        version = c.fetchone()[0]
+        for target_version, migration in enumerate(self.migrations(), start=1):
+            if version < target_version:
+                c.execute('''BEGIN''')
+                migration(c)
+                c.execute(f'''PRAGMA user_version = {target_version}''')
+                conn.commit()
+        self.rotate_logs()
+
+    def migrations(self):
+        # append only: a released migration never changes, later fixes go into a new one
+        return [self.migrate_base_schema, self.migrate_autoclean_cache, self.migrate_action_logs,
+                self.migrate_operation_journal, self.migrate_disk_usage, self.migrate_autoclean_policies,
+                self.migrate_hash_cache_roots]
+
+    def add_column(self, c, table, column, definition):
+        c.execute(f'''PRAGMA table_info({table})''')
+        if column not in [row[1] for row in c.fetchall()]:
+            c.execute(f'''ALTER TABLE {table} ADD COLUMN {column} {definition}''')
 
+    def migrate_base_schema(self, c):
         c.execute('''CREATE TABLE IF NOT EXISTS UserSettings (
                         user_id INTEGER PRIMARY KEY,
                         status TEXT,
@@ -47,38 +223,144 @@ class DatabaseHandler:
                         folder_name TEXT
                      )''')
 
-        conn.commit()
-        conn.close()
+    def migrate_autoclean_cache(self, c):
+        self.add_column(c, 'AutoCleanSettings', 'hash_algorithm', 'TEXT')
+        self.add_column(c, 'AutoCleanSettings', 'hash_workers', 'INTEGER')
+        self.add_column(c, 'AutoCleanSettings', 'incremental_flag', 'BOOLEAN')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS FileHashes (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER,
+                        mtime_ns INTEGER,
+                        inode INTEGER,
+                        algorithm TEXT,
+                        partial_digest TEXT,
+                        full_digest TEXT,
+                        last_used TEXT
+                     )''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS DirtyPaths (
+                        path TEXT PRIMARY KEY,
+                        root TEXT,
+                        recursive BOOLEAN,
+                        timestamp TEXT
+                     )''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS AutoCleanScans (
+                        root TEXT PRIMARY KEY,
+                        last_full_scan TEXT
+                     )''')
+
+    def migrate_action_logs(self, c):
+        c.execute('''CREATE TABLE IF NOT EXISTS ActionLogs (
+                        action_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        action_type TEXT,
+                        src_path TEXT,
+                        dst_path TEXT,
+                        timestamp TEXT,
+                        success BOOLEAN DEFAULT 1
+                     )''')
+        self.add_column(c, 'ActionLogs', 'success', 'BOOLEAN DEFAULT 1')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_actionlogs_timestamp ON ActionLogs (timestamp)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_actionlogs_action_type ON ActionLogs (action_type)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_actionlogs_src_path ON ActionLogs (src_path)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_errorlogs_timestamp ON ErrorLogs (timestamp)''')
+
+    def migrate_operation_journal(self, c):
+        c.execute('''CREATE TABLE IF NOT EXISTS Operations (
+                        operation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        action_type TEXT,
+                        status TEXT,
+                        created_at TEXT,
+                        finished_at TEXT
+                     )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS OperationSteps (
+                        step_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        operation_id INTEGER,
+                        action TEXT,
+                        src_path TEXT,
+                        dst_path TEXT,
+                        status TEXT,
+                        error TEXT
+                     )''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_operationsteps_operation ON OperationSteps (operation_id, status)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_operations_status ON Operations (status)''')
+
+    def migrate_disk_usage(self, c):
+        c.execute('''CREATE TABLE IF NOT EXISTS DirectorySizes (
+                        root TEXT,
+                        path TEXT,
+                        mtime REAL,
+                        files_size INTEGER,
+                        file_count INTEGER,
+                        total_size INTEGER,
+                        PRIMARY KEY (root, path)
+                     )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS LargeFiles (
+                        root TEXT,
+                        path TEXT,
+                        directory TEXT,
+                        size INTEGER,
+                        PRIMARY KEY (root, path)
+                     )''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_directorysizes_total ON DirectorySizes (root, total_size)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_largefiles_directory ON LargeFiles (root, directory)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_largefiles_size ON LargeFiles (root, size)''')
+
+    def migrate_autoclean_policies(self, c):
+        # globs are stored one per line; NULL age and depth mean AutoClean's defaults and no limit
+        c.execute('''CREATE TABLE IF NOT EXISTS AutoCleanPolicies (
+                        policy_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        root TEXT UNIQUE,
+                        include_globs TEXT,
+                        exclude_globs TEXT,
+                        unused_days INTEGER,
+                        max_depth INTEGER,
+                        follow_symlinks BOOLEAN,
+                        enabled BOOLEAN
+                     )''')
+        # the folders AutoClean used to have hardcoded, for the current user
+        home = os.path.expanduser('~')
+        roots = [os.path.join(home, 'Downloads'), os.path.join(home, 'Desktop'),
+                 os.path.join(home, 'AppData', 'Local', 'Temp')]
+        c.executemany('''INSERT OR IGNORE INTO AutoCleanPolicies
+                         (root, include_globs, exclude_globs, unused_days, max_depth, follow_symlinks, enabled)
+                         VALUES (?, '', ?, NULL, NULL, 0, 1)''',
+                      [(root, '\n'.join(DEFAULT_EXCLUDE_GLOBS)) for root in roots])
+
+    def migrate_hash_cache_roots(self, c):
+        # when each root's cached digests were last used as a whole; prefix is the root with a trailing separator
+        c.execute('''CREATE TABLE IF NOT EXISTS FileHashRoots (
+                        prefix TEXT PRIMARY KEY,
+                        last_used TEXT
+                     )''')
 
     # System Settings
     def load_status(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute("SELECT status FROM UserSettings WHERE user_id = 1")
         result = c.fetchone()
-        conn.close()
         return result[0] if result else None
 
     def save_status(self, status):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute("INSERT OR REPLACE INTO UserSettings (user_id, status) VALUES (1, ?)", (status,))
         conn.commit()
-        conn.close()
 
     def get_user_settings(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT status, ui_size, theme FROM UserSettings WHERE user_id = 1''')
         settings = c.fetchone()
-        conn.close()
         if settings:
             return {'status': settings[0], 'ui_size': settings[1], 'theme': settings[2]}
         else:
             return None
 
     def update_user_settings(self, status=None, ui_size=None, theme=None):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
 
         if status is not None:
@@ -88,32 +370,28 @@ class DatabaseHandler:
         if theme is not None:
             c.execute('''UPDATE UserSettings SET theme = ? WHERE user_id = 1''', (theme,))
         conn.commit()
-        conn.close()
 
     # AutoClean
     def get_clean_frequency(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT frequency FROM AutoCleanSettings WHERE id = 1''')
         result = c.fetchone()
-        conn.close()
         return result[0] if result else None
 
     def update_clean_frequency(self, frequency):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''INSERT OR REPLACE INTO AutoCleanSettings (id, frequency) VALUES (1, ?)''', (frequency,))
         conn.commit()
-        conn.close()
 
     def get_clean_flags(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT clean_empty_folders_flag, clean_unused_files_flag, clean_duplicate_files_flag,
                             clean_recycling_bin_flag, clean_browser_history_flag
                      FROM AutoCleanSettings WHERE id = 1''')
         result = c.fetchone()
-        conn.close()
         return {
             'clean_empty_folders_flag': result[0],
             'clean_unused_files_flag': result[1],
@@ -124,40 +402,47 @@ class DatabaseHandler:
 
     def update_clean_flags(self, clean_empty_folders_flag, clean_unused_files_flag, clean_duplicate_files_flag,
                            clean_recycling_bin_flag, clean_browser_history_flag, autoclean_frequency, next_cleaning_time):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''
-            INSERT OR REPLACE INTO AutoCleanSettings (id, clean_empty_folders_flag, clean_unused_files_flag, 
-                                              clean_duplicate_files_flag, clean_recycling_bin_flag, 
-                                              clean_browser_history_flag, frequency, next_cleaning_time)
+            INSERT INTO AutoCleanSettings (id, clean_empty_folders_flag, clean_unused_files_flag, 
+                                           clean_duplicate_files_flag, clean_recycling_bin_flag, 
+                                           clean_browser_history_flag, frequency, next_cleaning_time)
             VALUES (1, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                clean_empty_folders_flag = excluded.clean_empty_folders_flag,
+                clean_unused_files_flag = excluded.clean_unused_files_flag,
+                clean_duplicate_files_flag = excluded.clean_duplicate_files_flag,
+                clean_recycling_bin_flag = excluded.clean_recycling_bin_flag,
+                clean_browser_history_flag = excluded.clean_browser_history_flag,
+                frequency = excluded.frequency,
+                next_cleaning_time = excluded.next_cleaning_time
         ''', (clean_empty_folders_flag, clean_unused_files_flag, clean_duplicate_files_flag, clean_recycling_bin_flag,
               clean_browser_history_flag, autoclean_frequency, next_cleaning_time))
         conn.commit()
-        conn.close()
 
     def get_next_cleaning_time(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT next_cleaning_time FROM AutoCleanSettings WHERE id = 1''')
         result = c.fetchone()
-        conn.close()
         return datetime.datetime.fromisoformat(result[0]) if result and result[0] else None
 
     def update_next_cleaning_time(self, next_cleaning_time):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''INSERT OR REPLACE INTO AutoCleanSettings (id, next_cleaning_time) VALUES (1, ?)''',
                   (next_cleaning_time.isoformat(),))
         conn.commit()
-        conn.close()
 
     def get_autoclean_settings(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
-        c.execute('SELECT * FROM AutoCleanSettings WHERE id = 1')
+        c.execute('''SELECT id, clean_empty_folders_flag, clean_unused_files_flag, clean_duplicate_files_flag,
+                            clean_recycling_bin_flag, clean_browser_history_flag, frequency, next_cleaning_time,
+                            hash_algorithm, hash_workers, incremental_flag
+                     FROM AutoCleanSettings WHERE id = 1''')
         row = c.fetchone()
-        conn.close()
         if row:
             return {
                 'clean_empty_folders_flag': row[1],
@@ -166,87 +451,443 @@ class DatabaseHandler:
                 'clean_recycling_bin_flag': row[4],
                 'clean_browser_history_flag': row[5],
                 'autoclean_frequency': row[6],
-                'next_cleaning_time': row[7]
+                'next_cleaning_time': row[7],
+                'hash_algorithm': row[8],
+                'hash_workers': row[9],
+                'incremental_flag': row[10]
             }
         return None
 
+    def update_hash_settings(self, hash_algorithm, hash_workers):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''INSERT INTO AutoCleanSettings (id, hash_algorithm, hash_workers) VALUES (1, ?, ?)
+                     ON CONFLICT(id) DO UPDATE SET hash_algorithm = excluded.hash_algorithm,
+                                                   hash_workers = excluded.hash_workers''',
+                  (hash_algorithm, hash_workers))
+        conn.commit()
+
     def add_redirect(self, keyword, from_directory, to_directory):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''INSERT INTO Redirects (keyword, from_directory, to_directory)
                      VALUES (?, ?, ?)''', (keyword, from_directory, to_directory))
         conn.commit()
-        conn.close()
 
     def get_redirects(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT * FROM Redirects''')
         redirects = c.fetchall()
-        conn.close()
         return redirects
 
     def delete_redirect(self, keyword, from_directory, to_directory):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''DELETE FROM Redirects WHERE keyword = ? AND from_directory = ? AND to_directory = ?''',
                   (keyword, from_directory, to_directory))
         conn.commit()
-        conn.close()
 
     def clear_all_redirects(self):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''DELETE FROM Redirects''')
         conn.commit()
-        conn.close()
 
     def get_custom_folder_path(self, folder_id):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('SELECT folder_path FROM CustomFolders WHERE folder_id = ?', (folder_id,))
         path = c.fetchone()
-        conn.close()
         return path[0] if path else None
 
     def update_custom_folder(self, index, folder_path, folder_name):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''INSERT OR REPLACE INTO CustomFolders (folder_id, folder_path, folder_name) VALUES (?, ?, ?)''',
                   (index, folder_path, folder_name))
         conn.commit()
-        conn.close()
+
+    def get_custom_folders(self):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT folder_id, folder_path, folder_name FROM CustomFolders''')
+        return {row[0]: (row[1], row[2]) for row in c.fetchall()}
+
+    def save_settings(self, autoclean=None, user=None, custom_folders=None):
+        # everything the settings store changed goes into a single transaction
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        if autoclean is not None:
+            c.execute('''
+                INSERT INTO AutoCleanSettings (id, clean_empty_folders_flag, clean_unused_files_flag,
+                                               clean_duplicate_files_flag, clean_recycling_bin_flag,
+                                               clean_browser_history_flag, frequency, next_cleaning_time,
+                                               hash_algorithm, hash_workers, incremental_flag)
+                VALUES (1, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    clean_empty_folders_flag = excluded.clean_empty_folders_flag,
+                    clean_unused_files_flag = excluded.clean_unused_files_flag,
+                    clean_duplicate_files_flag = excluded.clean_duplicate_files_flag,
+                    clean_recycling_bin_flag = excluded.clean_recycling_bin_flag,
+                    clean_browser_history_flag = excluded.clean_browser_history_flag,
+                    frequency = excluded.frequency,
+                    next_cleaning_time = excluded.next_cleaning_time,
+                    hash_algorithm = excluded.hash_algorithm,
+                    hash_workers = excluded.hash_workers,
+                    incremental_flag = excluded.incremental_flag
+            ''', (autoclean['clean_empty_folders_flag'], autoclean['clean_unused_files_flag'],
+                  autoclean['clean_duplicate_files_flag'], autoclean['clean_recycling_bin_flag'],
+                  autoclean['clean_browser_history_flag'], autoclean['autoclean_frequency'],
+                  autoclean['next_cleaning_time'], autoclean['hash_algorithm'], autoclean['hash_workers'],
+                  autoclean['incremental_flag']))
+        if user is not None:
+            c.execute('''INSERT OR REPLACE INTO UserSettings (user_id, status, ui_size, theme) VALUES (1, ?, ?, ?)''',
+                      (user['status'], user['ui_size'], user['theme']))
+        if custom_folders is not None:
+            c.executemany('''INSERT OR REPLACE INTO CustomFolders (folder_id, folder_path, folder_name) VALUES (?, ?, ?)''',
+                          [(index, path, name) for index, (path, name) in custom_folders.items()])
+        conn.commit()
 
     def get_custom_folder_name(self, index):
-        conn = sqlite3.connect(self.db_file)
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT folder_name FROM CustomFolders WHERE folder_id = ?''', (index,))
         result = c.fetchone()
-        conn.close()
         return result[0] if result else f"Custom folder {index}"
 
-    # Error Handling
-    def log_action(self, action_type, src_path, dst_path):
-        conn = sqlite3.connect(self.db_file)
+    def update_incremental_flag(self, incremental_flag):
+        conn = connect(self.db_file)
         c = conn.cursor()
-        timestamp = datetime.datetime.now().isoformat()
-        c.execute('''INSERT INTO ActionLogs (action_type, src_path, dst_path, timestamp)
-                     VALUES (?, ?, ?, ?)''', (action_type, src_path, dst_path, timestamp))
+        c.execute('''INSERT INTO AutoCleanSettings (id, incremental_flag) VALUES (1, ?)
+                     ON CONFLICT(id) DO UPDATE SET incremental_flag = excluded.incremental_flag''',
+                  (incremental_flag,))
         conn.commit()
-        conn.close()
 
-    def log_error(self, description):
-        conn = sqlite3.connect(self.db_file)
+    def add_dirty_paths(self, rows):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.executemany('''INSERT INTO DirtyPaths (path, root, recursive, timestamp) VALUES (?, ?, ?, ?)
+                         ON CONFLICT(path) DO UPDATE SET recursive = max(recursive, excluded.recursive),
+                                                         timestamp = excluded.timestamp''', rows)
+        conn.commit()
+
+    def get_dirty_paths(self, root):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT path, recursive FROM DirtyPaths WHERE root = ?''', (root,))
+        rows = c.fetchall()
+        return [(row[0], bool(row[1])) for row in rows]
+
+    def clear_dirty_paths(self, root, before):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''DELETE FROM DirtyPaths WHERE root = ? AND timestamp <= ?''', (root, before))
+        conn.commit()
+
+    def get_last_full_scan(self, root):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT last_full_scan FROM AutoCleanScans WHERE root = ?''', (root,))
+        result = c.fetchone()
+        return datetime.datetime.fromisoformat(result[0]) if result and result[0] else None
+
+    def update_last_full_scan(self, root, last_full_scan):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''INSERT OR REPLACE INTO AutoCleanScans (root, last_full_scan) VALUES (?, ?)''',
+                  (root, last_full_scan.isoformat()))
+        conn.commit()
+
+    # AutoClean Policies
+    def get_autoclean_policies(self, enabled_only=True):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        where = 'WHERE enabled = 1' if enabled_only else ''
+        c.execute(f'''SELECT root, include_globs, exclude_globs, unused_days, max_depth, follow_symlinks, enabled
+                      FROM AutoCleanPolicies {where} ORDER BY policy_id''')
+        return [{'root': row[0],
+                 'include_globs': [glob for glob in (row[1] or '').splitlines() if glob],
+                 'exclude_globs': [glob for glob in (row[2] or '').splitlines() if glob],
+                 'unused_days': row[3],
+                 'max_depth': row[4],
+                 'follow_symlinks': bool(row[5]),
+                 'enabled': bool(row[6])} for row in c.fetchall()]
+
+    def save_autoclean_policy(self, root, include_globs=(), exclude_globs=DEFAULT_EXCLUDE_GLOBS, unused_days=None,
+                              max_depth=None, follow_symlinks=False, enabled=True):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''INSERT INTO AutoCleanPolicies
+                     (root, include_globs, exclude_globs, unused_days, max_depth, follow_symlinks, enabled)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)
+                     ON CONFLICT(root) DO UPDATE SET include_globs = excluded.include_globs,
+                                                     exclude_globs = excluded.exclude_globs,
+                                                     unused_days = excluded.unused_days,
+                                                     max_depth = excluded.max_depth,
+                                                     follow_symlinks = excluded.follow_symlinks,
+                                                     enabled = excluded.enabled''',
+                  (root, '\n'.join(include_globs), '\n'.join(exclude_globs), unused_days, max_depth,
+                   int(follow_symlinks), int(enabled)))
+        conn.commit()
+
+    def remove_autoclean_policy(self, root):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''DELETE FROM AutoCleanPolicies WHERE root = ?''', (root,))
+        conn.commit()
+
+    # Hash Cache
+    def get_file_hashes(self, root_directory):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        prefix = os.path.join(root_directory, '')
+        c.execute('''SELECT path, size, mtime_ns, inode, algorithm, partial_digest, full_digest
+                     FROM FileHashes WHERE path >= ? AND path < ?''', (prefix, prefix + '\uffff'))
+        rows = c.fetchall()
+        return {
+            row[0]: {'size': row[1], 'mtime_ns': row[2], 'inode': row[3], 'algorithm': row[4],
+                     'partial_digest': row[5], 'full_digest': row[6]}
+            for row in rows
+        }
+
+    def save_file_hashes(self, rows):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        last_used = datetime.datetime.now().isoformat()
+        c.executemany('''INSERT OR REPLACE INTO FileHashes (path, size, mtime_ns, inode, algorithm,
+                                                            partial_digest, full_digest, last_used)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                      [(path, row['size'], row['mtime_ns'], row['inode'], row['algorithm'],
+                        row['partial_digest'], row['full_digest'], last_used) for path, row in rows.items()])
+        conn.commit()
+
+    def delete_file_hashes(self, paths):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.executemany('''DELETE FROM FileHashes WHERE path = ?''', [(path,) for path in paths])
+        conn.commit()
+
+    def touch_file_hashes(self, root_directory):
+        # one row per root instead of an update of every file below it; rows that were read are
+        # refreshed by save_file_hashes
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''INSERT OR REPLACE INTO FileHashRoots (prefix, last_used) VALUES (?, ?)''',
+                  (os.path.join(root_directory, ''), datetime.datetime.now().isoformat()))
+        conn.commit()
+
+    def evict_file_hashes(self, max_age_days):
+        # a row is kept while it was read recently or its root was scanned recently
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        threshold = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+        c.execute('''DELETE FROM FileHashes WHERE last_used < ? AND NOT EXISTS (
+                         SELECT 1 FROM FileHashRoots WHERE FileHashRoots.last_used >= ?
+                         AND FileHashes.path >= prefix AND FileHashes.path < prefix || ?)''',
+                  (threshold, threshold, '\uffff'))
+        evicted = c.rowcount
+        c.execute('''DELETE FROM FileHashRoots WHERE last_used < ?''', (threshold,))
+        conn.commit()
+        return evicted
+
+    # Operation Journal
+    def add_operation(self, action_type, steps, staging_root):
+        # the plan and its steps are stored together; deletes get a path in the operation's staging folder
+        # below staging_root(src_path), which picks a folder on the file's own drive
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''INSERT INTO Operations (action_type, status, created_at) VALUES (?, 'planned', ?)''',
+                  (action_type, datetime.datetime.now().isoformat()))
+        operation_id = c.lastrowid
+        rows = []
+        for index, (action, src_path, dst_path) in enumerate(steps):
+            if action == 'delete':
+                # the index keeps staged files with the same name apart
+                dst_path = os.path.join(staging_root(src_path), str(operation_id),
+                                        f"{index}_{os.path.basename(src_path)}")
+            rows.append((operation_id, action, src_path, dst_path))
+        c.executemany('''INSERT INTO OperationSteps (operation_id, action, src_path, dst_path, status)
+                         VALUES (?, ?, ?, ?, 'pending')''', rows)
+        conn.commit()
+        return operation_id
+
+    def get_operation(self, operation_id):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT operation_id, action_type, status, created_at, finished_at FROM Operations
+                     WHERE operation_id = ?''', (operation_id,))
+        row = c.fetchone()
+        return {'operation_id': row[0], 'action_type': row[1], 'status': row[2], 'created_at': row[3],
+                'finished_at': row[4]} if row else None
+
+    def get_operations(self, statuses=None, limit=20, action_types=None, created_before=None):
+        # limit=None returns every matching operation
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        conditions = []
+        parameters = []
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            parameters.extend(statuses)
+        if action_types:
+            conditions.append(f"action_type IN ({', '.join('?' * len(action_types))})")
+            parameters.extend(action_types)
+        if created_before:
+            conditions.append('created_at < ?')
+            parameters.append(created_before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        c.execute(f'''SELECT operation_id FROM Operations {where} ORDER BY operation_id DESC LIMIT ?''',
+                  parameters + [-1 if limit is None else limit])
+        return [self.get_operation(row[0]) for row in c.fetchall()]
+
+    def get_staging_directories(self, operation_id):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT DISTINCT dst_path FROM OperationSteps WHERE operation_id = ? AND action = 'delete' ''',
+                  (operation_id,))
+        return sorted({os.path.dirname(row[0]) for row in c.fetchall()})
+
+    def update_operation_status(self, operation_id, status, finished=False):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''UPDATE Operations SET status = ?, finished_at = ? WHERE operation_id = ?''',
+                  (status, datetime.datetime.now().isoformat() if finished else None, operation_id))
+        conn.commit()
+
+    def get_operation_steps(self, operation_id, status, after_step_id=0, limit=1000, reverse=False):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        if reverse:
+            c.execute('''SELECT step_id, action, src_path, dst_path FROM OperationSteps
+                         WHERE operation_id = ? AND status = ? AND step_id < ? ORDER BY step_id DESC LIMIT ?''',
+                      (operation_id, status, after_step_id or 2 ** 62, limit))
+        else:
+            c.execute('''SELECT step_id, action, src_path, dst_path FROM OperationSteps
+                         WHERE operation_id = ? AND status = ? AND step_id > ? ORDER BY step_id LIMIT ?''',
+                      (operation_id, status, after_step_id, limit))
+        return c.fetchall()
+
+    def update_operation_steps(self, rows):
+        # rows of (status, error, step_id), one transaction per executed chunk
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.executemany('''UPDATE OperationSteps SET status = ?, error = ? WHERE step_id = ?''', rows)
+        conn.commit()
+
+    def count_operation_steps(self, operation_id):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT status, COUNT(*) FROM OperationSteps WHERE operation_id = ? GROUP BY status''',
+                  (operation_id,))
+        return dict(c.fetchall())
+
+    # Disk Usage
+    def get_directory_sizes(self, root):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT path, mtime, files_size, file_count FROM DirectorySizes WHERE root = ?''', (root,))
+        return {row[0]: (row[1], row[2], row[3]) for row in c.fetchall()}
+
+    def save_directory_sizes(self, root, directories, rescanned, large_files, removed):
+        # one transaction per scan: every directory's totals, and the largest files of the directories
+        # that were listed again; unchanged directories keep the large files they already have
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.executemany('''INSERT OR REPLACE INTO DirectorySizes (root, path, mtime, files_size, file_count, total_size)
+                         VALUES (?, ?, ?, ?, ?, ?)''', [(root,) + row for row in directories])
+        c.executemany('''DELETE FROM DirectorySizes WHERE root = ? AND path = ?''',
+                      [(root, path) for path in removed])
+        c.executemany('''DELETE FROM LargeFiles WHERE root = ? AND directory = ?''',
+                      [(root, path) for path in list(rescanned) + list(removed)])
+        c.executemany('''INSERT OR REPLACE INTO LargeFiles (root, path, directory, size) VALUES (?, ?, ?, ?)''',
+                      [(root,) + row for row in large_files])
+        conn.commit()
+
+    def get_largest_directories(self, root, limit):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT path, total_size, file_count FROM DirectorySizes WHERE root = ? AND path != ?
+                     ORDER BY total_size DESC LIMIT ?''', (root, root, limit))
+        return c.fetchall()
+
+    def get_largest_files(self, root, limit):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        c.execute('''SELECT path, size FROM LargeFiles WHERE root = ? ORDER BY size DESC LIMIT ?''', (root, limit))
+        return c.fetchall()
+
+    def get_directory_total(self, root):
+        conn = connect(self.db_file)
         c = conn.cursor()
+        c.execute('''SELECT total_size FROM DirectorySizes WHERE root = ? AND path = ?''', (root, root))
+        result = c.fetchone()
+        return result[0] if result else None
+
+    # Error Handling
+    def log_action(self, action_type, src_path, dst_path, success=True):
+        timestamp = datetime.datetime.now().isoformat()
+        self.log_buffer.add_action((action_type, src_path, dst_path, timestamp, int(success)))
+
+    def log_error(self, description):
         timestamp = datetime.datetime.now().isoformat()
-        c.execute('''INSERT INTO ErrorLogs (timestamp, description) VALUES (?, ?)''', (timestamp, description))
+        self.log_buffer.add_error((timestamp, description))
+
+    def flush_logs(self):
+        # called at the end of bulk operations so their log is complete when they return
+        self.log_buffer.flush()
+
+    def rotate_operations(self, max_age_days=OPERATION_MAX_AGE_DAYS):
+        # finished operations and their steps are only kept for undo and for the report; interrupted ones stay
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        threshold = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+        old = '''SELECT operation_id FROM Operations
+                 WHERE status NOT IN ('planned', 'running') AND finished_at < ?'''
+        c.execute(f'''DELETE FROM OperationSteps WHERE operation_id IN ({old})''', (threshold,))
+        c.execute(f'''DELETE FROM Operations WHERE operation_id IN ({old})''', (threshold,))
+        removed = c.rowcount
         conn.commit()
-        conn.close()
+        return removed
+
+    def rotate_logs(self, max_age_days=LOG_MAX_AGE_DAYS, max_rows=LOG_MAX_ROWS):
+        # ids only grow, so keeping the newest rows is a range delete instead of a COUNT(*)
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        threshold = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+        removed = 0
+        for table, id_column in (('ActionLogs', 'action_id'), ('ErrorLogs', 'error_id')):
+            c.execute(f'''DELETE FROM {table} WHERE timestamp < ?''', (threshold,))
+            removed += c.rowcount
+            c.execute(f'''DELETE FROM {table} WHERE {id_column} <= (SELECT MAX({id_column}) FROM {table}) - ?''',
+                      (max_rows,))
+            removed += c.rowcount
+        conn.commit()
+        return removed
+
+    def get_action_logs(self, since=None, action_type=None, src_path=None, limit=100):
+        conn = connect(self.db_file)
+        c = conn.cursor()
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('timestamp >= ?')
+            params.append(since.isoformat())
+        if action_type is not None:
+            conditions.append('action_type = ?')
+            params.append(action_type)
+        if src_path is not None:
+            conditions.append('src_path = ?')
+            params.append(src_path)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        c.execute(f'''SELECT action_type, src_path, dst_path, timestamp, success FROM ActionLogs {where}
+                      ORDER BY action_id DESC LIMIT ?''', params + [limit])
+        return [{'action_type': row[0], 'src_path': row[1], 'dst_path': row[2], 'timestamp': row[3],
+                 'success': bool(row[4])} for row in c.fetchall()]
 
     def get_latest_error(self):
-        conn = sqlite3.connect(self.db_file)
+        self.flush_logs()
+        conn = connect(self.db_file)
         c = conn.cursor()
         c.execute('''SELECT description FROM ErrorLogs ORDER BY error_id DESC LIMIT 1''')
         result = c.fetchone()
-        conn.close()
         return {'description': result[0]} if result else None
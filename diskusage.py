@@ -0,0 +1,149 @@
+import os
+import heapq
+import queue
+import threading
+from pathlib import Path
+from database import DatabaseHandler
+from scanner import DirectoryScanner, ScanVisitor
+
+TOP_FILES_PER_DIRECTORY = 10  # largest files kept per directory; the global top-N is picked from these
+TOP_N = 20
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class DiskUsageVisitor(ScanVisitor):
+    # sizes are added up bottom-up as the scanner leaves each directory; a directory whose mtime has not
+    # changed since the last scan keeps its cached file sizes and its files are not stat'ed again.
+    # A file rewritten in place does not touch its directory's mtime, so a full rescan (force) picks those up
+    def __init__(self, db_handler, force=False, top_files=TOP_FILES_PER_DIRECTORY):
+        self.db_handler = db_handler
+        self.force = force
+        self.top_files = top_files
+        self.root_directory = None
+        self.cache = {}
+        self.directories = {}
+        self.largest_files = {}
+        self.child_totals = {}
+        self.reused = 0
+
+    def start(self, root_directory):
+        self.root_directory = root_directory
+        # a full rescan still needs the cached folders, to drop the ones that are gone
+        self.cache = self.db_handler.get_directory_sizes(root_directory)
+        self.directories = {}
+        self.largest_files = {}
+        self.child_totals = {}
+        self.reused = 0
+
+    def wants_files(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+        cached = None if self.force else self.cache.get(directory)
+        if cached and mtime is not None and cached[0] == mtime:
+            # [mtime, files_size, file_count, total_size]
+            self.directories[directory] = [mtime, cached[1], cached[2], 0]
+            self.reused += 1
+            return False
+        self.directories[directory] = [mtime, 0, 0, 0]
+        self.largest_files[directory] = []
+        return True
+
+    def visit_file(self, file_path, st):
+        directory = os.path.dirname(file_path)
+        record = self.directories[directory]
+        record[1] += st.st_size
+        record[2] += 1
+        largest = self.largest_files[directory]
+        if len(largest) < self.top_files:
+            heapq.heappush(largest, (st.st_size, file_path))
+        elif st.st_size > largest[0][0]:
+            heapq.heapreplace(largest, (st.st_size, file_path))
+        return False
+
+    def leave_directory(self, directory, entry_count, is_root):
+        record = self.directories.get(directory)
+        if record is None:
+            return False
+        record[3] = record[1] + self.child_totals.pop(directory, 0)
+        if not is_root:
+            parent = os.path.dirname(directory)
+            self.child_totals[parent] = self.child_totals.get(parent, 0) + record[3]
+        return False
+
+    def finish(self):
+        removed = [path for path in self.cache if path not in self.directories]
+        self.db_handler.save_directory_sizes(
+            self.root_directory,
+            [(path, mtime, files_size, file_count, total_size)
+             for path, (mtime, files_size, file_count, total_size) in self.directories.items()],
+            self.largest_files,
+            [(path, directory, size) for directory, largest in self.largest_files.items() for size, path in largest],
+            removed)
+
+    def report(self):
+        total = self.directories.get(self.root_directory, [0, 0, 0, 0])[3]
+        return {'root': self.root_directory, 'total_size': total, 'directories': len(self.directories),
+                'rescanned': len(self.directories) - self.reused, 'reused': self.reused}
+
+
+class DiskUsageWorker(threading.Thread):
+    # runs a scan off the UI thread; the UI polls `events` for ('progress' | 'done' | 'cancelled' | 'error', data)
+    def __init__(self, disk_usage_handler, root_directory, force=False):
+        super().__init__(daemon=True)
+        self.disk_usage_handler = disk_usage_handler
+        self.root_directory = root_directory
+        self.force = force
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        try:
+            report = self.disk_usage_handler.scan(self.root_directory, force=self.force,
+                                                  progress=lambda p: self.events.put(('progress', p)),
+                                                  cancel_event=self.cancel_event)
+            self.events.put(('cancelled', None) if self.cancel_event.is_set() else ('done', report))
+        except Exception as e:
+            self.disk_usage_handler.db_handler.log_error(f"Error scanning disk usage of {self.root_directory}: {str(e)}")
+            self.events.put(('error', str(e)))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class DiskUsageHandler:
+    def __init__(self):
+        self.db_handler = DatabaseHandler()
+
+    def default_directory(self):
+        return str(Path.home())
+
+    def scan(self, root_directory, force=False, progress=None, cancel_event=None):
+        # the same single walk AutoClean uses, with a visitor that only adds up sizes
+        root_directory = os.path.abspath(root_directory)
+        visitor = DiskUsageVisitor(self.db_handler, force=force)
+        scanner = DirectoryScanner(self.db_handler, [visitor], cancel_event=cancel_event)
+        if progress:
+            scanner.on_progress = lambda s, directory: progress({'directory': directory,
+                                                                 'directories_scanned': s.directories_scanned,
+                                                                 'files_scanned': s.files_scanned})
+        scanner.scan(root_directory)
+        return visitor.report()
+
+    def top_directories(self, root_directory, limit=TOP_N):
+        # (path, total_size, file_count) from the last scan of root_directory, largest first
+        return self.db_handler.get_largest_directories(os.path.abspath(root_directory), limit)
+
+    def top_files(self, root_directory, limit=TOP_N):
+        return self.db_handler.get_largest_files(os.path.abspath(root_directory), limit)
+
+    def total_size(self, root_directory):
+        return self.db_handler.get_directory_total(os.path.abspath(root_directory))
@@ -0,0 +1,356 @@
+import os
+import hashlib
+import mmap
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+SAMPLE_SIZE = 64 * 1024  # bytes read from the head and the tail of a file for the partial hash
+CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024  # files at least this big are hashed through mmap instead of readinto
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+HASH_CACHE_MAX_AGE_DAYS = 30  # cached digests not used for this long are evicted
+
+CachedStat = namedtuple('CachedStat', 'st_size st_mtime_ns st_ino')  # a file's stat as the hash cache last saw it
+
+HASH_ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'blake2s': hashlib.blake2s,
+}
+if xxhash:
+    HASH_ALGORITHMS['xxh3'] = xxhash.xxh3_128
+
+
+def available_algorithms():
+    return list(HASH_ALGORITHMS)
+
+
+class HashCache:
+    def __init__(self, db_handler, algorithm='md5'):
+        self.db_handler = db_handler
+        self.algorithm = algorithm
+        self.root_directory = None
+        self.entries = {}
+        self.dirty = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, root_directory):
+        self.root_directory = root_directory
+        self.entries = self.db_handler.get_file_hashes(root_directory)
+        self.dirty = {}
+
+    def matches(self, entry, st):
+        # DirEntry.stat() reports st_ino 0 on Windows, where os.stat() has the real one, so the inode is only
+        # compared when both sides know it; size and mtime_ns still have to match
+        return (entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+                and (not entry['inode'] or not st.st_ino or entry['inode'] == st.st_ino))
+
+    def known_files(self):
+        return list(self.entries.items())
+
+    def get(self, file_path, st, kind):
+        entry = self.entries.get(file_path)
+        if self.matches(entry, st) and entry['algorithm'] == self.algorithm and entry[f'{kind}_digest']:
+            self.hits += 1
+            self.dirty[file_path] = entry  # refresh last_used
+            return entry[f'{kind}_digest']
+        self.misses += 1
+        return None
+
+    def put(self, file_path, st, kind=None, digest=None):
+        entry = self.entries.get(file_path)
+        if not (self.matches(entry, st) and entry['algorithm'] == self.algorithm):
+            # the file changed since it was cached, so every digest stored for it is stale
+            entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino,
+                     'algorithm': self.algorithm, 'partial_digest': None, 'full_digest': None}
+            self.entries[file_path] = entry
+        if kind:
+            entry[f'{kind}_digest'] = digest
+        self.dirty[file_path] = entry
+
+    def save(self, walked=None):
+        if walked is not None:
+            # every walked file gets a row, even without a digest, so incremental cleans know its size
+            for path, st in walked.items():
+                if not self.matches(self.entries.get(path), st):
+                    self.put(path, st)
+        if self.dirty:
+            self.db_handler.save_file_hashes(self.dirty)
+        if walked is not None:
+            # rows for files that disappeared from the root since the last clean
+            missing = [path for path in self.entries if path not in walked]
+            if missing:
+                self.db_handler.delete_file_hashes(missing)
+            self.db_handler.touch_file_hashes(self.root_directory)
+        self.dirty = {}
+
+    def evict(self, max_age_days=HASH_CACHE_MAX_AGE_DAYS):
+        return self.db_handler.evict_file_hashes(max_age_days)
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def report(self):
+        return f"Hash cache: {self.hits} hits, {self.misses} misses"
+
+
+class DuplicateFinder:
+    def __init__(self, db_handler, sample_size=SAMPLE_SIZE, hash_cache=None, algorithm='md5',
+                 workers=DEFAULT_WORKERS):
+        self.db_handler = db_handler
+        self.sample_size = sample_size
+        self.hash_cache = hash_cache
+        self.algorithm = algorithm
+        self.workers = workers
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.local = threading.local()
+        self.reset_stats()
+        self.reset_state()
+
+    def configure(self, algorithm=None, workers=None):
+        if algorithm in HASH_ALGORITHMS:
+            self.algorithm = algorithm
+            if self.hash_cache:
+                self.hash_cache.algorithm = algorithm
+        if workers:
+            self.workers = max(1, int(workers))
+
+    def reset_stats(self):
+        self.stats = {stage: {'files': 0, 'bytes_read': 0, 'bytes_skipped': 0}
+                      for stage in ('size', 'partial', 'full')}
+
+    def reset_state(self):
+        self.executor = None
+        self.pending = {}
+        self.ready = []
+        self.walked = {}
+        self.order = {}
+        self.size_groups = {}
+        self.partial_groups = {}
+        self.keepers = {}
+        self.unverified = set()
+
+    def find_duplicates(self, root_directory):
+        self.start(root_directory)
+        try:
+            for root, _, files in os.walk(root_directory):
+                for file in files:
+                    file_path = os.path.join(root, file)
+                    try:
+                        st = os.stat(file_path)
+                    except OSError as e:
+                        self.db_handler.log_error(f"Error reading file size {file_path}: {str(e)}")
+                        continue
+                    yield from self.add_file(file_path, st)
+            yield from self.finish()
+        finally:
+            self.close()
+
+    def start(self, root_directory):
+        self.reset_state()
+        if self.hash_cache:
+            self.hash_cache.load(root_directory)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='peanut-hash')
+
+    def known_files(self, skip=None):
+        # files recorded by earlier scans of the root, for a scan that only walks part of it; their folders are
+        # clean, so the cached size and mtime are trusted and a file is only stat'ed again by verify()
+        if not self.hash_cache:
+            return []
+        files = []
+        for path, entry in self.hash_cache.known_files():
+            if skip and skip(path):
+                continue
+            self.unverified.add(path)
+            files.append((path, CachedStat(entry['size'], entry['mtime_ns'], entry['inode'])))
+        return files
+
+    def verify(self, file_path):
+        # a known file is stat'ed once it is about to be kept or deleted: one that is gone is dropped, and one
+        # that changed behind the cache's back is left out of this scan and saved without its stale digests
+        self.unverified.discard(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            del self.walked[file_path]
+            return False
+        if self.hash_cache.matches(self.hash_cache.entries.get(file_path), st):
+            return True
+        self.walked[file_path] = st
+        return False
+
+    def add_file(self, file_path, st):
+        # Stage 1: a file is only hashed once another file of the same size shows up
+        self.stats['size']['files'] += 1
+        self.order[file_path] = len(self.order)
+        self.walked[file_path] = st
+        same_size = self.size_groups.setdefault(st.st_size, [])
+        same_size.append(file_path)
+        if len(same_size) == 2:
+            self.submit(same_size[0], 'partial')
+            self.submit(same_size[1], 'partial')
+        elif len(same_size) > 2:
+            self.submit(file_path, 'partial')
+        yield from self.drain(block=len(self.pending) >= self.workers * 4)
+
+    def finish(self, cancel_event=None):
+        while self.pending or self.ready:
+            if cancel_event is not None and cancel_event.is_set():
+                return  # close() keeps the digests computed so far
+            yield from self.drain(block=True)
+        for size, paths in self.size_groups.items():
+            if len(paths) == 1:
+                self.stats['size']['bytes_skipped'] += size
+        for (size, _), paths in self.partial_groups.items():
+            if len(paths) == 1 and size > 2 * self.sample_size:
+                self.stats['full']['bytes_skipped'] += size
+        if self.hash_cache:
+            self.hash_cache.save(self.walked)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.hash_cache:
+            # a cancelled scan never gets to finish(), its digests are saved here; the walk is incomplete,
+            # so nothing is evicted
+            for future, (file_path, kind) in self.pending.items():
+                if not future.cancelled() and future.exception() is None and future.result():
+                    self.hash_cache.put(file_path, self.walked[file_path], kind, future.result())
+            self.hash_cache.save()
+        self.reset_state()
+
+    def submit(self, file_path, kind):
+        st = self.walked[file_path]
+        if self.hash_cache:
+            digest = self.hash_cache.get(file_path, st, kind)
+            if digest:
+                self.stats[kind]['bytes_skipped'] += st.st_size
+                self.ready.append((file_path, kind, digest))
+                return
+        hash_function = self.hash_sample if kind == 'partial' else self.hash_full
+        future = self.executor.submit(hash_function, file_path, st.st_size)
+        self.pending[future] = (file_path, kind)
+
+    def drain(self, block=False):
+        # results stream back to the caller as soon as they are ready, while the walk continues
+        while self.ready:
+            file_path, kind, digest = self.ready.pop()
+            yield from self.on_hash(file_path, kind, digest)
+        if not self.pending:
+            return
+        done, _ = wait(self.pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            file_path, kind = self.pending.pop(future)
+            digest = future.result()
+            if digest is None:
+                continue
+            if self.hash_cache:
+                self.hash_cache.put(file_path, self.walked[file_path], kind, digest)
+            yield from self.on_hash(file_path, kind, digest)
+
+    def on_hash(self, file_path, kind, digest):
+        st = self.walked[file_path]
+        if kind == 'partial':
+            yield from self.on_partial_hash(file_path, st.st_size, digest)
+        else:
+            yield from self.on_full_hash(file_path, st.st_size, digest)
+
+    def on_partial_hash(self, file_path, size, digest):
+        # Stage 2: the sample already covered the whole file, no need to read it again
+        if size <= 2 * self.sample_size:
+            yield from self.on_full_hash(file_path, size, digest)
+            return
+        same_sample = self.partial_groups.setdefault((size, digest), [])
+        same_sample.append(file_path)
+        if len(same_sample) == 2:
+            self.submit(same_sample[0], 'full')
+            self.submit(same_sample[1], 'full')
+        elif len(same_sample) > 2:
+            self.submit(file_path, 'full')
+
+    def on_full_hash(self, file_path, size, digest):
+        # Stage 3: the file that came first in the walk is the one that is kept
+        if file_path in self.unverified and not self.verify(file_path):
+            return
+        key = (size, digest)
+        keeper = self.keepers.get(key)
+        if keeper is None:
+            self.keepers[key] = file_path
+        elif self.order[file_path] < self.order[keeper]:
+            self.keepers[key] = file_path
+            yield file_path, keeper
+        else:
+            yield keeper, file_path
+
+    def new_hash(self):
+        return HASH_ALGORITHMS[self.algorithm]()
+
+    def buffer(self):
+        # one reusable read buffer per hashing thread
+        if not hasattr(self.local, 'buffer'):
+            self.local.buffer = bytearray(CHUNK_SIZE)
+        return self.local.buffer
+
+    def add_stats(self, stage, bytes_read, bytes_skipped=0):
+        with self.stats_lock:
+            self.stats[stage]['files'] += 1
+            self.stats[stage]['bytes_read'] += bytes_read
+            self.stats[stage]['bytes_skipped'] += bytes_skipped
+
+    def hash_sample(self, file_path, size):
+        try:
+            file_hash = self.new_hash()
+            with open(file_path, "rb") as f:
+                if size <= 2 * self.sample_size:
+                    file_hash.update(f.read())
+                    bytes_read = size
+                else:
+                    file_hash.update(f.read(self.sample_size))
+                    f.seek(-self.sample_size, os.SEEK_END)
+                    file_hash.update(f.read(self.sample_size))
+                    bytes_read = 2 * self.sample_size
+            self.add_stats('partial', bytes_read, size - bytes_read)
+            return file_hash.hexdigest()
+        except Exception as e:
+            self.db_handler.log_error(f"Error hashing file {file_path}: {str(e)}")
+            return None
+
+    def hash_full(self, file_path, size):
+        try:
+            file_hash = self.new_hash()
+            with open(file_path, "rb", buffering=0) as f:
+                if size >= MMAP_THRESHOLD:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        for offset in range(0, len(view), CHUNK_SIZE * 16):
+                            file_hash.update(view[offset:offset + CHUNK_SIZE * 16])
+                else:
+                    buffer = self.buffer()
+                    view = memoryview(buffer)
+                    while True:
+                        n = f.readinto(buffer)
+                        if not n:
+                            break
+                        file_hash.update(view[:n])
+            self.add_stats('full', size)
+            return file_hash.hexdigest()
+        except Exception as e:
+            self.db_handler.log_error(f"Error hashing file {file_path}: {str(e)}")
+            return None
+
+    def report(self):
+        lines = []
+        for stage, counts in self.stats.items():
+            lines.append(f"{stage}: {counts['files']} files, {counts['bytes_read']} bytes read, "
+                         f"{counts['bytes_skipped']} bytes skipped")
+        return "\n".join(lines)
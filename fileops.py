@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import errno
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+FILEOP_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+COPY_CHUNK_SIZE = 64 * 1024 * 1024  # bytes handed to the kernel per copy_file_range/sendfile call
+# errors that mean the zero-copy call is not supported for this pair of files, not that the copy failed
+ZERO_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF,
+                         errno.ENOTSOCK}
+
+FileResult = namedtuple('FileResult', 'path destination success error bytes')
+
+
+def copy_file_contents(src, dst):
+    # copy_file_range lets the file system clone or copy server-side, sendfile still stays in the kernel;
+    # both are tried before falling back to a userspace copy. Only Linux can sendfile between two regular
+    # files, macOS and the BSDs want a socket as the destination
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if copy is None or not sys.platform.startswith('linux'):
+                continue
+            try:
+                copied = kernel_copy(copy, fsrc.fileno(), fdst.fileno(), size)
+            except OSError as e:
+                if e.errno not in ZERO_COPY_UNSUPPORTED:
+                    raise
+                continue
+            if copied == size:
+                return copied
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            break
+        shutil.copyfileobj(fsrc, fdst)
+        return size
+
+
+def kernel_copy(copy, src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        if copy is os.sendfile:
+            n = os.sendfile(dst_fd, src_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+        else:
+            n = copy(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - copied), copied, copied)
+        if n == 0:
+            break  # the source shrank while it was being copied
+        copied += n
+    return copied
+
+
+class FileOperationEngine:
+    # runs a batch of copies or moves on a bounded pool and returns one FileResult per file
+    def __init__(self, db_handler, workers=FILEOP_WORKERS):
+        self.db_handler = db_handler
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.reserved = set()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'files': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def copy_files(self, files, destination, progress=None):
+        os.makedirs(destination, exist_ok=True)
+        return self.run('Copy', self.copy_one, files, destination, progress)
+
+    def run(self, action_type, operation, files, destination=None, progress=None):
+        # progress(files_processed, files_total) is called as each result comes in
+        self.reset_stats()
+        self.reserved = set()
+        started = time.perf_counter()
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='peanut-fileops') as executor:
+            # results come back in the order of `files`, whatever order the workers finish in
+            for result in executor.map(lambda path: self.execute(action_type, operation, path, destination), files):
+                results.append(result)
+                if progress:
+                    progress(len(results), len(files))
+        self.stats['seconds'] = time.perf_counter() - started
+        self.db_handler.flush_logs()
+        return results
+
+    def execute(self, action_type, operation, path, destination):
+        try:
+            dst_path, size = operation(path, destination)
+            result = FileResult(path, dst_path, True, None, size)
+            self.db_handler.log_action(action_type, path, dst_path)
+        except OSError as e:
+            message = 'File not found' if isinstance(e, FileNotFoundError) else str(e)
+            result = FileResult(path, None, False, message, 0)
+            self.db_handler.log_action(action_type, path, message, success=False)
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += result.bytes
+            if not result.success:
+                self.stats['failed'] += 1
+        return result
+
+    def reserve_destination(self, destination, file_name):
+        # files with the same name from different folders get ' (1)', ' (2)'... instead of overwriting each other
+        with self.lock:
+            dst_path = os.path.join(destination, file_name)
+            base, ext = os.path.splitext(dst_path)
+            i = 1
+            while dst_path in self.reserved or os.path.exists(dst_path):
+                dst_path = f"{base} ({i}){ext}"
+                i += 1
+            self.reserved.add(dst_path)
+            return dst_path
+
+    def copy_one(self, path, destination):
+        dst_path = self.reserve_destination(destination, os.path.basename(path))
+        size = copy_file_contents(path, dst_path)
+        shutil.copymode(path, dst_path)
+        return dst_path, size
+
+    def report(self):
+        seconds = self.stats['seconds'] or 1e-9
+        return (f"{self.stats['files'] - self.stats['failed']} of {self.stats['files']} files, "
+                f"{self.stats['bytes'] // (1024 * 1024)} MB in {self.stats['seconds']:.1f}s "
+                f"({self.stats['bytes'] / seconds / (1024 * 1024):.0f} MB/s)")
@@ -0,0 +1,192 @@
+import os
+import shutil
+import datetime
+import threading
+from pathlib import Path
+
+JOURNAL_CHUNK_SIZE = 500  # steps executed between two journal commits
+STAGING_FOLDER_NAME = '.peanut_staging'
+STAGING_DIRECTORY = os.path.join(str(Path.home()), STAGING_FOLDER_NAME)
+STAGING_MAX_AGE_DAYS = 30  # staged deletes older than this are removed for good
+UNDOABLE_ACTION_TYPES = ('Rename', 'Delete')  # batches started from MultiSearch; AutoDirect moves are not undone
+
+# only operations planned before this process started can have been interrupted; anything newer is still in flight
+PROCESS_STARTED = datetime.datetime.now().isoformat()
+
+resume_lock = threading.Lock()
+resumed_files = set()
+
+
+def volume_root(path):
+    path = os.path.abspath(path)
+    device = os.stat(path).st_dev
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path or os.stat(parent).st_dev != device:
+            return path
+        path = parent
+
+
+def staging_directory_for(directory):
+    # a staged delete has to stay on the file's own drive so it is a rename and never a copy: the home staging
+    # folder when it shares the drive, else one in the volume root, else one next to the file
+    try:
+        if os.stat(directory).st_dev == os.stat(Path.home()).st_dev:
+            return STAGING_DIRECTORY
+        root = volume_root(directory)
+    except OSError:
+        return STAGING_DIRECTORY
+    staging = os.path.join(root, STAGING_FOLDER_NAME)
+    if os.path.isdir(staging) or os.access(root, os.W_OK):
+        return staging
+    return os.path.join(directory, STAGING_FOLDER_NAME)
+
+
+class OperationJournal:
+    # every batch is planned into peanut.db before anything on disk is touched; steps are then applied in
+    # chunks and marked done as they go, so a batch can be resumed after a crash or undone afterwards
+    def __init__(self, db_handler, staging_directory=None):
+        self.db_handler = db_handler
+        self.staging_directory = staging_directory  # one fixed staging folder instead of one per drive
+
+    def plan(self, action_type, steps):
+        # steps are (action, src_path, dst_path) with action 'move' or 'delete' (dst_path None); renames are moves
+        staging_directories = {}
+
+        def staging_root(src_path):
+            if self.staging_directory:
+                return self.staging_directory
+            directory = os.path.dirname(os.path.abspath(src_path))
+            if directory not in staging_directories:
+                staging_directories[directory] = staging_directory_for(directory)
+            return staging_directories[directory]
+
+        return self.db_handler.add_operation(action_type, steps, staging_root)
+
+    def run(self, action_type, steps, cancel_event=None, progress=None):
+        operation_id = self.plan(action_type, steps)
+        return operation_id, self.execute(operation_id, cancel_event, progress=progress)
+
+    def execute(self, operation_id, cancel_event=None, chunk_size=JOURNAL_CHUNK_SIZE, resuming=False, progress=None):
+        # progress(files_processed, files_total) is called after every chunk
+        operation = self.db_handler.get_operation(operation_id)
+        self.db_handler.update_operation_status(operation_id, 'running')
+        total = sum(self.db_handler.count_operation_steps(operation_id).values())
+        processed = 0
+        last_step_id = 0
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                # not resumed at the next start; what already ran can still be undone
+                self.db_handler.update_operation_status(operation_id, 'cancelled', finished=True)
+                self.db_handler.flush_logs()
+                return self.db_handler.count_operation_steps(operation_id)
+            steps = self.db_handler.get_operation_steps(operation_id, 'pending', last_step_id, chunk_size)
+            if not steps:
+                break
+            updates = []
+            for step_id, action, src_path, dst_path in steps:
+                # one failed file is recorded and skipped, the rest of the batch still runs
+                error = self.apply(action, src_path, dst_path, resuming)
+                updates.append(('failed' if error else 'done', error, step_id))
+                self.log(operation['action_type'], src_path, dst_path, action, error)
+            self.db_handler.update_operation_steps(updates)
+            last_step_id = steps[-1][0]
+            processed += len(steps)
+            if progress:
+                progress(processed, total)
+        self.db_handler.update_operation_status(operation_id, 'done', finished=True)
+        self.db_handler.flush_logs()
+        return self.db_handler.count_operation_steps(operation_id)
+
+    def apply(self, action, src_path, dst_path, resuming=False):
+        # a step that already happened before a crash is recognised instead of failing on resume; in a fresh
+        # batch a missing source is an error even if something else already sits at the destination
+        if resuming and not os.path.lexists(src_path) and os.path.lexists(dst_path):
+            return None
+        try:
+            if os.path.lexists(dst_path):
+                return f"Destination already exists: {dst_path}"
+            if action in ('delete', 'undo'):
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            shutil.move(src_path, dst_path)
+            return None
+        except OSError as e:
+            return 'File not found' if isinstance(e, FileNotFoundError) else str(e)
+
+    def log(self, action_type, src_path, dst_path, action, error):
+        if error:
+            self.db_handler.log_action(action_type, src_path, error, success=False)
+        elif action == 'delete':
+            self.db_handler.log_action(action_type, src_path, 'File deleted successfully')
+        elif action_type == 'Rename':
+            self.db_handler.log_action(action_type, src_path, f'File renamed to {dst_path}')
+        else:
+            self.db_handler.log_action(action_type, src_path, dst_path)
+
+    def undo(self, operation_id, chunk_size=JOURNAL_CHUNK_SIZE, progress=None):
+        # moves every completed step back, newest first, without overwriting anything created since
+        operation = self.db_handler.get_operation(operation_id)
+        if operation is None or operation['status'] not in ('done', 'cancelled'):
+            return None
+        total = self.db_handler.count_operation_steps(operation_id).get('done', 0)
+        processed = 0
+        before_step_id = 0
+        failed = 0
+        while True:
+            steps = self.db_handler.get_operation_steps(operation_id, 'done', before_step_id, chunk_size,
+                                                        reverse=True)
+            if not steps:
+                break
+            updates = []
+            for step_id, action, src_path, dst_path in steps:
+                error = self.apply('undo', dst_path, src_path)
+                updates.append(('undone', None, step_id) if not error else ('done', error, step_id))
+                failed += bool(error)
+                self.log(f"Undo {operation['action_type']}", dst_path, src_path, 'undo', error)
+            self.db_handler.update_operation_steps(updates)
+            before_step_id = steps[-1][0]
+            processed += len(steps)
+            if progress:
+                progress(processed, total)
+        if not failed:
+            for staged in self.db_handler.get_staging_directories(operation_id):
+                shutil.rmtree(staged, ignore_errors=True)
+        self.db_handler.update_operation_status(operation_id, 'undone' if not failed else operation['status'],
+                                                finished=True)
+        self.db_handler.flush_logs()
+        return self.db_handler.count_operation_steps(operation_id)
+
+    def last_operation(self):
+        operations = self.db_handler.get_operations(statuses=('done', 'cancelled'), limit=1,
+                                                    action_types=UNDOABLE_ACTION_TYPES)
+        return operations[0] if operations else None
+
+    def resume_incomplete(self):
+        # batches interrupted by a crash or shutdown are finished once per process, whichever handler gets here first
+        with resume_lock:
+            if self.db_handler.db_file in resumed_files:
+                return
+            resumed_files.add(self.db_handler.db_file)
+        for operation in self.db_handler.get_operations(statuses=('planned', 'running'), limit=100,
+                                                        created_before=PROCESS_STARTED):
+            try:
+                self.execute(operation['operation_id'], resuming=True)
+            except Exception as e:
+                self.db_handler.log_error(f"Error resuming operation {operation['operation_id']}: {str(e)}")
+        self.purge_staging()
+
+    def purge_staging(self, max_age_days=STAGING_MAX_AGE_DAYS):
+        # staged deletes can be undone until they are purged
+        threshold = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+        # only delete batches stage anything; every one of them is checked, however many moves came after it
+        for operation in self.db_handler.get_operations(statuses=('done', 'cancelled'), limit=None,
+                                                        action_types=('Delete',)):
+            if not operation['finished_at'] or datetime.datetime.fromisoformat(operation['finished_at']) >= threshold:
+                continue
+            staged = [path for path in self.db_handler.get_staging_directories(operation['operation_id'])
+                      if os.path.isdir(path)]
+            if staged:
+                for path in staged:
+                    shutil.rmtree(path, ignore_errors=True)
+                self.db_handler.update_operation_status(operation['operation_id'], 'purged', finished=True)
+        self.db_handler.rotate_operations()
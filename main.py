@@ -1,14 +1,56 @@
+import time
+startup_clock = time.perf_counter()  # started before the heavy imports so they show up in the startup timings
 import datetime
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import filedialog
 from PIL import Image
-import pygame
 import os
-from autoclean import AutoCleanHandler
+import queue
+import threading
+from autoclean import AutoCleanHandler, AutoCleanWorker
 from autodirect import AutoDirectHandler
-from multisearch import MultiSearchHandler
+from multisearch import MultiSearchHandler, SearchWorker, FileOperationWorker
 from database import DatabaseHandler
+from duplicates import available_algorithms
+from diskusage import DiskUsageHandler, DiskUsageWorker, format_size
+from settings import CUSTOM_FOLDER_COUNT, get_settings_store
+
+RESULT_ROW_HEIGHT = 30  # pixels per row in the MultiSearch result list
+
+startup_times = []  # (stage, seconds) pairs printed once the window is up
+image_cache = {}
+mixer = None
+
+
+def mark_startup(stage):
+    global startup_clock
+    now = time.perf_counter()
+    startup_times.append((stage, now - startup_clock))
+    startup_clock = now
+
+
+mark_startup("imports")
+
+
+def load_image(path, size=None):
+    # icons are decoded once per process; a CTkImage can be shared by any number of widgets
+    key = (path, size)
+    if key not in image_cache:
+        image = Image.open(path)
+        image_cache[key] = ctk.CTkImage(light_image=image, dark_image=image, **({'size': size} if size else {}))
+    return image_cache[key]
+
+
+def play_sound(path):
+    # pygame takes a noticeable part of startup and is only needed for the logo button
+    global mixer
+    if mixer is None:
+        import pygame
+        pygame.mixer.init()
+        mixer = pygame.mixer
+    mixer.music.load(path)
+    mixer.music.play()
 
 
 class ToolTip:
@@ -60,6 +102,109 @@ def browse_folder(entry):
         entry.insert(0, folder_selected)
 
 
+class ResultList(ctk.CTkFrame):
+    # only the rows that fit on screen are widgets; results live in a list and selection in a bitset
+    def __init__(self, master, height=260, **kwargs):
+        super().__init__(master, height=height, **kwargs)
+        self.paths = []
+        self.selection = bytearray()
+        self.top = 0
+        self.rows = []
+        self.grid_propagate(False)
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        self.rows_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.rows_frame.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.bind("<Configure>", self.on_resize)
+        self.bind_scroll(self.rows_frame)
+
+    def bind_scroll(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.scroll_to(self.top - int(e.delta / abs(e.delta or 1)) * 3))
+        widget.bind("<Button-4>", lambda e: self.scroll_to(self.top - 3))
+        widget.bind("<Button-5>", lambda e: self.scroll_to(self.top + 3))
+
+    def on_resize(self, event):
+        visible_rows = max(1, event.height // RESULT_ROW_HEIGHT)
+        while len(self.rows) < visible_rows:
+            index = len(self.rows)
+            row = ctk.CTkCheckBox(self.rows_frame, text="", command=lambda i=index: self.toggle_row(i))
+            row.place(x=15, y=index * RESULT_ROW_HEIGHT + 5)
+            self.bind_scroll(row)
+            self.rows.append(row)
+        while len(self.rows) > visible_rows:
+            self.rows.pop().destroy()
+        self.refresh()
+
+    def on_scroll(self, command, value, unit=None):
+        if command == 'moveto':
+            self.scroll_to(int(float(value) * len(self.paths)))
+        elif unit == 'pages':
+            self.scroll_to(self.top + int(value) * len(self.rows))
+        else:
+            self.scroll_to(self.top + int(value))
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, len(self.paths) - len(self.rows)))
+        self.refresh()
+
+    def refresh(self):
+        for i, row in enumerate(self.rows):
+            index = self.top + i
+            if index < len(self.paths):
+                row.configure(text=self.paths[index], state="normal")
+                if self.is_selected(index):
+                    row.select()
+                else:
+                    row.deselect()
+            else:
+                row.configure(text="", state="disabled")
+                row.deselect()
+        if self.paths:
+            self.scrollbar.set(self.top / len(self.paths), min(1.0, (self.top + len(self.rows)) / len(self.paths)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def extend(self, paths):
+        self.paths.extend(paths)
+        self.selection.extend(bytes((len(self.paths) + 7) // 8 - len(self.selection)))
+        if self.top + len(self.rows) > len(self.paths) - len(paths):
+            self.refresh()  # new rows are on screen
+        else:
+            self.scrollbar.set(self.top / len(self.paths), (self.top + len(self.rows)) / len(self.paths))
+
+    def clear(self):
+        self.paths = []
+        self.selection = bytearray()
+        self.top = 0
+        self.refresh()
+
+    def is_selected(self, index):
+        return self.selection[index >> 3] & (1 << (index & 7))
+
+    def toggle_row(self, row_index):
+        index = self.top + row_index
+        if index < len(self.paths):
+            self.selection[index >> 3] ^= 1 << (index & 7)
+
+    def select_all(self):
+        self.selection = bytearray(b'\xff' * (len(self.paths) // 8))
+        if len(self.paths) % 8:
+            self.selection.append((1 << (len(self.paths) % 8)) - 1)
+        self.refresh()
+
+    def get_selected(self):
+        # empty bytes skip eight results at a time
+        selected = []
+        for byte_index, byte in enumerate(self.selection):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        selected.append(self.paths[(byte_index << 3) | bit])
+        return selected
+
+
 class App(ctk.CTk):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -69,14 +214,23 @@ class App(ctk.CTk):
         self.title("Peanut Automated File Manager")
         self.iconbitmap("images/peanut.ico")
         self.db_handler = DatabaseHandler()
-        self.tab_view = TabView(master=self, app=self)
+        self.settings = get_settings_store(self.db_handler)
         self.show_progress = False
+        self.progress_message = None
         self.show_error = False
+        settings = self.settings.get_user()
+        self.user_status = settings['status']
+        self.ui_size = settings['ui_size'] or 100
+        self.theme = settings['theme'] or 'system'
+        mark_startup("database and settings")
+        self.create_sidebar()
+        mark_startup("sidebar")
+        # the tab view owns the only set of handlers; the app uses the same ones
         self.tab_view = TabView(master=self, app=self)
-        self.auto_clean_handler = AutoCleanHandler()
-        self.auto_direct_handler = AutoDirectHandler()
-        self.auto_clean_handler.load_settings()
-        self.update_next_cleaning_time_label()
+        self.tab_view.grid(row=0, column=1, padx=20, pady=10, sticky="nsew")
+        self.auto_clean_handler = self.tab_view.auto_clean_handler
+        self.auto_direct_handler = self.tab_view.auto_direct_handler
+        self.apply_settings()
         self.user_feedback_frame = ctk.CTkFrame(self)
         self.user_feedback_frame.grid(row=2, column=1, columnspan=2, sticky="nsew", padx=20, pady=(0, 10))
         self.user_feedback_label = ctk.CTkLabel(self.user_feedback_frame, text="", font=("Arial", 8))
@@ -103,7 +257,7 @@ class App(ctk.CTk):
                                                                 indeterminate_speed=1)
                 self.bouncing_progress_bar.grid(row=0, column=0, sticky="ew", padx=20)
                 self.bouncing_progress_bar.start()
-            message = "AutoClean in progress...."
+            message = self.progress_message or "AutoClean in progress...."
         else:
             message = ""
             if hasattr(self, 'bouncing_progress_bar'):
@@ -111,28 +265,8 @@ class App(ctk.CTk):
                 del self.bouncing_progress_bar
         self.user_feedback_label.configure(text=message)
 
-    def update_next_cleaning_time_label(self):
-        next_cleaning_time = self.auto_clean_handler.get_next_cleaning_time()
-        self.tab_view.ac_next_cleaning_label.configure(text=f"Next Clean in\n\n{next_cleaning_time}")
-        self.tab_view.ac_next_cleaning_label.after(600000, self.update_next_cleaning_time_label)  # Update every 10 minutes
-        self.db_handler = DatabaseHandler()
-        settings = self.db_handler.get_user_settings()
-        if settings:
-            self.user_status = settings['status']
-            self.ui_size = settings['ui_size']
-            self.theme = settings['theme']
-        else:
-            self.user_status = 0
-            self.ui_size = 100
-            self.theme = 'system'
-        self.create_sidebar()
-        self.tab_view = TabView(master=self, app=self)
-        self.tab_view.grid(row=0, column=1, padx=20, pady=10, sticky="nsew")
-        self.apply_settings()
-        self.tab_view.load_redirects()
-
     def load_settings(self):
-        settings = self.db_handler.get_autoclean_settings()
+        settings = self.settings.get_autoclean()
         if settings:
             self.clean_empty_folders_flag = settings['clean_empty_folders_flag']
             self.clean_unused_files_flag = settings['clean_unused_files_flag']
@@ -157,13 +291,10 @@ class App(ctk.CTk):
         self.create_sidebar_theme_scaling()
 
     def create_sidebar_buttons(self):
-        pygame.mixer.init()
-        self.peanut_logo_image = ctk.CTkImage(light_image=Image.open("images/peanut.ico"),
-                                              dark_image=Image.open("images/peanut.ico"))
+        self.peanut_logo_image = load_image("images/peanut.ico")
         def play_eee_sound():
             try:
-                pygame.mixer.music.load("images/eee.wav")
-                pygame.mixer.music.play()
+                play_sound("images/eee.wav")
             except Exception as e:
                 print("Error playing sound:", e)
 
@@ -176,15 +307,15 @@ class App(ctk.CTk):
         create_tooltip(self.help_button, "Open the FAQ page.")
 
     def load_saved_status(self):
-        status = self.db_handler.load_status()
+        status = self.settings.get_user()['status']
         return status != "running"
 
     def on_closing(self):
+        self.settings.flush()
         self.destroy()
 
     def create_sidebar_theme_scaling(self):
-        self.theme_label_image = ctk.CTkImage(light_image=Image.open("images/13125625.png"),
-                                              dark_image=Image.open("images/13125625.png"))
+        self.theme_label_image = load_image("images/13125625.png")
         self.theme_label = ctk.CTkLabel(self.sidebar_frame, image=self.theme_label_image, text="")
         self.theme_label.grid(row=5, column=0, padx=20, pady=(10, 0), sticky="ew")
         self.theme_menu = ctk.CTkOptionMenu(self.sidebar_frame, values=["System", "Light", "Dark"],
@@ -192,8 +323,7 @@ class App(ctk.CTk):
         self.theme_menu.set(self.theme)
         self.theme_menu.grid(row=6, column=0, padx=20, pady=(10, 10), sticky="ew")
 
-        self.scaling_label_image = ctk.CTkImage(light_image=Image.open("images/4606575.png"),
-                                                dark_image=Image.open("images/4606575.png"))
+        self.scaling_label_image = load_image("images/4606575.png")
         self.scaling_label = ctk.CTkLabel(self.sidebar_frame, image=self.scaling_label_image, text="")
         self.scaling_label.grid(row=7, column=0, padx=20, pady=(5, 0), sticky="ew")
         self.scaling_menu_var = ctk.StringVar(value=f"{self.ui_size}%")
@@ -203,15 +333,12 @@ class App(ctk.CTk):
         self.scaling_menu.grid(row=8, column=0, padx=20, pady=(5, 20), sticky="ew")
 
     def apply_settings(self):
-        settings = self.db_handler.get_user_settings()
+        settings = self.settings.get_user()
         ctk.set_appearance_mode(f"{self.theme}")
-        if settings:
-            self.change_scaling_event(f"{settings['ui_size'] or 100}%")
-        else:
-            self.change_scaling_event("100%")
+        self.change_scaling_event(f"{settings['ui_size'] or 100}%")
 
     def change_theme_event(self, new_appearance_mode: str):
-        self.db_handler.update_user_settings(theme=new_appearance_mode)
+        self.settings.update_user(theme=new_appearance_mode)
         ctk.set_appearance_mode(new_appearance_mode)
 
     def change_scaling_event(self, new_scaling: str):
@@ -219,7 +346,7 @@ class App(ctk.CTk):
             new_scaling = "100%"
         else:
             new_scaling_float = int(new_scaling.replace("%", "")) / 100
-            self.db_handler.update_user_settings(ui_size=int(new_scaling.replace("%", "")))
+            self.settings.update_user(ui_size=int(new_scaling.replace("%", "")))
             ctk.set_widget_scaling(new_scaling_float)
             new_width = int(self.original_width * new_scaling_float)
             new_height = int(self.original_height * new_scaling_float)
@@ -292,8 +419,7 @@ class App(ctk.CTk):
             directory_entry.grid(row=i + 3, column=1, padx=10, pady=5)
             favorite_folders_list.append(directory_entry)
 
-            browse_button_image = ctk.CTkImage(light_image=Image.open("images/3240447.png"),
-                                               dark_image=Image.open("images/3240447.png"))
+            browse_button_image = load_image("images/3240447.png")
             browse_button = ctk.CTkButton(setup_info_popup, image=browse_button_image, text="", width=20,
                                           command=lambda entry=directory_entry: browse_folder(entry))
             browse_button.grid(row=i + 3, column=2, padx=10, pady=5, sticky="w")
@@ -321,21 +447,41 @@ class TabView(ctk.CTkTabview):
         super().__init__(master, **kwargs)
         self.ac_next_cleaning_label = None
         self.next_cleaning_time = None
+        self.clean_worker = None
         self.db_handler = DatabaseHandler()
+        self.settings = get_settings_store(self.db_handler)
         self.auto_clean_handler = AutoCleanHandler()
         self.auto_direct_handler = AutoDirectHandler()
         self.multi_search_handler = MultiSearchHandler()
+        self.auto_clean_handler.resume_operations()
+        self.disk_usage_handler = DiskUsageHandler()
+        self.search_worker = None
+        self.file_operation_worker = None
+        self.disk_usage_worker = None
         self.app = app
+        mark_startup("handlers")
         self.add("AutoClean")
         self.add("AutoDirect")
         self.add("MultiSearch")
+        self.add("DiskUsage")
         self.clean_empty_folders_var = tk.BooleanVar(value=False)
 
-        self.create_autoclean_tab()
-        self.create_autodirect_tab()
-        self.create_multisearch_tab()
+        # only the visible tab is built at startup, the others the first time they are opened
+        self.tab_builders = {"AutoClean": self.create_autoclean_tab, "AutoDirect": self.create_autodirect_tab,
+                             "MultiSearch": self.create_multisearch_tab, "DiskUsage": self.create_diskusage_tab}
+        self.configure(command=self.build_current_tab)
+        self.build_current_tab()
 
-        self.load_autoclean_settings()
+    def build_current_tab(self):
+        builder = self.tab_builders.pop(self.get(), None)
+        if builder is None:
+            return
+        started = time.perf_counter()
+        builder()
+        if startup_times and startup_times[-1][0] == "window":
+            print(f"{self.get()} tab built in {(time.perf_counter() - started) * 1000:.0f} ms")
+        else:
+            mark_startup(f"{self.get()} tab")
 
     def create_autoclean_tab(self):
         self.ac_frame = ctk.CTkFrame(master=self.tab("AutoClean"))
@@ -353,6 +499,10 @@ class TabView(ctk.CTkTabview):
                                               values=["never", "day", "week", "month", "quarter", "year"],
                                               command=self.set_clean_frequency)
         self.ac_freq_menu.pack(side="top", padx=5, pady=(5, 13))
+        self.ac_hash_menu = ctk.CTkOptionMenu(self.ac_frame, values=available_algorithms(), width=100,
+                                              command=self.set_hash_algorithm)
+        self.ac_hash_menu.pack(side="top", padx=5, pady=(0, 13))
+        create_tooltip(self.ac_hash_menu, "Digest used to compare files when looking for duplicates.")
         self.ac_folders_switch = ctk.CTkSwitch(self.ac_frame, text="Empty folders",
                                                command=self.toggle_clean_empty_folders)
         self.ac_folders_switch.pack(anchor="w", padx=188, pady=3)
@@ -368,6 +518,12 @@ class TabView(ctk.CTkTabview):
         self.ac_browser_history_switch = ctk.CTkSwitch(self.ac_frame, text="Browser history",
                                                        command=self.toggle_clean_browser_history)
         self.ac_browser_history_switch.pack(anchor="w", padx=188, pady=3)
+        self.ac_incremental_switch = ctk.CTkSwitch(self.ac_frame, text="Watch for changes",
+                                                   command=self.toggle_incremental)
+        self.ac_incremental_switch.pack(anchor="w", padx=188, pady=3)
+        create_tooltip(self.ac_incremental_switch,
+                       "Only revisit folders that changed since the last clean. A full clean still runs weekly.")
+        self.load_autoclean_settings()
 
     def create_autodirect_tab(self):
         self.redirect_entries = []
@@ -387,35 +543,38 @@ class TabView(ctk.CTkTabview):
                                                   command=self.remove_all_redirects)
         self.ad_remove_all_button.grid(row=0, column=1, padx=(5, 5), pady=(10, 5), sticky="e")
 
-        self.ad_add_button_image = ctk.CTkImage(light_image=Image.open("images/plus_1104323.png"),
-                                                dark_image=Image.open("images/plus_1104323.png"))
+        self.ad_add_button_image = load_image("images/plus_1104323.png")
         self.ad_add_button = ctk.CTkButton(self.ad_button_frame, text="", image=self.ad_add_button_image, width=20,
                                            command=self.add_redirect)
         self.ad_add_button.grid(row=0, column=2, padx=(5, 10), pady=(10, 5), sticky="e")
+        self.load_redirects()
 
     def create_multisearch_tab(self):
         self.ms_frame = ctk.CTkFrame(master=self.tab("MultiSearch"))
         self.ms_frame.grid(row=1, column=1, sticky="nsew", padx=0, pady=3)  # Removed side padding
         self.ms_directory_entry = ctk.CTkEntry(self.ms_frame, placeholder_text="folder", width=220)
         self.ms_directory_entry.pack(side="left", padx=5, pady=1)
-        self.ms_browse_button_image = ctk.CTkImage(light_image=Image.open("images/3240447.png"),
-                                                   dark_image=Image.open("images/3240447.png"))
+        create_tooltip(self.ms_directory_entry, "Leave empty to search every drive at once.")
+        self.ms_browse_button_image = load_image("images/3240447.png")
         self.ad_browse_button = ctk.CTkButton(self.ms_frame, image=self.ms_browse_button_image, text="", width=20,
                                               command=lambda: browse_folder(self.ms_directory_entry))
         self.ad_browse_button.pack(side="left", padx=(2, 10))
         self.ms_keyword_entry = ctk.CTkEntry(self.ms_frame, placeholder_text="search  (or ' . ' for all files)",
                                              width=220)
         self.ms_keyword_entry.pack(side="left", padx=5, pady=1)
-        self.ms_search_button_image = ctk.CTkImage(light_image=Image.open("images/7270638.png"),
-                                                   dark_image=Image.open("images/7270638.png"))
+        create_tooltip(self.ms_keyword_entry, "A word matches file names as before. Filters can be combined: "
+                                              "ext:pdf,docx  glob:*.tmp  re:^IMG_\\d+  size:>10MB  size:1k..5mb  "
+                                              "mtime:<7d  atime:>1y  mtime:2024-01-01..2024-02-01  path:subfolder")
+        self.ms_search_button_image = load_image("images/7270638.png")
         self.ms_search_button = ctk.CTkButton(self.ms_frame, text="", image=self.ms_search_button_image,
                                               command=self.perform_search, width=20)
         self.ms_search_button.pack(side="left", padx=3)
+        self.ms_index_button = ctk.CTkButton(self.ms_frame, text="index", width=20, command=self.build_search_index)
+        self.ms_index_button.pack(side="left", padx=3)
+        create_tooltip(self.ms_index_button, "Index this folder so searches in it return instantly.")
 
-        self.search_results_frame = ctk.CTkScrollableFrame(master=self.tab("MultiSearch"), height=260)
-        self.search_results_frame.grid(row=3, column=1, sticky="nsew", padx=0, pady=1)
-        self.search_results_frame.grid_rowconfigure(0, weight=1)
-        self.search_results_frame.grid_columnconfigure(0, weight=1)
+        self.search_results_list = ResultList(master=self.tab("MultiSearch"), height=260)
+        self.search_results_list.grid(row=3, column=1, sticky="nsew", padx=0, pady=1)
 
         self.ms_button_frame = ctk.CTkFrame(master=self.tab("MultiSearch"))
         self.ms_button_frame.grid(row=4, column=1, sticky="nsew", padx=0, pady=1)
@@ -423,33 +582,57 @@ class TabView(ctk.CTkTabview):
         self.ms_select_all_button = ctk.CTkButton(self.ms_button_frame, text="select all", width=20,
                                                   command=self.select_all_files)
         self.ms_select_all_button.pack(side="left", padx=5, pady=1)
+        self.ms_undo_button = ctk.CTkButton(self.ms_button_frame, text="undo", width=20,
+                                            command=self.undo_last_operation)
+        self.ms_undo_button.pack(side="left", padx=5, pady=1)
+        create_tooltip(self.ms_undo_button, "Undo the last rename or delete.")
 
-        self.ms_rename_button_image = ctk.CTkImage(light_image=Image.open("images/pencil.png"),
-                                                   dark_image=Image.open("images/pencil.png"))
+        self.ms_rename_button_image = load_image("images/pencil.png")
         self.ms_rename_button = ctk.CTkButton(self.ms_button_frame, text="", image=self.ms_rename_button_image,
                                               width=20, command=self.open_ms_rename_popup)
         self.ms_rename_button.pack(side="right", padx=5, pady=5)
         create_tooltip(self.ms_rename_button,
                        "(1) Find and replace, (2) Convert file formats, or (3) Add a prefix or suffix to the filenames")
 
-        self.ms_copy_button_image = ctk.CTkImage(light_image=Image.open("images/11092355.png"),
-                                                 dark_image=Image.open("images/11092355.png"))
+        self.ms_copy_button_image = load_image("images/11092355.png")
         self.ms_copy_button = ctk.CTkButton(self.ms_button_frame, text="", image=self.ms_copy_button_image, width=20,
                                             command=self.open_ms_copy_popup)
         self.ms_copy_button.pack(side="right", padx=5, pady=5)
         create_tooltip(self.ms_copy_button, "Copy all selected items into a new folder.")
 
-        self.ms_delete_button_image = ctk.CTkImage(light_image=Image.open("images/delete.png"),
-                                                   dark_image=Image.open("images/delete.png"))
+        self.ms_delete_button_image = load_image("images/delete.png")
         self.ms_delete_button = ctk.CTkButton(self.ms_button_frame, text="", image=self.ms_delete_button_image,
                                               width=20, command=self.open_ms_delete_popup)
         self.ms_delete_button.pack(side="right", padx=5, pady=5)
         create_tooltip(self.ms_delete_button, "Delete all selected items.")
 
+    def create_diskusage_tab(self):
+        self.du_frame = ctk.CTkFrame(master=self.tab("DiskUsage"))
+        self.du_frame.grid(row=1, column=0, sticky="nsew", padx=0, pady=3)
+        self.du_directory_entry = ctk.CTkEntry(self.du_frame, placeholder_text="folder", width=300)
+        self.du_directory_entry.insert(0, self.disk_usage_handler.default_directory())
+        self.du_directory_entry.pack(side="left", padx=5, pady=1)
+        self.du_browse_button_image = load_image("images/3240447.png")
+        self.du_browse_button = ctk.CTkButton(self.du_frame, image=self.du_browse_button_image, text="", width=20,
+                                              command=lambda: browse_folder(self.du_directory_entry))
+        self.du_browse_button.pack(side="left", padx=(2, 10))
+        self.du_scan_button = ctk.CTkButton(self.du_frame, text="Scan", width=80, command=self.scan_disk_usage)
+        self.du_scan_button.pack(side="left", padx=3)
+        create_tooltip(self.du_scan_button, "Add up folder sizes. Folders that did not change since the last "
+                                            "scan are taken from the cache.")
+        self.du_full_scan_switch = ctk.CTkSwitch(self.du_frame, text="Full rescan")
+        self.du_full_scan_switch.pack(side="left", padx=10)
+        create_tooltip(self.du_full_scan_switch, "Ignore the cache, e.g. after files were rewritten in place.")
+
+        self.du_results_textbox = ctk.CTkTextbox(master=self.tab("DiskUsage"), width=560, height=300)
+        self.du_results_textbox.grid(row=2, column=0, sticky="nsew", padx=0, pady=5)
+        self.du_results_textbox.configure(state="disabled")
+        self.show_disk_usage(self.du_directory_entry.get())
+
     ''' AutoClean Functions '''
 
     def load_autoclean_settings(self):
-        settings = self.db_handler.get_autoclean_settings()
+        settings = self.settings.get_autoclean()
         if settings:
             self.ac_folders_switch.select() if settings[
                                                    'clean_empty_folders_flag'] == 1 else self.ac_folders_switch.deselect()
@@ -462,6 +645,12 @@ class TabView(ctk.CTkTabview):
             self.ac_browser_history_switch.select() if settings[
                                                            'clean_browser_history_flag'] == 1 else self.ac_browser_history_switch.deselect()
             self.ac_freq_menu.set(settings['autoclean_frequency'] or "never")
+            self.ac_hash_menu.set(settings['hash_algorithm'] or "md5")
+            if settings['incremental_flag']:
+                self.ac_incremental_switch.select()
+                self.auto_clean_handler.start_watching()
+            else:
+                self.ac_incremental_switch.deselect()
             next_cleaning_time_str = settings.get('next_cleaning_time', None)
             if next_cleaning_time_str:
                 try:
@@ -479,44 +668,59 @@ class TabView(ctk.CTkTabview):
 
     def set_clean_frequency(self, frequency):
         self.auto_clean_handler.set_clean_frequency(frequency)
-        next_cleaning_time = self.auto_clean_handler.next_cleaning_time
-        self.db_handler.update_clean_flags(
-            autoclean_frequency=frequency,
-            clean_empty_folders_flag=self.ac_folders_switch.get(),
-            clean_unused_files_flag=self.ac_unused_files_switch.get(),
-            clean_duplicate_files_flag=self.ac_duplicate_files_switch.get(),
-            clean_recycling_bin_flag=self.ac_recycling_switch.get(),
-            clean_browser_history_flag=self.ac_browser_history_switch.get(),
-            next_cleaning_time=next_cleaning_time.isoformat() if next_cleaning_time else None
-        )
         self.update_next_cleaning_time_label()
 
+    def set_hash_algorithm(self, algorithm):
+        self.auto_clean_handler.set_hash_settings(algorithm=algorithm)
+
     def update_next_cleaning_time_label(self):
         next_cleaning_time = self.auto_clean_handler.get_next_cleaning_time()
         self.ac_next_cleaning_label.configure(text=f"Next Clean in\n\n{next_cleaning_time}")
         self.ac_next_cleaning_label.after(60000, self.update_next_cleaning_time_label)  # Update every minute
 
     def clean_now(self):
-        self.show_progress = True
+        # a second click while a clean is running cancels it
+        if self.clean_worker and self.clean_worker.is_alive():
+            self.clean_worker.cancel()
+            self.clean_now_button.configure(state="disabled")
+            return
+        self.app.show_progress = True
+        self.app.progress_message = None
         self.app.update_user_feedback()
-        self.auto_clean_handler.activate_selected_AC(force=True)
-        self.show_progress = False
+        self.clean_now_button.configure(text="Cancel")
+        self.clean_worker = AutoCleanWorker(self.auto_clean_handler)
+        self.clean_worker.start()
+        self.after(100, self.poll_clean_worker)
+
+    def poll_clean_worker(self):
+        finished = False
+        try:
+            while True:
+                event, data = self.clean_worker.events.get_nowait()
+                if event == 'progress':
+                    self.app.progress_message = (f"AutoClean: {data['files_scanned']} files scanned, "
+                                                 f"{data['bytes_hashed'] // (1024 * 1024)} MB hashed, "
+                                                 f"{data['items_removed']} removed - {data['directory']}")
+                else:
+                    finished = True
+                    self.app.show_error = event == 'error'
+        except queue.Empty:
+            pass
+
+        if not finished:
+            self.app.update_user_feedback()
+            self.after(100, self.poll_clean_worker)
+            return
+        self.app.show_progress = False
+        self.app.progress_message = None
         self.app.update_user_feedback()
+        self.clean_now_button.configure(text="Clean Now", state="normal")
         self.update_next_cleaning_time_label()
 
     def toggle_autoclean_feature(self, feature_name, value):
         try:
             setattr(self.auto_clean_handler, feature_name, value)
             self.auto_clean_handler.save_settings()
-            self.db_handler.update_clean_flags(
-                autoclean_frequency=self.auto_clean_handler.frequency,
-                clean_empty_folders_flag=self.auto_clean_handler.clean_empty_folders_flag,
-                clean_unused_files_flag=self.auto_clean_handler.clean_unused_files_flag,
-                clean_duplicate_files_flag=self.auto_clean_handler.clean_duplicate_files_flag,
-                clean_recycling_bin_flag=self.auto_clean_handler.clean_recycling_bin_flag,
-                clean_browser_history_flag=self.auto_clean_handler.clean_browser_history_flag,
-                next_cleaning_time=self.auto_clean_handler.next_cleaning_time
-            )
         except Exception as e:
             print(f"Failed to toggle {feature_name}: {e}")
 
@@ -540,6 +744,9 @@ class TabView(ctk.CTkTabview):
         value = int(self.ac_browser_history_switch.get())
         self.toggle_autoclean_feature('clean_browser_history_flag', value)
 
+    def toggle_incremental(self):
+        self.auto_clean_handler.set_incremental(int(self.ac_incremental_switch.get()))
+
     ''' AutoDirect Functions '''
 
     def add_redirect(self, keyword="", from_directory="", to_directory="", id=None):
@@ -583,8 +790,7 @@ class TabView(ctk.CTkTabview):
         ad_to_dir_entry.bind("<FocusIn>", lambda event: self.clear_placeholder(event, "to this folder"))
         ad_to_dir_entry.bind("<FocusOut>", lambda event: self.set_placeholder(event, "to this folder"))
 
-        ad_browse_button_image = ctk.CTkImage(light_image=Image.open("images/3240447.png"),
-                                              dark_image=Image.open("images/3240447.png"))
+        ad_browse_button_image = load_image("images/3240447.png")
         ad_browse_button = ctk.CTkButton(new_frame, image=ad_browse_button_image, text="", width=20,
                                          command=lambda: browse_folder(ad_to_dir_entry))
         ad_browse_button.pack(side="left", padx=4)
@@ -619,12 +825,11 @@ class TabView(ctk.CTkTabview):
 
             folder_entry = ctk.CTkEntry(custom_folders_popup, placeholder_text=f"Custom folder {i} name", width=130)
             folder_entry.grid(row=i, column=1, padx=5, pady=10)
-            folder_path = self.db_handler.get_custom_folder_path(i)
+            folder_path = self.settings.get_custom_folder_path(i)
             folder_entry.insert(0, folder_path if folder_path else "")
             folder_entries.append(folder_entry)
 
-            browse_button_image = ctk.CTkImage(light_image=Image.open("images/3240447.png"),
-                                               dark_image=Image.open("images/3240447.png"))
+            browse_button_image = load_image("images/3240447.png")
             browse_button = ctk.CTkButton(custom_folders_popup, image=browse_button_image, text="", width=20,
                                           command=lambda entry=folder_entry: browse_folder(entry))
             browse_button.grid(row=i, column=2, padx=5, pady=10)
@@ -636,7 +841,7 @@ class TabView(ctk.CTkTabview):
     def save_all_custom_folders(self, folder_entries):
         for i, entry in enumerate(folder_entries, 1):
             folder_name = os.path.basename(entry.get())
-            self.db_handler.update_custom_folder(i, folder_name, entry.get())
+            self.settings.set_custom_folder(i, entry.get(), folder_name)
 
     def browse_and_set_folder(self, entry, index):
         folder_selected = filedialog.askdirectory()
@@ -644,7 +849,7 @@ class TabView(ctk.CTkTabview):
             entry.delete(0, "end")
             entry.insert(0, folder_selected)
             folder_name = os.path.basename(folder_selected)
-            self.db_handler.update_custom_folder(index, folder_selected, folder_name)
+            self.settings.set_custom_folder(index, folder_selected, folder_name)
             self.update_custom_folder_options()
 
     def save_custom_folders(self, folder_entries):
@@ -652,11 +857,11 @@ class TabView(ctk.CTkTabview):
             folder_path = entry.get()
             if folder_path:
                 folder_name = os.path.basename(folder_path)
-                self.db_handler.update_custom_folder(i, folder_path, folder_name)
+                self.settings.set_custom_folder(i, folder_path, folder_name)
         self.update_custom_folder_options()
 
     def update_custom_folder_options(self):
-        custom_folder_names = [self.db_handler.get_custom_folder_name(i) for i in range(1, 4)]
+        custom_folder_names = [self.settings.get_custom_folder_name(i) for i in range(1, CUSTOM_FOLDER_COUNT + 1)]
         self.custom_folders = ["-- from --", "Downloads", "Desktop"] + custom_folder_names
         for entry in self.redirect_entries:
             entry[1].configure(values=self.custom_folders)
@@ -705,23 +910,98 @@ class TabView(ctk.CTkTabview):
     ''' MultiSearch Functions '''
 
     def perform_search(self):
+        # a second click while a search is running cancels it
+        if self.search_worker and self.search_worker.is_alive():
+            self.search_worker.cancel()
+            self.ms_search_button.configure(state="disabled")
+            return
         self.clear_search_results()
         directory = self.ms_directory_entry.get()
         keyword = self.ms_keyword_entry.get()
         if keyword:
-            files_found = self.multi_search_handler.multi_search_for_files(keyword, directory)
-            for file in files_found:
-                result_checkbox = ctk.CTkCheckBox(self.search_results_frame, text=file)
-                result_checkbox.pack(anchor="w", padx=15, pady=5)
+            self.app.show_progress = True
+            self.app.progress_message = "Searching... 0 files found"
+            self.app.update_user_feedback()
+            self.ms_search_button.configure(text="cancel")
+            self.search_worker = SearchWorker(self.multi_search_handler, keyword, directory)
+            self.search_worker.start()
+            self.after(100, self.poll_search_worker)
+
+    def poll_search_worker(self):
+        finished = None
+        try:
+            while True:
+                event, data = self.search_worker.events.get_nowait()
+                if event == 'batch':
+                    self.search_results_list.extend(data)
+                else:
+                    finished = event
+                    self.app.show_error = event == 'error'
+        except queue.Empty:
+            pass
+
+        found_count = len(self.search_results_list.paths)
+        if finished is None:
+            self.app.progress_message = f"Searching... {found_count} files found"
+            self.app.update_user_feedback()
+            self.after(100, self.poll_search_worker)
+            return
+        self.app.show_progress = False
+        self.app.progress_message = None
+        self.app.update_user_feedback()
+        self.ms_search_button.configure(text="", state="normal")
+        search_index = self.multi_search_handler.search_index
+        if finished == 'cancelled':
+            self.app.user_feedback_label.configure(text=f"Search cancelled, {found_count} files found")
+        elif finished == 'error':
+            self.app.user_feedback_label.configure(text=f"Search failed: {self.search_worker.error}")
+        elif search_index.indexed_root_for(self.search_worker.directory) and search_index.last_query_time is not None:
+            self.app.user_feedback_label.configure(
+                text=f"{found_count} files found in {search_index.last_query_time * 1000:.0f} ms (indexed)")
+        elif finished == 'done':
+            self.app.user_feedback_label.configure(text=f"{found_count} files found")
+
+    def build_search_index(self):
+        directory = self.ms_directory_entry.get()
+        if not directory or not os.path.isdir(directory):
+            return
+        self.ms_index_button.configure(state="disabled")
+        self.app.show_progress = True
+        self.app.progress_message = f"Indexing {directory}..."
+        self.app.update_user_feedback()
+        result = {}
+
+        def build():
+            try:
+                result['stats'] = self.multi_search_handler.build_search_index(directory)
+            except Exception as e:
+                self.db_handler.log_error(f"Error indexing {directory}: {str(e)}")
+
+        index_thread = threading.Thread(target=build, daemon=True)
+        index_thread.start()
+        self.after(100, self.poll_search_index, index_thread, result)
+
+    def poll_search_index(self, index_thread, result):
+        if index_thread.is_alive():
+            self.after(100, self.poll_search_index, index_thread, result)
+            return
+        self.app.show_progress = False
+        self.app.progress_message = None
+        self.app.update_user_feedback()
+        self.ms_index_button.configure(state="normal")
+        if 'stats' in result:
+            stats = result['stats']
+            file_count = sum(root['file_count'] for root in stats['roots'])
+            build_seconds = sum(root['build_seconds'] for root in stats['roots'])
+            self.app.user_feedback_label.configure(
+                text=f"Index: {file_count} files, built in {build_seconds:.1f}s, "
+                     f"{stats['size_on_disk'] // (1024 * 1024)} MB on disk")
 
     def select_all_files(self):
-        for widget in self.search_results_frame.winfo_children():
-            if isinstance(widget, ctk.CTkCheckBox):
-                widget.select()
+        self.search_results_list.select_all()
 
     def clear_search_results(self):
-        for widget in self.search_results_frame.winfo_children():
-            widget.destroy()
+        self.search_results_list.clear()
 
     def open_ms_delete_popup(self):
         selected_files = self.get_selected_files()
@@ -735,11 +1015,10 @@ class TabView(ctk.CTkTabview):
         ms_delete_popup.resizable(False, False)
         ms_delete_popup.grab_set()
 
-        ms_warning_image = ctk.CTkImage(light_image=Image.open("images/4096970.png"),
-                                        dark_image=Image.open("images/4096970.png"), size=(50, 50))
+        ms_warning_image = load_image("images/4096970.png", size=(50, 50))
         ms_warning_image_label = ctk.CTkLabel(ms_delete_popup, image=ms_warning_image, text="")
         ms_warning_image_label.pack(side="top")
-        ms_warning_label = ctk.CTkLabel(ms_delete_popup, text="Are you sure?\n\nThis action cannot be undone.")
+        ms_warning_label = ctk.CTkLabel(ms_delete_popup, text="Are you sure?\n\nDeleted items can be restored with undo.")
         ms_warning_label.pack(side="top", padx=10)
         ms_yes_button = ctk.CTkButton(ms_delete_popup, text="Yes, delete selected items", width=150,
                                       command=lambda: self.confirm_delete(ms_delete_popup, selected_files))
@@ -748,9 +1027,9 @@ class TabView(ctk.CTkTabview):
         ms_no_button.pack(side="right", padx=5)
 
     def confirm_delete(self, popup, files):
-        self.multi_search_handler.multi_delete_files(files)
         popup.destroy()
-        self.perform_search()
+        self.start_file_operation("Deleting", lambda operation_id: self.show_journal_report("Deleted", operation_id),
+                                  self.multi_search_handler.multi_delete_files, files)
 
     def open_ms_copy_popup(self):
         selected_files = self.get_selected_files()
@@ -764,8 +1043,7 @@ class TabView(ctk.CTkTabview):
         ms_copy_popup.resizable(False, False)
         ms_copy_popup.grab_set()
 
-        ms_name_file_image = ctk.CTkImage(light_image=Image.open("images/5762171.png"),
-                                          dark_image=Image.open("images/5762171.png"), size=(50, 50))
+        ms_name_file_image = load_image("images/5762171.png", size=(50, 50))
         ms_name_file_label = ctk.CTkLabel(ms_copy_popup, image=ms_name_file_image, text="")
         ms_name_file_label.pack(side="top", pady=10)
         ms_name_file_entry = ctk.CTkEntry(ms_copy_popup, placeholder_text="Name new folder", width=200)
@@ -784,8 +1062,71 @@ class TabView(ctk.CTkTabview):
         downloads_path = os.path.join(os.path.expanduser("~"), "Downloads")
         new_folder = os.path.join(downloads_path, folder_name)
 
-        self.multi_search_handler.multi_copy_files(files, new_folder)
         popup.destroy()
+        self.start_file_operation("Copying", lambda _: self.show_file_operation_report("Copied"),
+                                  self.multi_search_handler.multi_copy_files, files, new_folder)
+
+    def start_file_operation(self, verb, on_done, function, *args):
+        # batches run one at a time on a worker; the Tk thread only polls for progress and the result
+        if self.file_operation_worker and self.file_operation_worker.is_alive():
+            self.app.user_feedback_label.configure(text="Another file operation is still running")
+            return
+        self.app.show_progress = True
+        self.app.progress_message = f"{verb}..."
+        self.app.update_user_feedback()
+        self.file_operation_worker = FileOperationWorker(self.multi_search_handler, function, *args)
+        self.file_operation_worker.start()
+        self.after(100, self.poll_file_operation_worker, verb, on_done)
+
+    def poll_file_operation_worker(self, verb, on_done):
+        result = None
+        finished = None
+        try:
+            while True:
+                event, data = self.file_operation_worker.events.get_nowait()
+                if event == 'progress':
+                    self.app.progress_message = f"{verb} {data[0]} of {data[1]} files"
+                else:
+                    finished = event
+                    result = data
+                    self.app.show_error = event == 'error'
+        except queue.Empty:
+            pass
+
+        if finished is None:
+            self.app.update_user_feedback()
+            self.after(100, self.poll_file_operation_worker, verb, on_done)
+            return
+        self.app.show_progress = False
+        self.app.progress_message = None
+        self.app.update_user_feedback()
+        if finished == 'done':
+            on_done(result)
+
+    def show_file_operation_report(self, verb):
+        self.app.user_feedback_label.configure(text=f"{verb} {self.multi_search_handler.file_operations.report()}")
+
+    def show_journal_report(self, verb, operation_id):
+        if operation_id is None:
+            return
+        counts = self.multi_search_handler.db_handler.count_operation_steps(operation_id)
+        self.app.user_feedback_label.configure(
+            text=f"{verb} {counts.get('done', 0)} of {sum(counts.values())} files")
+        self.perform_search()
+
+    def undo_last_operation(self):
+        self.start_file_operation("Restoring", self.show_undo_report, self.multi_search_handler.undo_last_operation)
+
+    def show_undo_report(self, undone):
+        if undone is None:
+            self.app.user_feedback_label.configure(text="Nothing to undo")
+            return
+        action_type, counts = undone
+        failed = counts.get('done', 0)
+        self.app.user_feedback_label.configure(
+            text=f"Undid {action_type.lower()}: {counts.get('undone', 0)} files restored"
+                 + (f", {failed} could not be restored" if failed else ""))
+        self.perform_search()
 
     def open_ms_rename_popup(self):
         selected_files = self.get_selected_files()
@@ -799,8 +1140,7 @@ class TabView(ctk.CTkTabview):
         ms_rename_popup.resizable(False, False)
         ms_rename_popup.grab_set()
 
-        ms_warning_image = ctk.CTkImage(light_image=Image.open("images/caution.png"),
-                                        dark_image=Image.open("images/caution.png"), size=(50, 50))
+        ms_warning_image = load_image("images/caution.png", size=(50, 50))
         ms_warning_image_label = ctk.CTkLabel(ms_rename_popup, image=ms_warning_image, text="")
         ms_warning_image_label.pack(side="top")
         ms_warning_label = ctk.CTkLabel(ms_rename_popup, text="Enter words for Renaming")
@@ -819,21 +1159,91 @@ class TabView(ctk.CTkTabview):
 
     def confirm_rename(self, popup, files, find_pattern, replace_pattern):
         if find_pattern and replace_pattern:
-            self.multi_search_handler.multi_rename_files(files, find_pattern, replace_pattern)
             popup.destroy()
-            self.perform_search()
+            self.start_file_operation("Renaming",
+                                      lambda operation_id: self.show_journal_report("Renamed", operation_id),
+                                      self.multi_search_handler.multi_rename_files, files, find_pattern,
+                                      replace_pattern)
 
     def get_selected_files(self):
-        selected_files = []
-        for widget in self.search_results_frame.winfo_children():
-            if isinstance(widget, ctk.CTkCheckBox) and widget.get() == 1:
-                selected_files.append(widget.cget("text"))
-        return selected_files
+        return self.search_results_list.get_selected()
+
+    ''' DiskUsage Functions '''
+
+    def scan_disk_usage(self):
+        # a second click while a scan is running cancels it
+        if self.disk_usage_worker and self.disk_usage_worker.is_alive():
+            self.disk_usage_worker.cancel()
+            self.du_scan_button.configure(state="disabled")
+            return
+        directory = self.du_directory_entry.get().strip()
+        if not directory or not os.path.isdir(directory):
+            self.app.user_feedback_label.configure(text="Choose a folder to scan")
+            return
+        self.app.show_progress = True
+        self.app.progress_message = None
+        self.app.update_user_feedback()
+        self.du_scan_button.configure(text="Cancel")
+        self.disk_usage_worker = DiskUsageWorker(self.disk_usage_handler, directory,
+                                                 force=bool(self.du_full_scan_switch.get()))
+        self.disk_usage_worker.start()
+        self.after(100, self.poll_disk_usage_worker)
+
+    def poll_disk_usage_worker(self):
+        report = None
+        finished = False
+        try:
+            while True:
+                event, data = self.disk_usage_worker.events.get_nowait()
+                if event == 'progress':
+                    self.app.progress_message = (f"DiskUsage: {data['directories_scanned']} folders, "
+                                                 f"{data['files_scanned']} files - {data['directory']}")
+                else:
+                    finished = True
+                    report = data if event == 'done' else None
+                    self.app.show_error = event == 'error'
+        except queue.Empty:
+            pass
+
+        if not finished:
+            self.app.update_user_feedback()
+            self.after(100, self.poll_disk_usage_worker)
+            return
+        self.app.show_progress = False
+        self.app.progress_message = None
+        self.app.update_user_feedback()
+        self.du_scan_button.configure(text="Scan", state="normal")
+        if report:
+            self.app.user_feedback_label.configure(
+                text=f"Scanned {report['directories']} folders, {report['rescanned']} listed again, "
+                     f"{report['reused']} from the cache")
+            self.show_disk_usage(report['root'])
+
+    def show_disk_usage(self, directory):
+        total = self.disk_usage_handler.total_size(directory)
+        lines = []
+        if total is None:
+            lines.append("Not scanned yet.")
+        else:
+            lines.append(f"{directory}: {format_size(total)}\n")
+            lines.append("Largest folders")
+            lines.extend(f"  {format_size(size):>10}  {path}"
+                         for path, size, _ in self.disk_usage_handler.top_directories(directory))
+            lines.append("\nLargest files")
+            lines.extend(f"  {format_size(size):>10}  {path}"
+                         for path, size in self.disk_usage_handler.top_files(directory))
+        self.du_results_textbox.configure(state="normal")
+        self.du_results_textbox.delete("1.0", "end")
+        self.du_results_textbox.insert("1.0", "\n".join(lines))
+        self.du_results_textbox.configure(state="disabled")
 
 
 def main():
     ctk.set_default_color_theme("green")
     app = App()
+    mark_startup("window")
+    print("Startup: " + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in startup_times)
+          + f" (total {sum(seconds for _, seconds in startup_times) * 1000:.0f} ms)")
     app.mainloop()
 
 
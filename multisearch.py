@@ -1,9 +1,69 @@
 import os
-import shutil
+import time
+import queue
+import datetime
+import threading
 from database import DatabaseHandler
+from searchindex import SearchIndex
+from query import Query, QueryError, is_query, parse_query
+from parallelsearch import ParallelSearch, root_directories
+from fileops import FileOperationEngine
+from journal import OperationJournal
+
+INDEX_MAX_AGE_HOURS = 24  # indexed roots older than this are rebuilt in the background
+SEARCH_BATCH_SIZE = 500
+SEARCH_BATCH_SECONDS = 0.1  # a partial batch is handed over after this long so slow walks still show hits
+
+
+class SearchWorker(threading.Thread):
+    # runs a search off the UI thread; the UI polls `events` for ('batch' | 'done' | 'cancelled' | 'error', data)
+    def __init__(self, multi_search_handler, keyword, directory):
+        super().__init__(daemon=True)
+        self.multi_search_handler = multi_search_handler
+        self.keyword = keyword
+        self.directory = directory
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            for batch in self.multi_search_handler.iter_search(self.keyword, self.directory, self.cancel_event):
+                self.events.put(('batch', batch))
+            self.events.put(('cancelled' if self.cancel_event.is_set() else 'done', None))
+        except QueryError as e:
+            self.error = str(e)
+            self.events.put(('error', str(e)))
+        except Exception as e:
+            self.error = str(e)
+            self.multi_search_handler.db_handler.log_error(f"Error searching {self.directory}: {str(e)}")
+            self.events.put(('error', str(e)))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+
+class FileOperationWorker(threading.Thread):
+    # runs a delete, copy, rename or undo batch off the UI thread; the UI polls `events` for
+    # ('progress' | 'done' | 'error', data), progress being (files_processed, files_total)
+    def __init__(self, multi_search_handler, function, *args):
+        super().__init__(daemon=True)
+        self.multi_search_handler = multi_search_handler
+        self.function = function
+        self.args = args
+        self.events = queue.Queue()
+
+    def run(self):
+        try:
+            result = self.function(*self.args, progress=lambda done, total: self.events.put(('progress', (done, total))))
+            self.events.put(('done', result))
+        except Exception as e:
+            self.multi_search_handler.db_handler.log_error(f"Error in file operation: {str(e)}")
+            self.events.put(('error', str(e)))
+
 
 class MultiSearchHandler:
-    def __init__(self):
+    def __init__(self, background=True):
         self.db_handler = DatabaseHandler()
         self.found_files = []
         # file extensions that are valid for batch renaming
@@ -17,61 +77,185 @@ class MultiSearchHandler:
             ".py", ".java", ".c", ".cpp", ".h", ".html", ".css", ".js", ".php", ".xml",  # Programming/scripting formats
             ".zip", ".rar", ".tar.gz", ".7z",  # Archive formats
             ".exe", ".app", ".bat", ".sh"]  # Executable formats
+        self.file_operations = FileOperationEngine(self.db_handler)
+        self.journal = OperationJournal(self.db_handler)
+        self.search_index = SearchIndex()
+        if not background:
+            return  # one-shot searches skip resuming batches, index watchers and index refreshes
+        threading.Thread(target=self.journal.resume_incomplete, daemon=True).start()
+        self.search_index.watch_all()
+        threading.Thread(target=self.refresh_stale_indexes, daemon=True).start()
+
+    def build_search_index(self, directory):
+        self.search_index.build(directory)
+        self.search_index.watch(directory)
+        return self.search_index.get_stats()
+
+    def refresh_stale_indexes(self):
+        threshold = datetime.datetime.now() - datetime.timedelta(hours=INDEX_MAX_AGE_HOURS)
+        for root in self.search_index.get_stats()['roots']:
+            if datetime.datetime.fromisoformat(root['built_at']) < threshold:
+                try:
+                    self.search_index.build(root['root'])
+                except Exception as e:
+                    self.db_handler.log_error(f"Error refreshing search index for {root['root']}: {str(e)}")
 
     def multi_search_for_files(self, keyword, directory):
         self.found_files = []
+        for batch in self.iter_search(keyword, directory):
+            self.found_files.extend(batch)
+        return self.found_files
+
+    def iter_search(self, keyword, directory, cancel_event=None, batch_size=SEARCH_BATCH_SIZE):
+        # yields hits in batches as they are found, so callers never wait for the whole walk;
+        # keyword is either a plain keyword, a query string like 'ext:pdf size:>10MB' or a Query;
+        # without a directory every drive is searched in parallel
+        if not directory:
+            yield from self.iter_search_all(keyword, cancel_event=cancel_event, batch_size=batch_size)
+            return
+        if isinstance(keyword, str) and is_query(keyword):
+            keyword = parse_query(keyword, directory)
+        if isinstance(keyword, Query):
+            yield from self.iter_query(keyword, directory, cancel_event, batch_size)
+            return
+
+        indexed_files = self.search_index.search(keyword, directory)
+        if indexed_files is not None:
+            # indexed roots answer from peanut_index.db instead of walking the disk
+            for i in range(0, len(indexed_files), batch_size):
+                yield indexed_files[i:i + batch_size]
+            return
+
+        batch = []
+        last_batch = time.monotonic()
         for root, dirs, files in os.walk(directory):
+            if cancel_event is not None and cancel_event.is_set():
+                return
             for file in files:
                 if keyword in file:
-                    self.found_files.append(os.path.join(root, file))
-        return self.found_files
+                    batch.append(os.path.join(root, file))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+                        last_batch = time.monotonic()
+            if batch and time.monotonic() - last_batch >= SEARCH_BATCH_SECONDS:
+                yield batch
+                batch = []
+                last_batch = time.monotonic()
+        if batch:
+            yield batch
 
-    def get_root_directories(self):
-        if os.name == 'nt':  # Windows
-            return [f"{chr(d)}:\\" for d in range(ord('A'), ord('Z') + 1) if os.path.exists(f"{chr(d)}:\\")]
-        else:  # Unix-based (Linux, macOS)
-            return ['/']
+    def iter_query(self, query, directory, cancel_event=None, batch_size=SEARCH_BATCH_SIZE):
+        batch = []
+        last_batch = time.monotonic()
+        for file_path in self.query_candidates(query, directory, cancel_event):
+            batch.append(file_path)
+            if len(batch) >= batch_size or time.monotonic() - last_batch >= SEARCH_BATCH_SECONDS:
+                yield batch
+                batch = []
+                last_batch = time.monotonic()
+        if batch:
+            yield batch
 
-    def multi_delete_files(self, files):
-        for file in files:
-            try:
-                os.remove(file)
-                self.db_handler.log_action('Delete', file, 'File deleted successfully')
-            except FileNotFoundError:
-                self.db_handler.log_action('Delete', file, 'File not found', success=False)
+    def query_candidates(self, query, directory, cancel_event=None):
+        # an indexed root narrows the candidates by the longest plain word without touching the disk
+        word = max(query.words, key=len, default=None)
+        indexed_files = self.search_index.search(word, directory) if word else None
+        if indexed_files is not None:
+            for file_path in indexed_files:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                if not (query.match_path(file_path) and query.match_name(os.path.basename(file_path))):
+                    continue
+                if query.needs_stat:
+                    try:
+                        if not query.match_stat(os.stat(file_path)):
+                            continue
+                    except OSError:
+                        continue
+                yield file_path
+            return
+
+        for start_directory in query.start_directories(directory):
+            stack = [start_directory]
+            while stack:
+                if cancel_event is not None and cancel_event.is_set():
+                    return
+                try:
+                    with os.scandir(stack.pop()) as it:
+                        entries = list(it)
+                except OSError:
+                    continue
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                stack.append(entry.path)
+                        # name predicates first; the stat comes from the DirEntry and is only taken for survivors
+                        elif query.match_name(entry.name) and (not query.needs_stat or query.match_stat(entry.stat())):
+                            yield entry.path
+                    except OSError:
+                        continue
+
+    def iter_search_all(self, keyword, roots=None, cancel_event=None, batch_size=SEARCH_BATCH_SIZE,
+                        include_network=False):
+        roots = roots or self.get_root_directories(include_network)
+        if isinstance(keyword, str) and is_query(keyword):
+            keyword = parse_query(keyword, roots[0] if roots else '.')
+        if isinstance(keyword, Query):
+            query = keyword
+            roots = [start for root in roots for start in query.start_directories(root)]
+
+            def match(entry):
+                return query.match_name(entry.name) and (not query.needs_stat or query.match_stat(entry.stat()))
+        else:
+            def match(entry):
+                return keyword in entry.name
+
+        search = ParallelSearch(match, cancel_event=cancel_event, on_error=self.db_handler.log_error)
+        yield from search.run(roots, batch_size, SEARCH_BATCH_SECONDS)
+
+    def get_root_directories(self, include_network=False):
+        # fixed and removable drives on Windows; network drives and CD drives are left out unless asked for
+        return root_directories(include_network)
 
-    def multi_copy_files(self, files, new_folder):
+    def multi_delete_files(self, files, progress=None):
+        # deleted files go to the journal's staging folder first, so the batch can be undone
+        operation_id, _ = self.journal.run('Delete', [('delete', file, None) for file in files], progress=progress)
+        return operation_id
+
+    def multi_copy_files(self, files, new_folder, progress=None):
+        return self.file_operations.copy_files(files, new_folder, progress)
+
+    def multi_rename_files(self, files, find_pattern, replace_pattern, progress=None):
+        steps = []
         for file in files:
-            try:
-                os.makedirs(new_folder, exist_ok=True)
-                shutil.copy(file, new_folder)
-                self.db_handler.log_action('Copy', file, f'File copied to {new_folder}')
-            except FileNotFoundError:
-                self.db_handler.log_action('Copy', file, 'File not found', success=False)
-            except shutil.Error as e:
-                self.db_handler.log_action('Copy', file, str(e), success=False)
-
-    def multi_rename_files(self, files, find_pattern, replace_pattern):
-        try:
-            for file in files:
-                file_extension = os.path.splitext(file)[1]
-                if file_extension.lower() in self.valid_extensions:
-                    directory, filename = os.path.split(file)
-                    filename_without_ext, ext = os.path.splitext(filename)
-
-                    if find_pattern == '+':
-                        new_filename = f"{replace_pattern}{filename_without_ext}{ext}"
-                    elif find_pattern == '-':
-                        new_filename = f"{filename_without_ext}{replace_pattern}{ext}"
-                    else:
-                        new_filename = filename.replace(find_pattern, replace_pattern)
-
-                    new_path = os.path.join(directory, new_filename)
-
-                    if os.path.exists(file):
-                        os.rename(file, new_path)
-                        self.db_handler.log_action('Rename', file, f'File renamed to {new_path}')
+            file_extension = os.path.splitext(file)[1]
+            if file_extension.lower() in self.valid_extensions:
+                directory, filename = os.path.split(file)
+                filename_without_ext, ext = os.path.splitext(filename)
+
+                if find_pattern == '+':
+                    new_filename = f"{replace_pattern}{filename_without_ext}{ext}"
+                elif find_pattern == '-':
+                    new_filename = f"{filename_without_ext}{replace_pattern}{ext}"
                 else:
-                    self.db_handler.log_action('Rename', file, f"Invalid file extension: {file_extension}. File skipped.", success=False)
-        except Exception as e:
-            self.db_handler.log_action('Rename', file, str(e), success=False)
+                    new_filename = filename.replace(find_pattern, replace_pattern)
+
+                new_path = os.path.join(directory, new_filename)
+                if new_path != file:
+                    steps.append(('move', file, new_path))
+            else:
+                self.db_handler.log_action('Rename', file, f"Invalid file extension: {file_extension}. File skipped.", success=False)
+        if not steps:
+            self.db_handler.flush_logs()
+            return None
+        # a file that cannot be renamed is recorded in the journal and the rest of the batch carries on
+        operation_id, _ = self.journal.run('Rename', steps, progress=progress)
+        return operation_id
+
+    def undo_last_operation(self, progress=None):
+        operation = self.journal.last_operation()
+        if operation is None:
+            return None
+        return operation['action_type'], self.journal.undo(operation['operation_id'], progress=progress)
@@ -0,0 +1,158 @@
+import os
+import time
+import queue
+import string
+import threading
+
+SEARCH_WORKERS = min(16, (os.cpu_count() or 1) * 2)  # directory listing waits on the disk, so more threads than cores
+# mount points that are never worth searching; more are read from /proc/mounts by file system type
+SKIP_DIRECTORIES = ('/proc', '/sys', '/dev', '/run')
+PSEUDO_FILESYSTEMS = {'proc', 'sysfs', 'devtmpfs', 'devpts', 'cgroup', 'cgroup2', 'debugfs', 'tracefs',
+                      'securityfs', 'pstore', 'bpf', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs', 'autofs',
+                      'binfmt_misc', 'efivarfs', 'rpc_pipefs', 'nsfs'}
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'ncpfs', '9p', 'fuse.sshfs', 'davfs',
+                       'fuse.rclone', 'glusterfs', 'ceph'}
+DRIVE_REMOTE = 4  # GetDriveTypeW
+DRIVE_CDROM = 5
+
+
+def read_mounts():
+    # (mount point, file system type) pairs on Linux, nothing elsewhere
+    mounts = []
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    # spaces in mount points are escaped as \040
+                    mounts.append((fields[1].replace('\\040', ' '), fields[2]))
+    except OSError:
+        pass
+    return mounts
+
+
+def skipped_directories(include_network=False):
+    if os.name == 'nt':
+        return set()
+    skipped = set(SKIP_DIRECTORIES)
+    for mount_point, fs_type in read_mounts():
+        if fs_type in PSEUDO_FILESYSTEMS or (not include_network and fs_type in NETWORK_FILESYSTEMS):
+            skipped.add(mount_point)
+    return skipped
+
+
+def drive_type(drive):
+    import ctypes
+    return ctypes.windll.kernel32.GetDriveTypeW(drive)
+
+
+def root_directories(include_network=False):
+    if os.name == 'nt':
+        drives = [f"{letter}:\\" for letter in string.ascii_uppercase if os.path.exists(f"{letter}:\\")]
+        skipped_types = {DRIVE_CDROM} if include_network else {DRIVE_CDROM, DRIVE_REMOTE}
+        return [drive for drive in drives if drive_type(drive) not in skipped_types]
+    return ['/']
+
+
+class ParallelSearch:
+    # every directory is a separate work item on one shared queue, so idle threads pick up whatever is left
+    # of any root and one deep subtree cannot hold up the others
+    def __init__(self, match, workers=SEARCH_WORKERS, skip=None, cancel_event=None, on_error=None):
+        self.match = match
+        self.workers = workers
+        self.skip = skip if skip is not None else skipped_directories()
+        self.cancel_event = cancel_event
+        self.on_error = on_error
+        self.directories = queue.Queue()
+        self.results = queue.Queue()
+        self.outstanding = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.directories_scanned = 0
+
+    @property
+    def cancelled(self):
+        return self.stopped.is_set() or (self.cancel_event is not None and self.cancel_event.is_set())
+
+    def run(self, roots, batch_size=500, batch_seconds=0.1):
+        # generator of result batches merged from every worker as they arrive; within a batch results are
+        # ordered by root, in the order roots were given, and then by path
+        for rank, root in enumerate(roots):
+            self.push(root, rank)
+        if not self.outstanding:
+            return
+        threads = [threading.Thread(target=self.work, daemon=True, name=f'peanut-search-{i}')
+                   for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        batch = []
+        last_batch = time.monotonic()
+        finished = 0
+        try:
+            while finished < len(threads):
+                try:
+                    item = self.results.get(timeout=batch_seconds)
+                except queue.Empty:
+                    item = []
+                if item is None:
+                    finished += 1
+                    continue
+                batch.extend(item)
+                if batch and (len(batch) >= batch_size or time.monotonic() - last_batch >= batch_seconds):
+                    yield [path for _, path in sorted(batch)]
+                    batch = []
+                    last_batch = time.monotonic()
+            if batch:
+                yield [path for _, path in sorted(batch)]
+        finally:
+            self.stopped.set()
+            self.release_workers()
+
+    def push(self, directory, rank):
+        if directory in self.skip:
+            return
+        with self.lock:
+            self.outstanding += 1
+        self.directories.put((directory, rank))
+
+    def release_workers(self):
+        for _ in range(self.workers):
+            self.directories.put(None)
+
+    def work(self):
+        try:
+            while True:
+                item = self.directories.get()
+                if item is None:
+                    return
+                if not self.cancelled:
+                    self.scan_directory(*item)
+                with self.lock:
+                    self.outstanding -= 1
+                    done = self.outstanding == 0
+                if done:
+                    self.release_workers()
+        finally:
+            self.results.put(None)
+
+    def scan_directory(self, directory, rank):
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return
+        with self.lock:
+            self.directories_scanned += 1
+        found = []
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        self.push(entry.path, rank)
+                elif self.match(entry):
+                    found.append((rank, entry.path))
+            except OSError as e:
+                if self.on_error:
+                    self.on_error(f"Error searching {entry.path}: {str(e)}")
+        if found:
+            self.results.put(found)
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import contextlib
+import datetime
+
+# headless entry point: only the handlers and the database are imported, never the UI, so scheduled
+# jobs start quickly and run without a display
+
+
+def emit(payload):
+    # stdout carries nothing but one JSON document per line; handler prints go to stderr
+    sys.__stdout__.write(json.dumps(payload, default=str) + '\n')
+    sys.__stdout__.flush()
+
+
+def clean_now(args):
+    from autoclean import AutoCleanHandler
+    handler = AutoCleanHandler()
+    started = time.perf_counter()
+    handler.activate_selected_AC(force=True)
+    return {
+        'command': 'clean-now',
+        'cleaned': {
+            'empty_folders': bool(handler.clean_empty_folders_flag),
+            'unused_files': bool(handler.clean_unused_files_flag),
+            'duplicate_files': bool(handler.clean_duplicate_files_flag),
+            'recycling_bin': bool(handler.clean_recycling_bin_flag),
+            'browser_history': bool(handler.clean_browser_history_flag)
+        },
+        'next_cleaning_time': handler.next_cleaning_time,
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def direct_once(args):
+    from autodirect import AutoDirectHandler
+    handler = AutoDirectHandler(watch=False)
+    started = time.perf_counter()
+    directories = handler.reconcile_all()
+    return {
+        'command': 'direct-once',
+        'directories': directories,
+        'moved': sum(counts.get('done', 0) for counts in directories.values()),
+        'failed': sum(counts.get('failed', 0) for counts in directories.values()),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def search(args):
+    from multisearch import MultiSearchHandler
+    handler = MultiSearchHandler(background=False)
+    started = time.perf_counter()
+    directory = os.path.abspath(args.directory) if args.directory else None
+    results = []
+    count = 0
+    for batch in handler.iter_search(args.keyword, directory):
+        if args.limit:
+            batch = batch[:args.limit - count]
+        count += len(batch)
+        if args.lines:
+            for path in batch:
+                emit({'path': path})
+        else:
+            results.extend(batch)
+        if args.limit and count >= args.limit:
+            break
+    result = {'command': 'search', 'keyword': args.keyword, 'directory': directory, 'count': count,
+              'seconds': round(time.perf_counter() - started, 3)}
+    if not args.lines:
+        result['results'] = results
+    return result
+
+
+def disk_usage(args):
+    from diskusage import DiskUsageHandler
+    handler = DiskUsageHandler()
+    directory = args.directory or handler.default_directory()
+    report = handler.scan(directory, force=args.full)
+    report.update({
+        'command': 'disk-usage',
+        'largest_directories': [{'path': path, 'size': size, 'files': files}
+                                for path, size, files in handler.top_directories(directory, args.top)],
+        'largest_files': [{'path': path, 'size': size} for path, size in handler.top_files(directory, args.top)]
+    })
+    return report
+
+
+def daemon(args):
+    from autoclean import AutoCleanHandler
+    from autodirect import AutoDirectHandler
+    from database import DatabaseHandler
+    from journal import OperationJournal
+    stop = threading.Event()
+    for signal_name in ('SIGINT', 'SIGTERM'):
+        if hasattr(signal, signal_name):
+            signal.signal(getattr(signal, signal_name), lambda *_: stop.set())
+    # batches cut short by a crash are finished, and old staging folders purged, before any watcher can move files
+    OperationJournal(DatabaseHandler()).resume_incomplete()
+    auto_clean_handler = AutoCleanHandler()
+    auto_direct_handler = AutoDirectHandler()
+    auto_clean_handler.resume_operations()
+    emit({'event': 'started', 'pid': os.getpid(), 'next_cleaning_time': auto_clean_handler.next_cleaning_time,
+          'redirect_directories': list(auto_direct_handler.matchers), 'time': datetime.datetime.now()})
+    while not stop.wait(1):
+        pass
+    auto_clean_handler.pause_operations()
+    auto_direct_handler.pause_operations()
+    auto_direct_handler.db_handler.flush_logs()
+    return {'event': 'stopped', 'time': datetime.datetime.now()}
+
+
+def fail(command, message):
+    emit({'command': command, 'error': message})
+    return 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='peanut', description='Run Peanut without its window.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('clean-now', help='run the enabled AutoClean cleaners once').set_defaults(run=clean_now)
+    commands.add_parser('direct-once', help='apply every AutoDirect rule once').set_defaults(run=direct_once)
+    search_parser = commands.add_parser('search', help='search for files like the MultiSearch tab')
+    search_parser.add_argument('keyword', help="a keyword or a query such as 'ext:pdf size:>10MB'")
+    search_parser.add_argument('directory', nargs='?', help='folder to search; every drive when left out')
+    search_parser.add_argument('--limit', type=int, default=0, help='stop after this many results')
+    search_parser.add_argument('--lines', action='store_true', help='print one JSON line per result as it is found')
+    search_parser.set_defaults(run=search)
+    disk_usage_parser = commands.add_parser('disk-usage', help='add up folder sizes and list the largest')
+    disk_usage_parser.add_argument('directory', nargs='?', help='folder to scan; the home folder when left out')
+    disk_usage_parser.add_argument('--top', type=int, default=20, help='how many folders and files to list')
+    disk_usage_parser.add_argument('--full', action='store_true', help='ignore sizes cached by earlier scans')
+    disk_usage_parser.set_defaults(run=disk_usage)
+    commands.add_parser('daemon', help='run scheduled cleaning and AutoDirect watchers until stopped'
+                        ).set_defaults(run=daemon)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            result = args.run(args)
+    except Exception as e:
+        return fail(args.command, str(e))
+    emit(result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+import os
+import re
+import math
+import time
+import shlex
+import fnmatch
+import datetime
+
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'kb': 1024, 'm': 1024 ** 2, 'mb': 1024 ** 2,
+              'g': 1024 ** 3, 'gb': 1024 ** 3, 't': 1024 ** 4, 'tb': 1024 ** 4}
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+PREDICATES = ('ext', 'glob', 're', 'size', 'mtime', 'atime', 'path')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def parse_size(text):
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([a-zA-Z]*)', text.strip())
+    if not match or match.group(2).lower() not in SIZE_UNITS:
+        raise QueryError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def parse_time(text, now):
+    # an age like 7d is measured back from now, anything else has to be an ISO date
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdwy])', text.strip())
+    if match:
+        return now - float(match.group(1)) * AGE_UNITS[match.group(2)], True
+    try:
+        return datetime.datetime.fromisoformat(text.strip()).timestamp(), False
+    except ValueError:
+        raise QueryError(f"Invalid date or age: {text}")
+
+
+def exclusive(value, direction):
+    # ranges stay inclusive (low, high) pairs, so a strict bound moves to the next value past it
+    if isinstance(value, int):
+        return value + direction
+    return math.nextafter(value, math.inf * direction)
+
+
+def bound(operator, value, strict):
+    if operator == '<':
+        return None, exclusive(value, -1) if strict else value
+    return (exclusive(value, 1) if strict else value), None
+
+
+def parse_range(text, parse_value):
+    # '<x', '<=x', '>x', '>=x', 'a..b' or a bare value, returned as an inclusive (low, high) pair with None for
+    # open ends; '<' and '>' are strict, 'a..b' includes both ends
+    if '..' in text:
+        low, high = text.split('..', 1)
+        return (parse_value(low) if low else None), (parse_value(high) if high else None)
+    if text[:2] in ('<=', '>='):
+        return bound(text[0], parse_value(text[2:]), strict=False)
+    if text[:1] in ('<', '>'):
+        return bound(text[0], parse_value(text[1:]), strict=True)
+    return parse_value(text), parse_value(text)
+
+
+def parse_time_range(text, now):
+    # ages read as 'age < 7d' (changed within the last week), dates as 'date > 2024-01-01';
+    # both end up as a (low, high) timestamp range
+    if '..' in text:
+        first, second = [parse_time(value, now)[0] if value else None for value in text.split('..', 1)]
+        if first is not None and second is not None and first > second:
+            first, second = second, first
+        return first, second
+    operator = text[:1] if text[:1] in ('<', '>') else ''
+    strict = bool(operator) and text[1:2] != '='
+    timestamp, is_age = parse_time(text[len(operator):].lstrip('='), now)
+    if not operator:
+        # a bare age means 'within', a bare date means that whole day
+        return (timestamp, None) if is_age else (timestamp, exclusive(timestamp + 86400, -1))
+    if is_age:
+        operator = '>' if operator == '<' else '<'
+    return bound(operator, timestamp, strict)
+
+
+class Query:
+    # name predicates run on the bare file name, stat predicates only for files that passed them
+    def __init__(self):
+        self.words = []
+        self.extensions = []
+        self.globs = []
+        self.patterns = []
+        self.path_prefixes = []
+        self.size_range = None
+        self.mtime_range = None
+        self.atime_range = None
+
+    @property
+    def needs_stat(self):
+        return any(r is not None for r in (self.size_range, self.mtime_range, self.atime_range))
+
+    def match_name(self, name):
+        if any(word not in name for word in self.words):
+            return False
+        if self.extensions and not name.lower().endswith(tuple(self.extensions)):
+            return False
+        if any(not fnmatch.fnmatch(name, pattern) for pattern in self.globs):
+            return False
+        return all(pattern.search(name) for pattern in self.patterns)
+
+    def match_stat(self, st):
+        return (in_range(st.st_size, self.size_range) and in_range(st.st_mtime, self.mtime_range)
+                and in_range(st.st_atime, self.atime_range))
+
+    def match_path(self, path):
+        return not self.path_prefixes or any(path == prefix or path.startswith(os.path.join(prefix, ''))
+                                             for prefix in self.path_prefixes)
+
+    def start_directories(self, directory):
+        # path: predicates below the searched folder narrow the walk itself instead of filtering its results
+        directory = os.path.abspath(directory)
+        if not self.path_prefixes:
+            return [directory]
+        starts = []
+        for prefix in self.path_prefixes:
+            if prefix == directory or prefix.startswith(os.path.join(directory, '')):
+                starts.append(prefix)
+            elif directory.startswith(os.path.join(prefix, '')):
+                starts.append(directory)
+        return starts
+
+
+def in_range(value, value_range):
+    if value_range is None:
+        return True
+    low, high = value_range
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def is_query(text):
+    # anything without a known 'name:' token is a plain keyword and is searched literally, as before
+    return any(token.split(':', 1)[0].lower() in PREDICATES
+               for token in text.split() if ':' in token)
+
+
+def parse_query(text, directory='.'):
+    query = Query()
+    now = time.time()
+    # quotes group words with spaces; backslashes are kept for regexes and Windows paths
+    lexer = shlex.shlex(text, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ''
+    try:
+        tokens = list(lexer)
+    except ValueError as e:
+        raise QueryError(str(e))
+    for token in tokens:
+        name, _, value = token.partition(':')
+        name = name.lower()
+        if not value or name not in PREDICATES:
+            query.words.append(token)
+        elif name == 'ext':
+            query.extensions.extend('.' + ext.lower().lstrip('.') for ext in value.split(',') if ext)
+        elif name == 'glob':
+            query.globs.append(value)
+        elif name == 're':
+            try:
+                query.patterns.append(re.compile(value))
+            except re.error as e:
+                raise QueryError(f"Invalid regular expression {value}: {e}")
+        elif name == 'size':
+            query.size_range = parse_range(value, parse_size)
+        elif name == 'mtime':
+            query.mtime_range = parse_time_range(value, now)
+        elif name == 'atime':
+            query.atime_range = parse_time_range(value, now)
+        elif name == 'path':
+            query.path_prefixes.append(os.path.abspath(os.path.join(directory, os.path.expanduser(value))))
+    return query
@@ -0,0 +1,242 @@
+import os
+import time
+import fnmatch
+
+PROGRESS_INTERVAL = 0.1  # seconds between two progress callbacks
+
+
+def is_within(path, directory):
+    return path == directory or path.startswith(os.path.join(directory, ''))
+
+
+class ScanVisitor:
+    scanner = None
+
+    def start(self, root_directory):
+        pass
+
+    def wants_files(self, directory):
+        # called once per listed directory; return False when its files need not be stat'ed,
+        # e.g. because a cache still holds their sizes
+        return True
+
+    def visit_file(self, file_path, st):
+        # return True when the file was removed so later visitors skip it
+        return False
+
+    def leave_directory(self, directory, entry_count, is_root):
+        # entry_count only counts what is still there after the subtree was visited;
+        # return True when the directory was removed so its parent's count drops too
+        return False
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class ScanPolicy:
+    # which part of a root a scan may touch; globs match a name or a path relative to the root ('a/*/cache').
+    # Excluded directories and anything below max_depth are pruned before they are ever listed
+    def __init__(self, root_directory, include_globs=(), exclude_globs=(), max_depth=None, follow_symlinks=False):
+        self.root_directory = root_directory
+        self.include_globs = list(include_globs)
+        self.exclude_globs = list(exclude_globs)
+        self.max_depth = max_depth
+        self.follow_symlinks = follow_symlinks
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root_directory).replace(os.sep, '/')
+
+    def matches(self, path, globs):
+        name = os.path.basename(path)
+        relative = self.relative(path)
+        return any(fnmatch.fnmatch(name, glob) or fnmatch.fnmatch(relative, glob) for glob in globs)
+
+    def depth(self, path):
+        relative = self.relative(path)
+        return 0 if relative == '.' else relative.count('/') + 1
+
+    def allows_directory(self, path, depth):
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        return not self.exclude_globs or not self.matches(path, self.exclude_globs)
+
+    def allows_file(self, path):
+        if self.exclude_globs and self.matches(path, self.exclude_globs):
+            return False
+        return not self.include_globs or self.matches(path, self.include_globs)
+
+    def allows_path(self, directory):
+        # a directory that did not come from the walk itself, e.g. a watcher event, is only scanned
+        # when none of its ancestors would have been pruned
+        path = self.root_directory
+        relative = self.relative(directory)
+        if relative == '.':
+            return True
+        if relative == '..' or relative.startswith('../'):
+            return False
+        for depth, part in enumerate(relative.split('/'), start=1):
+            path = os.path.join(path, part)
+            if not self.allows_directory(path, depth):
+                return False
+        return True
+
+
+class DirectoryScanner:
+    def __init__(self, db_handler, visitors, on_progress=None, cancel_event=None, policy=None):
+        self.db_handler = db_handler
+        self.visitors = visitors
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.policy = policy
+        self.last_progress = 0.0
+        self.files_scanned = 0
+        self.directories_scanned = 0
+        self.items_removed = 0
+        self.entry_counts = {}
+        self.left_directories = set()
+        self.root_directory = None
+        self.targets = None
+        self.real_root = None
+        self.linked_targets = set()
+
+    def scan(self, root_directory, targets=None):
+        # targets limits the walk to a list of (directory, recursive) pairs below root_directory,
+        # e.g. the dirty paths recorded by the watcher since the last clean
+        self.root_directory = root_directory
+        self.targets = targets
+        self.entry_counts = {}
+        self.left_directories = set()
+        self.real_root = os.path.realpath(root_directory)
+        self.linked_targets = set()
+        for visitor in self.visitors:
+            visitor.scanner = self
+            visitor.start(root_directory)
+        try:
+            if targets is None:
+                self.walk(root_directory)
+            else:
+                for directory, recursive in targets:
+                    self.walk(directory, recursive)
+            if not self.cancelled:
+                for visitor in self.visitors:
+                    visitor.finish()
+            self.report_progress(root_directory, force=True)
+        finally:
+            for visitor in self.visitors:
+                visitor.close()
+
+    def walk(self, top_directory, recursive=True):
+        # each directory is listed exactly once; it is pushed back as a 'leave' marker so that
+        # visitors see it again after everything below it has been visited
+        policy = self.policy
+        follow_symlinks = policy is not None and policy.follow_symlinks
+        # linked marks directories reached through a followed symlink
+        stack = [(top_directory, False, policy.depth(top_directory) if policy else 0, False)]
+        while stack and not self.cancelled:
+            directory, leaving, depth, linked = stack.pop()
+            if leaving:
+                self.leave_directory(directory)
+                continue
+
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue  # unreadable directories are skipped, like os.walk does
+            self.directories_scanned += 1
+            self.report_progress(directory)
+            self.entry_counts[directory] = len(entries)
+            stack.append((directory, True, depth, linked))
+            # every visitor is asked, so each one sees every directory
+            visit_files = any([visitor.wants_files(directory) for visitor in self.visitors])
+
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=follow_symlinks):
+                        # pruned subtrees still count as entries, so their parent is never taken for empty
+                        if (recursive or directory != top_directory) \
+                                and (policy is None or policy.allows_directory(entry.path, depth + 1)) \
+                                and self.visit_once(entry, linked):
+                            stack.append((entry.path, False, depth + 1, linked or entry.is_symlink()))
+                    elif visit_files and entry.is_file(follow_symlinks=follow_symlinks) \
+                            and (policy is None or policy.allows_file(entry.path)) \
+                            and self.visit_once(entry, linked):
+                        self.visit_file(entry, follow_symlinks)
+                except OSError as e:
+                    self.db_handler.log_error(f"Error scanning {entry.path}: {str(e)}")
+
+    def visit_once(self, entry, linked):
+        # with follow_symlinks every file is handed to the visitors under one path only, so a file is never taken
+        # for its own duplicate. A link into the root (or to a folder above it) is skipped, the target is visited
+        # under its own path; targets outside the root are entered or visited once, however many links lead there
+        if entry.is_symlink():
+            target = os.path.realpath(entry.path)
+            if is_within(target, self.real_root) or is_within(self.real_root, target):
+                return False
+        elif not linked:
+            return True
+        st = entry.stat()
+        if (st.st_dev, st.st_ino) in self.linked_targets:
+            return False
+        self.linked_targets.add((st.st_dev, st.st_ino))
+        return True
+
+    def visit_file(self, entry, follow_symlinks=False):
+        st = entry.stat(follow_symlinks=follow_symlinks)  # cached by scandir on Windows, one lstat elsewhere
+        self.files_scanned += 1
+        for visitor in self.visitors:
+            if visitor.visit_file(entry.path, st):
+                self.entry_removed(entry.path)
+                break
+
+    @property
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def report_progress(self, directory, force=False):
+        if not self.on_progress:
+            return
+        now = time.monotonic()
+        if force or now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            self.on_progress(self, directory)
+
+    def is_inside_root(self, path):
+        return path == self.root_directory or path.startswith(os.path.join(self.root_directory, ''))
+
+    def count_outside_target(self, directory):
+        # a partial scan removed the last entry of a directory it never listed; list it once so
+        # the removal can still cascade towards the root
+        try:
+            self.entry_counts[directory] = len(os.listdir(directory))
+        except OSError:
+            return
+        self.left_directories.add(directory)
+        if self.entry_counts[directory] == 0:
+            self.leave_directory(directory)
+
+    def leave_directory(self, directory):
+        self.left_directories.add(directory)
+        entry_count = self.entry_counts[directory]
+        for visitor in self.visitors:
+            if visitor.leave_directory(directory, entry_count, directory == self.root_directory):
+                self.entry_removed(directory)
+                break
+
+    def entry_removed(self, path):
+        # child counts are kept in memory, so removals cascade upwards without listing a directory again
+        self.items_removed += 1
+        self.entry_counts.pop(path, None)
+        self.left_directories.discard(path)
+        parent = os.path.dirname(path)
+        if parent not in self.entry_counts:
+            if self.targets is not None and self.is_inside_root(parent):
+                self.count_outside_target(parent)
+            return
+        self.entry_counts[parent] -= 1
+        if self.entry_counts[parent] == 0 and parent in self.left_directories:
+            # the parent was already left (e.g. a duplicate below it was removed late), visit it again
+            self.leave_directory(parent)
@@ -0,0 +1,120 @@
+import time
+import heapq
+import datetime
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEDULER_WORKERS = 2  # jobs running at once; cleans and reconcile walks are disk heavy
+MAX_SLEEP_SECONDS = 300  # wake up at least this often so a changed system clock or a resume from sleep is noticed
+
+
+class Job:
+    def __init__(self, job_id, function, args, deadline, interval=None):
+        self.job_id = job_id
+        self.function = function
+        self.args = args
+        self.deadline = deadline
+        self.interval = interval
+
+
+class Scheduler:
+    # one thread sleeps until the earliest deadline of every Peanut job and hands due jobs to a small pool;
+    # job ids are namespaced ('autoclean:', 'autodirect:') so each handler only ever replaces its own jobs
+    def __init__(self, workers=SCHEDULER_WORKERS):
+        self.jobs = {}
+        self.heap = []
+        self.running = set()
+        self.waiting = {}  # one-shot jobs that came due while the same id was still running
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.workers = workers
+        self.executor = None
+        self.thread = None
+
+    def every(self, job_id, seconds, function, *args, first_run=None):
+        self.add(Job(job_id, function, args, self.timestamp(first_run) or time.time() + seconds, seconds))
+
+    def at(self, job_id, when, function, *args):
+        # a time that has already passed runs straight away, which is how missed runs are caught up
+        self.add(Job(job_id, function, args, self.timestamp(when)))
+
+    def add(self, job):
+        with self.condition:
+            self.jobs[job.job_id] = job
+            self.push(job)
+            if self.thread is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='peanut-scheduler')
+                self.thread = threading.Thread(target=self.run, daemon=True, name='peanut-scheduler')
+                self.thread.start()
+            self.condition.notify()
+
+    def push(self, job):
+        heapq.heappush(self.heap, (job.deadline, next(self.sequence), job))
+
+    def cancel(self, job_id):
+        with self.condition:
+            self.jobs.pop(job_id, None)
+            self.condition.notify()
+
+    def cancel_all(self, prefix):
+        with self.condition:
+            for job_id in [job_id for job_id in self.jobs if job_id.startswith(prefix)]:
+                del self.jobs[job_id]
+            self.condition.notify()
+
+    def next_run(self, job_id):
+        job = self.jobs.get(job_id)
+        return datetime.datetime.fromtimestamp(job.deadline) if job else None
+
+    def timestamp(self, when):
+        if isinstance(when, datetime.datetime):
+            return when.timestamp()
+        return when
+
+    def run(self):
+        with self.condition:
+            while True:
+                # cancelled or rescheduled jobs leave stale heap entries behind, they are dropped here
+                while self.heap and self.jobs.get(self.heap[0][2].job_id) is not self.heap[0][2]:
+                    heapq.heappop(self.heap)
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, _, job = self.heap[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self.condition.wait(min(delay, MAX_SLEEP_SECONDS))
+                    continue
+                heapq.heappop(self.heap)
+                if job.interval:
+                    # runs missed while the machine slept collapse into one
+                    job.deadline = max(deadline + job.interval, time.time())
+                    self.push(job)
+                if job.job_id in self.running:
+                    # still busy with the previous run, never overlap a job with itself; an interval job just
+                    # waits for its next turn, a one-shot job runs as soon as the previous run finishes
+                    if not job.interval:
+                        self.waiting[job.job_id] = job
+                    continue
+                if not job.interval:
+                    del self.jobs[job.job_id]
+                self.running.add(job.job_id)
+                self.executor.submit(self.execute, job)
+
+    def execute(self, job):
+        try:
+            job.function(*job.args)
+        except Exception as e:
+            print(f"Scheduled job {job.job_id} failed: {e}")
+        finally:
+            with self.condition:
+                self.running.discard(job.job_id)
+                waiting = self.waiting.pop(job.job_id, None)
+                if waiting is not None and self.jobs.get(job.job_id) is waiting:
+                    self.push(waiting)
+                    self.condition.notify()
+
+
+# one scheduler thread per process, shared by every handler instance
+scheduler = Scheduler()
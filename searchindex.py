@@ -0,0 +1,263 @@
+import os
+import sqlite3
+import threading
+import time
+import datetime
+from watchdog.events import FileSystemEventHandler
+from watcher import directory_watcher
+from database import connect, delayed_writes
+
+INDEX_FILE = 'peanut_index.db'
+INSERT_BATCH_SIZE = 5000
+INDEX_FLUSH_DELAY = 2.0  # seconds of quiet before watcher events are written to the index
+
+
+class IndexUpdater(FileSystemEventHandler):
+    # keeps an indexed root fresh from watcher events instead of rebuilding it
+    def __init__(self, search_index, root_directory):
+        self.search_index = search_index
+        self.root_directory = root_directory
+        self.added = set()
+        self.removed = set()
+        # a moved or deleted folder is a single event on inotify, so whole subtrees are dropped and walked again
+        self.added_directories = set()
+        self.removed_directories = set()
+        self.lock = threading.Lock()
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.record_directory(added=event.src_path)
+        else:
+            self.record(added=event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.record_directory(removed=event.src_path)
+        else:
+            self.record(removed=event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.record_directory(added=event.dest_path, removed=event.src_path)
+        else:
+            self.record(added=event.dest_path, removed=event.src_path)
+
+    def record(self, added=None, removed=None):
+        with self.lock:
+            if removed:
+                self.added.discard(removed)
+                self.removed.add(removed)
+            if added:
+                self.removed.discard(added)
+                self.added.add(added)
+            delayed_writes.schedule(self, INDEX_FLUSH_DELAY, self.flush)
+
+    def record_directory(self, added=None, removed=None):
+        with self.lock:
+            if removed:
+                prefix = os.path.join(removed, '')
+                self.added = {path for path in self.added if not path.startswith(prefix)}
+                self.added_directories = {path for path in self.added_directories
+                                          if path != removed and not path.startswith(prefix)}
+                self.removed_directories.add(removed)
+            if added:
+                self.added_directories.add(added)
+            delayed_writes.schedule(self, INDEX_FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        with self.lock:
+            added, self.added = self.added, set()
+            removed, self.removed = self.removed, set()
+            added_directories, self.added_directories = self.added_directories, set()
+            removed_directories, self.removed_directories = self.removed_directories, set()
+            delayed_writes.cancel(self)
+        if not (added or removed or added_directories or removed_directories):
+            return
+        # the folders are walked now, so their files are indexed as they are on disk at this point
+        for directory in added_directories:
+            for root, _, files in os.walk(directory):
+                added.update(os.path.join(root, file) for file in files)
+        try:
+            self.search_index.update_paths(self.root_directory, added, removed, removed_directories)
+        except sqlite3.OperationalError as e:
+            # usually a build holding the write lock past the busy timeout; events recorded since win over these
+            print(f"Index update for {self.root_directory} postponed: {e}")
+            with self.lock:
+                self.added |= added - self.removed
+                self.removed |= removed - self.added
+                self.removed_directories |= removed_directories
+                delayed_writes.schedule(self, INDEX_FLUSH_DELAY, self.flush, restart=False)
+
+
+class SearchIndex:
+    # filename index kept next to peanut.db; substring lookups go through an FTS5 trigram table
+    def __init__(self, index_file=INDEX_FILE):
+        self.index_file = index_file
+        self.use_fts = True
+        self.last_query_time = None
+        self.create_tables()
+
+    def connect(self):
+        return connect(self.index_file)
+
+    def create_tables(self):
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS IndexedRoots (
+                        root TEXT PRIMARY KEY,
+                        file_count INTEGER,
+                        build_seconds REAL,
+                        built_at TEXT
+                     )''')
+        c.execute('''CREATE TABLE IF NOT EXISTS IndexedFiles (
+                        file_id INTEGER PRIMARY KEY,
+                        name TEXT,
+                        directory TEXT,
+                        root TEXT
+                     )''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_indexedfiles_root ON IndexedFiles (root)''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_indexedfiles_path ON IndexedFiles (directory, name)''')
+        try:
+            # case_sensitive keeps the same semantics as the `keyword in file` search
+            c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS FileNameTrigrams
+                         USING fts5(name, content='IndexedFiles', content_rowid='file_id',
+                                    tokenize="trigram case_sensitive 1")''')
+        except sqlite3.OperationalError:
+            # SQLite without the trigram tokenizer (older than 3.34) falls back to scanning names with instr()
+            self.use_fts = False
+        conn.commit()
+
+    def build(self, root_directory):
+        root_directory = os.path.abspath(root_directory)
+        started = time.perf_counter()
+        conn = self.connect()
+        c = conn.cursor()
+        # the root is dropped from IndexedRoots first, so searches walk the disk until the new index is complete;
+        # each batch is its own transaction and watcher updates and other writers get the lock in between
+        c.execute('''DELETE FROM IndexedRoots WHERE root = ?''', (root_directory,))
+        self.delete_where(c, '''root = ?''', (root_directory,))
+        conn.commit()
+        file_count = 0
+        batch = []
+        for root, _, files in os.walk(root_directory):
+            for file in files:
+                batch.append((file, root, root_directory))
+            if len(batch) >= INSERT_BATCH_SIZE:
+                self.insert(c, batch)
+                conn.commit()
+                file_count += len(batch)
+                batch = []
+        self.insert(c, batch)
+        file_count += len(batch)
+        build_seconds = time.perf_counter() - started
+        c.execute('''INSERT OR REPLACE INTO IndexedRoots (root, file_count, build_seconds, built_at)
+                     VALUES (?, ?, ?, ?)''', (root_directory, file_count, build_seconds,
+                                              datetime.datetime.now().isoformat()))
+        conn.commit()
+        return file_count
+
+    def insert(self, c, rows):
+        if not c.connection.in_transaction:
+            # the new file ids are read back below, so no other writer may insert in between
+            c.execute('''BEGIN IMMEDIATE''')
+        c.execute('''SELECT COALESCE(MAX(file_id), 0) FROM IndexedFiles''')
+        last_id = c.fetchone()[0]
+        c.executemany('''INSERT INTO IndexedFiles (name, directory, root) VALUES (?, ?, ?)''', rows)
+        if self.use_fts:
+            c.execute('''INSERT INTO FileNameTrigrams (rowid, name)
+                         SELECT file_id, name FROM IndexedFiles WHERE file_id > ?''', (last_id,))
+
+    def delete_where(self, c, condition, params):
+        if self.use_fts:
+            # external content tables need the old values to drop their trigrams
+            c.execute(f'''INSERT INTO FileNameTrigrams (FileNameTrigrams, rowid, name)
+                          SELECT 'delete', file_id, name FROM IndexedFiles WHERE {condition}''', params)
+        c.execute(f'''DELETE FROM IndexedFiles WHERE {condition}''', params)
+
+    def remove_root(self, root_directory):
+        root_directory = os.path.abspath(root_directory)
+        self.unwatch(root_directory)
+        conn = self.connect()
+        c = conn.cursor()
+        self.delete_where(c, '''root = ?''', (root_directory,))
+        c.execute('''DELETE FROM IndexedRoots WHERE root = ?''', (root_directory,))
+        conn.commit()
+
+    def update_paths(self, root_directory, added=(), removed=(), removed_directories=()):
+        conn = self.connect()
+        c = conn.cursor()
+        for directory in removed_directories:
+            prefix = os.path.join(directory, '')
+            self.delete_where(c, '''directory = ? OR (directory >= ? AND directory < ?)''',
+                              (directory, prefix, prefix + '\uffff'))
+        # an added path may already be indexed, e.g. a file saved by replacing it, and is never listed twice
+        for path in set(removed) | set(added):
+            self.delete_where(c, '''directory = ? AND name = ?''', os.path.split(path))
+        self.insert(c, [(os.path.basename(path), os.path.dirname(path), root_directory) for path in added])
+        c.execute('''UPDATE IndexedRoots SET file_count = (SELECT COUNT(*) FROM IndexedFiles WHERE root = ?)
+                     WHERE root = ?''', (root_directory, root_directory))
+        conn.commit()
+
+    def watch(self, root_directory):
+        root_directory = os.path.abspath(root_directory)
+        directory_watcher.watch(f"searchindex:{root_directory}", root_directory, IndexUpdater(self, root_directory))
+
+    def unwatch(self, root_directory):
+        directory_watcher.unwatch(f"searchindex:{os.path.abspath(root_directory)}")
+
+    def watch_all(self):
+        for root in self.get_roots():
+            self.watch(root)
+
+    def get_roots(self):
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute('''SELECT root FROM IndexedRoots''')
+        roots = [row[0] for row in c.fetchall()]
+        return roots
+
+    def indexed_root_for(self, directory):
+        # the indexed root that contains directory, if any
+        directory = os.path.abspath(directory)
+        for root in self.get_roots():
+            if directory == root or directory.startswith(os.path.join(root, '')):
+                return root
+        return None
+
+    def search(self, keyword, directory):
+        root = self.indexed_root_for(directory)
+        if root is None:
+            return None
+        started = time.perf_counter()
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, '')
+        conn = self.connect()
+        c = conn.cursor()
+        if self.use_fts and len(keyword) >= 3:
+            phrase = '"' + keyword.replace('"', '""') + '"'
+            c.execute('''SELECT f.directory, f.name FROM FileNameTrigrams t JOIN IndexedFiles f ON f.file_id = t.rowid
+                         WHERE FileNameTrigrams MATCH ? AND f.root = ?
+                               AND (f.directory = ? OR (f.directory >= ? AND f.directory < ?))''',
+                      (phrase, root, directory, prefix, prefix + '\uffff'))
+        else:
+            # trigrams need at least three characters
+            c.execute('''SELECT directory, name FROM IndexedFiles
+                         WHERE root = ? AND instr(name, ?) > 0
+                               AND (directory = ? OR (directory >= ? AND directory < ?))''',
+                      (root, keyword, directory, prefix, prefix + '\uffff'))
+        found_files = [os.path.join(parent, name) for parent, name in c.fetchall()]
+        self.last_query_time = time.perf_counter() - started
+        return found_files
+
+    def get_stats(self):
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute('''SELECT root, file_count, build_seconds, built_at FROM IndexedRoots''')
+        roots = [{'root': row[0], 'file_count': row[1], 'build_seconds': row[2], 'built_at': row[3]}
+                 for row in c.fetchall()]
+        return {
+            'roots': roots,
+            'size_on_disk': sum(os.path.getsize(path) for path in (self.index_file, self.index_file + '-wal')
+                                if os.path.exists(path)),
+            'last_query_seconds': self.last_query_time
+        }
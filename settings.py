@@ -0,0 +1,110 @@
+import atexit
+import threading
+from database import delayed_writes
+
+SETTINGS_WRITE_DELAY = 0.5  # seconds of quiet before changed settings are written to peanut.db
+CUSTOM_FOLDER_COUNT = 3
+
+AUTOCLEAN_DEFAULTS = {
+    'clean_empty_folders_flag': False,
+    'clean_unused_files_flag': False,
+    'clean_duplicate_files_flag': False,
+    'clean_recycling_bin_flag': False,
+    'clean_browser_history_flag': False,
+    'autoclean_frequency': None,
+    'next_cleaning_time': None,
+    'hash_algorithm': None,
+    'hash_workers': None,
+    'incremental_flag': False
+}
+USER_DEFAULTS = {'status': 0, 'ui_size': 100, 'theme': 'system'}
+
+
+class SettingsStore:
+    # settings are read once and served from memory; changes are written back in one transaction
+    # after a short quiet period, so a burst of switch clicks costs a single write off the UI thread
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.dirty = set()
+        self.autoclean = dict(AUTOCLEAN_DEFAULTS)
+        self.autoclean.update(db_handler.get_autoclean_settings() or {})
+        self.user = dict(USER_DEFAULTS)
+        self.user.update(db_handler.get_user_settings() or {})
+        self.custom_folders = db_handler.get_custom_folders()
+
+    def get_autoclean(self):
+        with self.lock:
+            return dict(self.autoclean)
+
+    def update_autoclean(self, **values):
+        self.update('autoclean', self.autoclean, values)
+
+    def get_user(self):
+        with self.lock:
+            return dict(self.user)
+
+    def update_user(self, **values):
+        self.update('user', self.user, values)
+
+    def get_custom_folder_path(self, index):
+        folder = self.custom_folders.get(int(index))
+        return folder[0] if folder else None
+
+    def get_custom_folder_name(self, index):
+        folder = self.custom_folders.get(int(index))
+        return folder[1] if folder and folder[1] else f"Custom folder {index}"
+
+    def set_custom_folder(self, index, folder_path, folder_name):
+        with self.lock:
+            self.custom_folders[int(index)] = (folder_path, folder_name)
+            self.dirty.add('custom_folders')
+            self.schedule_write()
+
+    def update(self, section, settings, values):
+        with self.lock:
+            changed = {key: value for key, value in values.items() if settings.get(key) != value}
+            if not changed:
+                return
+            settings.update(changed)
+            self.dirty.add(section)
+            self.schedule_write()
+
+    def schedule_write(self):
+        delayed_writes.schedule(self, SETTINGS_WRITE_DELAY, self.flush)
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                delayed_writes.cancel(self)
+                dirty, self.dirty = self.dirty, set()
+                autoclean = dict(self.autoclean) if 'autoclean' in dirty else None
+                user = dict(self.user) if 'user' in dirty else None
+                custom_folders = dict(self.custom_folders) if 'custom_folders' in dirty else None
+            if not dirty:
+                return
+            try:
+                self.db_handler.save_settings(autoclean=autoclean, user=user, custom_folders=custom_folders)
+            except Exception as e:
+                with self.lock:
+                    self.dirty |= dirty  # keep them for the next write
+                self.db_handler.log_error(f"Error saving settings: {str(e)}")
+
+
+settings_stores = {}
+settings_stores_lock = threading.Lock()
+
+
+def get_settings_store(db_handler):
+    # every handler on the same database file shares one store, so they never see stale copies of each other
+    with settings_stores_lock:
+        if db_handler.db_file not in settings_stores:
+            settings_stores[db_handler.db_file] = SettingsStore(db_handler)
+        return settings_stores[db_handler.db_file]
+
+
+@atexit.register
+def flush_all_settings():
+    for settings_store in list(settings_stores.values()):
+        settings_store.flush()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import journal
+import settings
+
+
+@pytest.fixture
+def db_handler(tmp_path, monkeypatch):
+    # DatabaseHandler opens peanut.db in the working directory; connections, schema checks, log buffers and
+    # settings stores are cached per file name, so every test starts from a clean slate in its own folder
+    monkeypatch.chdir(tmp_path)
+    reset_database_state()
+    yield database.DatabaseHandler()
+    database.flush_all_logs()
+    reset_database_state()
+
+
+def reset_database_state():
+    for conn in getattr(database.local_connections, 'connections', {}).values():
+        conn.close()
+    database.local_connections.connections = {}
+    database.initialized_files.clear()
+    database.log_buffers.clear()
+    journal.resumed_files.clear()
+    settings.settings_stores.clear()
@@ -0,0 +1,74 @@
+import os
+import threading
+
+from autoclean import AutoCleanWorker, EmptyFolderVisitor
+from scanner import DirectoryScanner, ScanVisitor
+
+
+class RemoveEverything(ScanVisitor):
+    def visit_file(self, file_path, st):
+        os.remove(file_path)
+        return True
+
+
+def test_empty_folders_collapse_bottom_up_in_one_walk(db_handler, tmp_path, monkeypatch):
+    root = tmp_path / 'root'
+    (root / 'a' / 'b' / 'c').mkdir(parents=True)
+    (root / 'kept').mkdir()
+    (root / 'kept' / 'file.txt').write_text('x')
+    listed = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: listed.append(path) or real_scandir(path))
+    visitor = EmptyFolderVisitor(db_handler)
+    DirectoryScanner(db_handler, [visitor]).scan(str(root))
+
+    assert sorted(os.listdir(root)) == ['kept']
+    assert visitor.removed == 3
+    assert len(listed) == len(set(listed))
+
+
+def test_a_folder_emptied_by_another_visitor_is_removed_in_the_same_walk(db_handler, tmp_path):
+    root = tmp_path / 'root'
+    (root / 'old' / 'older').mkdir(parents=True)
+    (root / 'old' / 'older' / 'unused.txt').write_text('x')
+    (root / 'old' / 'unused.txt').write_text('x')
+    visitor = EmptyFolderVisitor(db_handler)
+    DirectoryScanner(db_handler, [RemoveEverything(), visitor]).scan(str(root))
+    assert os.listdir(root) == []
+    assert visitor.removed == 2
+
+
+class FakeAutoCleanHandler:
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+        self.started = threading.Event()
+
+    def activate_selected_AC(self, force=False, progress=None, cancel_event=None):
+        progress({'files_scanned': 1})
+        self.started.set()
+        cancel_event.wait(5)
+
+
+def drain(worker):
+    worker.join(5)
+    events = []
+    while not worker.events.empty():
+        events.append(worker.events.get())
+    return events
+
+
+def test_the_worker_streams_progress_and_reports_a_cancel(db_handler):
+    handler = FakeAutoCleanHandler(db_handler)
+    worker = AutoCleanWorker(handler)
+    worker.start()
+    assert handler.started.wait(5)
+    worker.cancel()
+    assert drain(worker) == [('progress', {'files_scanned': 1}), ('cancelled', None)]
+
+
+def test_the_worker_reports_errors_instead_of_dying(db_handler):
+    handler = FakeAutoCleanHandler(db_handler)
+    handler.activate_selected_AC = lambda **kwargs: 1 / 0
+    worker = AutoCleanWorker(handler)
+    worker.start()
+    assert drain(worker) == [('error', 'division by zero')]
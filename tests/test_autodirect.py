@@ -0,0 +1,80 @@
+import os
+import time
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent
+
+import autodirect
+from autodirect import AutoDirectHandler, KeywordMatcher, RedirectEventHandler
+
+
+def make_handler(tmp_path, rules):
+    # rules are (keyword, destination folder name) reading from tmp_path/source
+    source = tmp_path / 'source'
+    source.mkdir()
+    redirects = []
+    for redirect_id, (keyword, folder) in enumerate(rules, start=1):
+        (tmp_path / folder).mkdir(exist_ok=True)
+        redirects.append((redirect_id, keyword, str(source), str(tmp_path / folder)))
+    handler = AutoDirectHandler(watch=False)
+    handler.matchers = {str(source): KeywordMatcher(redirects)}
+    return handler, source
+
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_files_settling_together_are_moved_as_one_operation(db_handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(autodirect, 'DEBOUNCE_SECONDS', 0.1)
+    handler, source = make_handler(tmp_path, [('pdf', 'docs')])
+    for name in ('a.pdf', 'b.pdf', 'c.pdf', 'notes.txt'):
+        (source / name).write_text(name)
+        handler.queue_file(str(source / name))
+    assert wait_for(lambda: len(os.listdir(tmp_path / 'docs')) == 3)
+    operations = db_handler.get_operations(action_types=('redirect',))
+    assert len(operations) == 1
+    assert db_handler.count_operation_steps(operations[0]['operation_id']) == {'done': 3}
+    assert os.listdir(source) == ['notes.txt']
+
+
+def test_a_file_still_being_written_waits_for_its_last_change(db_handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(autodirect, 'DEBOUNCE_SECONDS', 0.3)
+    handler, source = make_handler(tmp_path, [('pdf', 'docs')])
+    (source / 'a.pdf').write_text('a')
+    handler.queue_file(str(source / 'a.pdf'))
+    for _ in range(3):
+        time.sleep(0.15)
+        handler.queue_file(str(source / 'a.pdf'), only_if_pending=True)
+    assert os.path.exists(source / 'a.pdf')
+    assert wait_for(lambda: os.path.exists(tmp_path / 'docs' / 'a.pdf'))
+
+
+def test_every_source_is_watched_and_reconciled_right_away(db_handler, tmp_path, monkeypatch):
+    jobs, watches = [], []
+    monkeypatch.setattr(autodirect.scheduler, 'every',
+                        lambda key, interval, function, *args, first_run=None: jobs.append((key, args, first_run)))
+    monkeypatch.setattr(autodirect.directory_watcher, 'watch', lambda key, directory, handler: watches.append(key))
+    (tmp_path / 'source').mkdir()
+    db_handler.add_redirect('pdf', str(tmp_path / 'source'), str(tmp_path / 'docs'))
+    db_handler.add_redirect('jpg', str(tmp_path / 'source'), str(tmp_path / 'pictures'))
+    started = time.time()
+    AutoDirectHandler()
+
+    # one job and one watch per source folder, however many rules read from it
+    assert [(key, args) for key, args, _ in jobs] == [(f"autodirect:reconcile:{tmp_path / 'source'}",
+                                                      (str(tmp_path / 'source'),))]
+    assert started <= jobs[0][2] <= time.time()
+    assert watches == [f"autodirect:{tmp_path / 'source'}"]
+
+
+def test_watcher_events_queue_only_new_or_pending_files(db_handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(autodirect, 'DEBOUNCE_SECONDS', 60)
+    handler, source = make_handler(tmp_path, [('pdf', 'docs')])
+    events = RedirectEventHandler(handler)
+    events.on_modified(FileModifiedEvent(str(source / 'old.pdf')))
+    events.on_created(FileCreatedEvent(str(source / 'new.pdf')))
+    events.on_moved(FileMovedEvent(str(tmp_path / 'elsewhere.pdf'), str(source / 'moved.pdf')))
+    assert sorted(handler.pending_files) == [str(source / 'moved.pdf'), str(source / 'new.pdf')]
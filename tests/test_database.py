@@ -0,0 +1,103 @@
+import threading
+import time
+
+import database
+from database import DatabaseHandler, connect
+
+
+def user_version(db_file):
+    return connect(db_file).execute('''PRAGMA user_version''').fetchone()[0]
+
+
+def tables(db_file):
+    return {row[0] for row in connect(db_file).execute('''SELECT name FROM sqlite_master WHERE type = 'table' ''')}
+
+
+def test_a_new_file_gets_every_migration(db_handler):
+    assert user_version(db_handler.db_file) == len(db_handler.migrations())
+    expected = {'Redirects', 'ActionLogs', 'Operations', 'OperationSteps', 'AutoCleanPolicies'}
+    assert expected <= tables(db_handler.db_file)
+
+
+def test_an_old_file_is_migrated_from_its_recorded_version(db_handler):
+    # a file written by the first release: the base schema only, user_version 1
+    old = DatabaseHandler.__new__(DatabaseHandler)
+    old.db_file = 'old.db'
+    conn = connect(old.db_file)
+    old.migrate_base_schema(conn.cursor())
+    conn.execute('''PRAGMA user_version = 1''')
+    conn.commit()
+    assert 'Operations' not in tables(old.db_file)
+
+    old.create_tables()
+    assert user_version(old.db_file) == len(old.migrations())
+    assert {'Operations', 'OperationSteps', 'AutoCleanPolicies'} <= tables(old.db_file)
+
+
+def test_migrations_are_not_run_twice(db_handler):
+    db_handler.add_operation('Rename', [('move', 'a', 'b')], None)
+    database.initialized_files.clear()
+    DatabaseHandler()
+    assert db_handler.count_operation_steps(1) == {'pending': 1}
+
+
+def action_rows(db_file):
+    return connect(db_file).execute('''SELECT COUNT(*) FROM ActionLogs''').fetchone()[0]
+
+
+def test_log_rows_wait_in_memory_until_the_batch_is_full(db_handler, monkeypatch):
+    monkeypatch.setattr(database, 'LOG_BATCH_SIZE', 3)
+    monkeypatch.setattr(database, 'LOG_FLUSH_SECONDS', 60)
+    db_handler.log_action('Copy', 'a', 'b')
+    db_handler.log_error('something failed')
+    assert action_rows(db_handler.db_file) == 0
+    # actions and errors share one batch
+    db_handler.log_action('Copy', 'c', 'd')
+    assert action_rows(db_handler.db_file) == 2
+    assert db_handler.get_latest_error() == {'description': 'something failed'}
+
+
+def test_a_partial_batch_is_written_after_a_short_delay(db_handler, monkeypatch):
+    monkeypatch.setattr(database, 'LOG_FLUSH_SECONDS', 0.05)
+    db_handler.log_action('Copy', 'a', 'b', success=False)
+    deadline = time.monotonic() + 3
+    while action_rows(db_handler.db_file) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db_handler.get_action_logs()[0]['success'] is False
+
+
+def connection_on_new_thread(db_file):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(connect(db_file)))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_each_thread_keeps_one_connection_per_file(db_handler):
+    conn = connect(db_handler.db_file)
+    assert connect(db_handler.db_file) is conn
+    assert connect('other.db') is not conn
+    assert connection_on_new_thread(db_handler.db_file) is not conn
+    assert conn.execute('''PRAGMA journal_mode''').fetchone()[0] == 'wal'
+
+
+def test_readers_are_not_blocked_by_an_open_write(db_handler):
+    db_handler.add_redirect('pdf', 'from', 'to')
+    writer = connect(db_handler.db_file)
+    writer.execute('''BEGIN IMMEDIATE''')
+    writer.execute('''DELETE FROM Redirects''')
+    rows = []
+    thread = threading.Thread(target=lambda: rows.extend(db_handler.get_redirects()))
+    thread.start()
+    thread.join(5)
+    writer.rollback()
+    assert len(rows) == 1
+
+
+def test_a_transaction_left_open_is_rolled_back_on_the_next_call(db_handler):
+    conn = connect(db_handler.db_file)
+    conn.execute('''BEGIN IMMEDIATE''')
+    conn.execute('''DELETE FROM AutoCleanPolicies''')
+    assert connect(db_handler.db_file) is conn and not conn.in_transaction
+    assert db_handler.get_autoclean_policies()
@@ -0,0 +1,25 @@
+import os
+import shutil
+
+from diskusage import DiskUsageHandler
+
+
+def make_tree(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'big').mkdir(parents=True)
+    (root / 'small').mkdir()
+    (root / 'big' / 'a.bin').write_bytes(b'x' * 5000)
+    (root / 'small' / 'b.bin').write_bytes(b'x' * 100)
+    (root / 'c.bin').write_bytes(b'x' * 10)
+    return root
+
+
+def test_deleted_folders_disappear_after_a_full_rescan(db_handler, tmp_path):
+    root = make_tree(tmp_path)
+    handler = DiskUsageHandler()
+    handler.scan(str(root))
+    shutil.rmtree(root / 'big')
+    report = handler.scan(str(root), force=True)
+    assert report['total_size'] == 110
+    assert [path for path, _, _ in handler.top_directories(str(root))] == [str(root / 'small')]
+    assert [path for path, _ in handler.top_files(str(root))] == [str(root / 'small' / 'b.bin'), str(root / 'c.bin')]
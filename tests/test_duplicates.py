@@ -0,0 +1,155 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+import duplicates
+from database import connect
+from duplicates import DuplicateFinder, HashCache
+
+SAMPLE = 1024
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def make_files(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    content = bytes(range(256)) * 40
+    # same size as the copies, and the same head and tail, so only the full hash tells it apart
+    changed = bytearray(content)
+    changed[len(content) // 2] ^= 0xff
+    return str(root), {
+        'original': write(root / 'a.bin', content),
+        'copy': write(root / 'b.bin', content),
+        'same_sample': write(root / 'c.bin', bytes(changed)),
+        'unique_size': write(root / 'd.bin', content + b'!'),
+    }
+
+
+def test_only_identical_files_are_reported(db_handler, tmp_path):
+    root, files = make_files(tmp_path)
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, workers=2)
+    pairs = list(finder.find_duplicates(root))
+    assert len(pairs) == 1
+    assert set(pairs[0]) == {files['original'], files['copy']}
+
+
+def test_each_stage_only_hashes_files_that_are_still_candidates(db_handler, tmp_path):
+    root, files = make_files(tmp_path)
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, workers=2)
+    list(finder.find_duplicates(root))
+    # the file with a unique size is never opened
+    assert finder.stats['size']['files'] == 4
+    assert finder.stats['partial']['files'] == 3
+    assert finder.stats['partial']['bytes_read'] == 3 * 2 * SAMPLE
+    assert finder.stats['full']['files'] == 3
+
+
+def test_cached_digests_are_reused_until_a_file_changes(db_handler, tmp_path):
+    root, files = make_files(tmp_path)
+    list(DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler)).find_duplicates(root))
+
+    cache = HashCache(db_handler)
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=cache)
+    assert len(list(finder.find_duplicates(root))) == 1
+    assert finder.stats['partial']['files'] == 0 and finder.stats['full']['files'] == 0
+    assert cache.misses == 0
+
+    with open(files['copy'], 'r+b') as f:
+        f.write(b'\xff')
+    st = os.stat(files['copy'])
+    os.utime(files['copy'], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler))
+    assert list(finder.find_duplicates(root)) == []
+    assert finder.stats['partial']['files'] == 1
+
+
+def test_a_zero_inode_does_not_invalidate_the_cache(db_handler):
+    cache = HashCache(db_handler)
+    entry = {'size': 10, 'mtime_ns': 5, 'inode': 0}
+    st = SimpleNamespace(st_size=10, st_mtime_ns=5, st_ino=1234)
+    assert cache.matches(entry, st)
+    assert not cache.matches(dict(entry, inode=99), st)
+
+
+def scan_part(db_handler, root, part):
+    # an incremental clean: files cached by the last scan, then the walk of the one folder that changed
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler))
+    finder.start(root)
+    try:
+        pairs = []
+        for path, st in finder.known_files(skip=lambda path: path.startswith(part)):
+            pairs += finder.add_file(path, st)
+        for name in sorted(os.listdir(part)):
+            path = os.path.join(part, name)
+            pairs += finder.add_file(path, os.stat(path))
+        pairs += finder.finish()
+        return pairs
+    finally:
+        finder.close()
+
+
+def test_known_files_trust_the_cache_until_they_are_kept_or_deleted(db_handler, tmp_path, monkeypatch):
+    root, files = make_files(tmp_path)
+    list(DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler)).find_duplicates(root))
+    part = tmp_path / 'root' / 'new'
+    part.mkdir()
+    write(part / 'x.bin', (tmp_path / 'root' / 'a.bin').read_bytes())
+
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda path, *args, **kwargs: stats.append(path) or real_stat(path, *args, **kwargs))
+    finder = DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler))
+    finder.start(root)
+    assert len(finder.known_files()) == 4 and stats == []
+    finder.close()
+
+    # the cached original is gone, so the copy that is kept is the next one in the walk
+    os.remove(files['original'])
+    assert scan_part(db_handler, root, str(part)) == [(files['copy'], str(part / 'x.bin'))]
+
+
+def test_rows_are_evicted_once_neither_they_nor_their_root_were_used(db_handler, tmp_path):
+    root, files = make_files(tmp_path)
+    list(DuplicateFinder(db_handler, sample_size=SAMPLE, hash_cache=HashCache(db_handler)).find_duplicates(root))
+    conn = connect(db_handler.db_file)
+    conn.execute('''UPDATE FileHashes SET last_used = '2000-01-01T00:00:00' ''')
+    conn.commit()
+    # the root was scanned just now, so even the row of the file that was never read is kept
+    assert HashCache(db_handler).evict() == 0
+
+    conn.execute('''UPDATE FileHashRoots SET last_used = '2000-01-01T00:00:00' ''')
+    conn.commit()
+    assert HashCache(db_handler).evict() == 4
+    assert db_handler.get_file_hashes(root) == {}
+
+
+def test_full_hashes_match_a_plain_read_through_buffer_and_mmap(db_handler, tmp_path, monkeypatch):
+    data = os.urandom(duplicates.CHUNK_SIZE * 2 + 123)
+    path = write(tmp_path / 'big.bin', data)
+    expected = hashlib.md5(data).hexdigest()
+    finder = DuplicateFinder(db_handler)
+    assert finder.hash_full(path, len(data)) == expected
+    monkeypatch.setattr(duplicates, 'MMAP_THRESHOLD', 1)
+    assert finder.hash_full(path, len(data)) == expected
+
+
+def test_several_hashing_workers_find_the_same_pairs_as_one(db_handler, tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    for group in range(10):
+        content = bytes([group]) * (3 * SAMPLE + group)
+        for copy in range(3):
+            write(root / f'{group}-{copy}.bin', content)
+
+    def removed(workers):
+        # which earlier copy a file is paired with depends on the order the workers finish in; the copies
+        # that would be removed do not
+        finder = DuplicateFinder(db_handler, sample_size=SAMPLE, workers=workers)
+        return sorted(duplicate for _, duplicate in finder.find_duplicates(str(root)))
+
+    assert len(removed(1)) == 20
+    assert removed(4) == removed(1)
@@ -0,0 +1,55 @@
+import errno
+import os
+
+from fileops import FileOperationEngine, copy_file_contents
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_copies_keep_their_order_and_never_overwrite_each_other(db_handler, tmp_path):
+    sources = [write(tmp_path / folder / 'a.txt', folder.encode()) for folder in ('one', 'two', 'three')]
+    missing = str(tmp_path / 'four' / 'a.txt')
+    destination = tmp_path / 'copies'
+    write(destination / 'a.txt', b'already there')
+    engine = FileOperationEngine(db_handler, workers=3)
+    results = engine.copy_files(sources + [missing], str(destination))
+
+    assert [result.path for result in results] == sources + [missing]
+    # the missing file reserves a name too before it fails, so which numbers are used depends on the workers
+    assert {result.destination for result in results[:3]} <= {str(destination / f'a ({i}).txt') for i in range(1, 5)}
+    assert len(os.listdir(destination)) == 4
+    assert {open(result.destination, 'rb').read() for result in results[:3]} == {b'one', b'two', b'three'}
+    assert not results[3].success and results[3].error == 'File not found'
+    assert engine.stats['files'] == 4 and engine.stats['failed'] == 1 and engine.stats['bytes'] == 11
+
+
+def test_an_unsupported_kernel_copy_falls_back_to_a_plain_one(tmp_path, monkeypatch):
+    data = os.urandom(100000)
+    src = write(tmp_path / 'src.bin', data)
+
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'cross-device link')
+    monkeypatch.setattr(os, 'copy_file_range', unsupported, raising=False)
+    monkeypatch.setattr(os, 'sendfile', unsupported, raising=False)
+    assert copy_file_contents(src, str(tmp_path / 'dst.bin')) == len(data)
+    assert (tmp_path / 'dst.bin').read_bytes() == data
+
+
+def test_a_kernel_copy_that_stops_early_is_finished_in_userspace(tmp_path, monkeypatch):
+    data = os.urandom(100000)
+    src = write(tmp_path / 'src.bin', data)
+    calls = []
+
+    def half_then_nothing(src_fd, dst_fd, count, offset_src, offset_dst):
+        calls.append(count)
+        if len(calls) > 1:
+            return 0
+        chunk = os.pread(src_fd, len(data) // 2, offset_src)
+        return os.pwrite(dst_fd, chunk, offset_dst)
+    monkeypatch.setattr(os, 'copy_file_range', half_then_nothing, raising=False)
+    assert copy_file_contents(src, str(tmp_path / 'dst.bin')) == len(data)
+    assert (tmp_path / 'dst.bin').read_bytes() == data
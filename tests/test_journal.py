@@ -0,0 +1,120 @@
+import os
+import datetime
+
+import database
+import journal
+from database import connect
+from journal import OperationJournal
+
+
+def make_journal(db_handler, tmp_path):
+    return OperationJournal(db_handler, staging_directory=str(tmp_path / 'staging'))
+
+
+def touch(path, text='x'):
+    path.write_text(text)
+    return str(path)
+
+
+def test_staged_deletes_can_be_undone(db_handler, tmp_path):
+    files = [touch(tmp_path / 'a.txt', 'a'), touch(tmp_path / 'b.txt', 'b')]
+    operations = make_journal(db_handler, tmp_path)
+    operation_id, counts = operations.run('Delete', [('delete', path, None) for path in files])
+    assert counts == {'done': 2}
+    assert not any(os.path.exists(path) for path in files)
+
+    assert operations.last_operation()['operation_id'] == operation_id
+    assert operations.undo(operation_id) == {'undone': 2}
+    assert [open(path).read() for path in files] == ['a', 'b']
+    assert not os.path.exists(tmp_path / 'staging' / str(operation_id))
+    assert operations.undo(operation_id) is None
+
+
+def test_a_failed_step_does_not_stop_the_batch(db_handler, tmp_path):
+    src = touch(tmp_path / 'a.txt')
+    operations = make_journal(db_handler, tmp_path)
+    _, counts = operations.run('Rename', [('move', str(tmp_path / 'missing.txt'), str(tmp_path / 'x.txt')),
+                                          ('move', src, str(tmp_path / 'b.txt'))])
+    assert counts == {'done': 1, 'failed': 1}
+    assert os.path.exists(tmp_path / 'b.txt')
+
+
+def test_undo_never_overwrites_a_file_created_since(db_handler, tmp_path):
+    src = touch(tmp_path / 'a.txt', 'old')
+    operations = make_journal(db_handler, tmp_path)
+    operation_id, _ = operations.run('Rename', [('move', src, str(tmp_path / 'b.txt'))])
+    touch(tmp_path / 'a.txt', 'new')
+    assert operations.undo(operation_id) == {'done': 1}
+    assert open(src).read() == 'new'
+
+
+def test_only_multisearch_batches_are_undone(db_handler, tmp_path):
+    operations = make_journal(db_handler, tmp_path)
+    rename_id, _ = operations.run('Rename', [('move', touch(tmp_path / 'a.txt'), str(tmp_path / 'b.txt'))])
+    operations.run('redirect', [('move', touch(tmp_path / 'c.txt'), str(tmp_path / 'd.txt'))])
+    assert operations.last_operation()['operation_id'] == rename_id
+
+
+def test_a_missing_source_only_counts_as_done_when_resuming(db_handler, tmp_path):
+    dst = touch(tmp_path / 'b.txt')
+    operations = make_journal(db_handler, tmp_path)
+    assert operations.apply('move', str(tmp_path / 'a.txt'), dst)
+    assert operations.apply('move', str(tmp_path / 'a.txt'), dst, resuming=True) is None
+
+
+def test_interrupted_operations_are_resumed(db_handler, tmp_path, monkeypatch):
+    moved = touch(tmp_path / 'a.txt')
+    pending = touch(tmp_path / 'c.txt')
+    operations = make_journal(db_handler, tmp_path)
+    operation_id = operations.plan('Rename', [('move', moved, str(tmp_path / 'b.txt')),
+                                              ('move', pending, str(tmp_path / 'd.txt'))])
+    # the first step reached the disk before the crash, the journal never heard about it
+    os.rename(moved, tmp_path / 'b.txt')
+    monkeypatch.setattr(journal, 'PROCESS_STARTED', '9999-12-31')
+    operations.resume_incomplete()
+    assert db_handler.get_operation(operation_id)['status'] == 'done'
+    assert db_handler.count_operation_steps(operation_id) == {'done': 2}
+    assert os.path.exists(tmp_path / 'd.txt')
+
+
+def test_operations_planned_by_this_process_are_not_resumed(db_handler, tmp_path, monkeypatch):
+    operations = make_journal(db_handler, tmp_path)
+    operation_id = operations.plan('redirect', [('move', touch(tmp_path / 'a.txt'), str(tmp_path / 'b.txt'))])
+    monkeypatch.setattr(journal, 'PROCESS_STARTED', '0001-01-01')
+    operations.resume_incomplete()
+    assert db_handler.get_operation(operation_id)['status'] == 'planned'
+
+
+def age_operation(db_handler, operation_id, days):
+    conn = connect(db_handler.db_file)
+    finished_at = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
+    conn.execute('''UPDATE Operations SET finished_at = ? WHERE operation_id = ?''', (finished_at, operation_id))
+    conn.commit()
+
+
+def test_old_staged_deletes_are_purged_behind_any_number_of_moves(db_handler, tmp_path):
+    operations = make_journal(db_handler, tmp_path)
+    delete_id, _ = operations.run('Delete', [('delete', touch(tmp_path / 'a.txt'), None)])
+    age_operation(db_handler, delete_id, journal.STAGING_MAX_AGE_DAYS + 1)
+    # AutoDirect journals every file it moves, so finished moves easily outnumber everything else
+    conn = connect(db_handler.db_file)
+    now = datetime.datetime.now().isoformat()
+    conn.executemany('''INSERT INTO Operations (action_type, status, created_at, finished_at)
+                        VALUES ('redirect', 'done', ?, ?)''', [(now, now)] * 1500)
+    conn.commit()
+    operations.purge_staging()
+    assert db_handler.get_operation(delete_id)['status'] == 'purged'
+    assert not os.path.exists(tmp_path / 'staging' / str(delete_id))
+
+
+def test_old_finished_operations_are_dropped(db_handler, tmp_path):
+    operations = make_journal(db_handler, tmp_path)
+    old_id, _ = operations.run('Rename', [('move', touch(tmp_path / 'a.txt'), str(tmp_path / 'b.txt'))])
+    new_id, _ = operations.run('Rename', [('move', touch(tmp_path / 'c.txt'), str(tmp_path / 'd.txt'))])
+    interrupted_id = operations.plan('Rename', [('move', touch(tmp_path / 'e.txt'), str(tmp_path / 'f.txt'))])
+    age_operation(db_handler, old_id, database.OPERATION_MAX_AGE_DAYS + 1)
+    operations.purge_staging()
+    assert db_handler.get_operation(old_id) is None
+    assert db_handler.count_operation_steps(old_id) == {}
+    assert db_handler.get_operation(new_id)['status'] == 'done'
+    assert db_handler.get_operation(interrupted_id)['status'] == 'planned'
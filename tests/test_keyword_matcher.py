@@ -0,0 +1,38 @@
+from autodirect import KeywordMatcher
+
+
+def redirect(redirect_id, keyword, to_directory):
+    return redirect_id, keyword, 'Downloads', to_directory
+
+
+def matched_ids(matcher, name):
+    return [r[0] for r in matcher.matches(name)]
+
+
+def test_every_keyword_in_the_name_matches_longest_first():
+    matcher = KeywordMatcher([redirect(1, 'pdf', '/docs'), redirect(2, 'invoice', '/invoices'),
+                              redirect(3, 'voice', '/audio')])
+    assert matched_ids(matcher, 'invoice_2024.pdf') == [2, 3, 1]
+    assert matched_ids(matcher, 'notes.txt') == []
+
+
+def test_ties_go_to_the_rule_created_first():
+    matcher = KeywordMatcher([redirect(7, 'abc', '/b'), redirect(4, 'xyz', '/a')])
+    assert matched_ids(matcher, 'xyz_abc') == [4, 7]
+
+
+def test_overlapping_keywords_are_found_through_failure_links():
+    matcher = KeywordMatcher([redirect(1, 'he', '/a'), redirect(2, 'she', '/b'), redirect(3, 'hers', '/c')])
+    assert matched_ids(matcher, 'ushers') == [3, 2, 1]
+
+
+def test_matching_is_case_sensitive_like_the_in_operator():
+    matcher = KeywordMatcher([redirect(1, 'Report', '/a')])
+    assert matched_ids(matcher, 'Report.docx') == [1]
+    assert matched_ids(matcher, 'report.docx') == []
+
+
+def test_an_empty_keyword_matches_everything_after_the_other_rules():
+    matcher = KeywordMatcher([redirect(1, '', '/everything'), redirect(2, 'pdf', '/docs')])
+    assert matched_ids(matcher, 'a.pdf') == [2, 1]
+    assert matched_ids(matcher, 'a.txt') == [1]
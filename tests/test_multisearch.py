@@ -0,0 +1,62 @@
+import os
+
+import multisearch
+from multisearch import MultiSearchHandler, SearchWorker
+
+
+def make_tree(tmp_path, count):
+    root = tmp_path / 'root'
+    for i in range(count):
+        folder = root / f'folder{i % 3}'
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f'report{i}.pdf').write_text('x')
+        (folder / f'other{i}.txt').write_text('x')
+    return str(root)
+
+
+def run_worker(worker):
+    worker.start()
+    worker.join(5)
+    events = []
+    while not worker.events.empty():
+        events.append(worker.events.get())
+    return events
+
+
+def test_hits_arrive_in_batches_while_the_walk_goes_on(db_handler, tmp_path):
+    root = make_tree(tmp_path, 7)
+    handler = MultiSearchHandler(background=False)
+    batches = list(handler.iter_search('report', root, batch_size=2))
+    assert all(1 <= len(batch) <= 2 for batch in batches)
+    assert sorted(path for batch in batches for path in batch) == sorted(
+        os.path.join(root, f'folder{i % 3}', f'report{i}.pdf') for i in range(7))
+
+
+def test_a_slow_walk_still_hands_over_partial_batches(db_handler, tmp_path, monkeypatch):
+    monkeypatch.setattr(multisearch, 'SEARCH_BATCH_SECONDS', 0)
+    root = make_tree(tmp_path, 3)
+    handler = MultiSearchHandler(background=False)
+    # one hit per folder, each handed over as soon as its folder was listed
+    assert [len(batch) for batch in handler.iter_search('report', root)] == [1, 1, 1]
+
+
+def test_the_worker_streams_batches_then_reports_the_end(db_handler, tmp_path):
+    root = make_tree(tmp_path, 4)
+    events = run_worker(SearchWorker(MultiSearchHandler(background=False), 'report', root))
+    assert events[-1] == ('done', None)
+    assert all(kind == 'batch' for kind, _ in events[:-1])
+    assert sum(len(batch) for _, batch in events[:-1]) == 4
+
+
+def test_a_cancelled_search_stops_and_says_so(db_handler, tmp_path):
+    root = make_tree(tmp_path, 4)
+    worker = SearchWorker(MultiSearchHandler(background=False), 'report', root)
+    worker.cancel()
+    assert run_worker(worker) == [('cancelled', None)]
+
+
+def test_a_bad_query_is_reported_as_an_error(db_handler, tmp_path):
+    root = make_tree(tmp_path, 1)
+    worker = SearchWorker(MultiSearchHandler(background=False), 'size:>lots', root)
+    kind, message = run_worker(worker)[0]
+    assert kind == 'error' and message
@@ -0,0 +1,45 @@
+import os
+import threading
+
+from parallelsearch import ParallelSearch
+
+
+def make_root(tmp_path, name, folders=4):
+    root = tmp_path / name
+    for i in range(folders):
+        folder = root / f'folder{i}' / 'deeper'
+        folder.mkdir(parents=True)
+        (folder / f'{name}{i}.pdf').write_text('x')
+        (root / f'folder{i}' / f'{name}{i}.txt').write_text('x')
+    return str(root)
+
+
+def is_pdf(entry):
+    return entry.name.endswith('.pdf')
+
+
+def test_every_root_is_searched_by_the_shared_workers(tmp_path):
+    roots = [make_root(tmp_path, 'b'), make_root(tmp_path, 'a')]
+    search = ParallelSearch(is_pdf, workers=4, skip=set())
+    # one batch: hits come in the order the roots were given, then by path
+    batches = list(search.run(roots, batch_size=100, batch_seconds=5))
+    assert batches == [[os.path.join(roots[0], f'folder{i}', 'deeper', f'b{i}.pdf') for i in range(4)]
+                       + [os.path.join(roots[1], f'folder{i}', 'deeper', f'a{i}.pdf') for i in range(4)]]
+    assert search.directories_scanned == 2 * (1 + 4 * 2)
+
+
+def test_skipped_folders_and_symlinks_are_not_entered(tmp_path):
+    root = make_root(tmp_path, 'r')
+    os.symlink(os.path.join(root, 'folder0'), os.path.join(root, 'link'))
+    search = ParallelSearch(is_pdf, workers=2, skip={os.path.join(root, 'folder1')})
+    found = sorted(path for batch in search.run([root]) for path in batch)
+    assert found == [os.path.join(root, f'folder{i}', 'deeper', f'r{i}.pdf') for i in (0, 2, 3)]
+
+
+def test_a_cancelled_search_ends_without_results(tmp_path):
+    root = make_root(tmp_path, 'r')
+    cancel_event = threading.Event()
+    cancel_event.set()
+    search = ParallelSearch(is_pdf, workers=2, skip=set(), cancel_event=cancel_event)
+    assert list(search.run([root])) == []
+    assert search.directories_scanned == 0
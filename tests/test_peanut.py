@@ -0,0 +1,49 @@
+import json
+import os
+
+import peanut
+
+
+def run(capfd, *argv):
+    status = peanut.main(list(argv))
+    out, _ = capfd.readouterr()
+    return status, [json.loads(line) for line in out.splitlines()]
+
+
+def make_files(tmp_path, names):
+    folder = tmp_path / 'files'
+    folder.mkdir()
+    for name in names:
+        (folder / name).write_text('x')
+    return folder
+
+
+def test_search_prints_one_json_document(db_handler, tmp_path, capfd):
+    folder = make_files(tmp_path, ['a.pdf', 'b.pdf', 'c.txt'])
+    status, output = run(capfd, 'search', 'ext:pdf', str(folder))
+    assert status == 0 and len(output) == 1
+    assert output[0]['command'] == 'search' and output[0]['count'] == 2
+    assert sorted(output[0]['results']) == [str(folder / 'a.pdf'), str(folder / 'b.pdf')]
+
+
+def test_search_lines_stream_each_result_and_stop_at_the_limit(db_handler, tmp_path, capfd):
+    folder = make_files(tmp_path, [f'{i}.pdf' for i in range(5)])
+    status, output = run(capfd, 'search', '.pdf', str(folder), '--lines', '--limit', '3')
+    assert status == 0
+    assert [set(line) for line in output[:3]] == [{'path'}] * 3
+    assert output[3]['count'] == 3 and 'results' not in output[3]
+
+
+def test_direct_once_reports_what_it_moved(db_handler, tmp_path, capfd):
+    folder = make_files(tmp_path, ['report.pdf', 'notes.txt'])
+    (tmp_path / 'docs').mkdir()
+    db_handler.add_redirect('pdf', str(folder), str(tmp_path / 'docs'))
+    status, output = run(capfd, 'direct-once')
+    assert status == 0 and output[0]['moved'] == 1 and output[0]['failed'] == 0
+    assert os.listdir(tmp_path / 'docs') == ['report.pdf']
+
+
+def test_errors_are_reported_as_json_with_a_failing_status(db_handler, tmp_path, capfd):
+    status, output = run(capfd, 'search', 'size:>lots', str(tmp_path))
+    assert status == 1
+    assert output[0]['command'] == 'search' and output[0]['error']
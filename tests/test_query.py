@@ -0,0 +1,84 @@
+import os
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from query import QueryError, is_query, parse_query, parse_range, parse_size, parse_time_range
+
+
+def test_sizes_take_binary_units():
+    assert parse_size('10') == 10
+    assert parse_size('1.5KB') == 1536
+    assert parse_size('2m') == 2 * 1024 ** 2
+    with pytest.raises(QueryError):
+        parse_size('10 parsecs')
+
+
+def test_ranges_include_their_ends_unless_the_operator_is_strict():
+    assert parse_range('>10', int) == (11, None)
+    assert parse_range('>=10', int) == (10, None)
+    assert parse_range('<10', int) == (None, 9)
+    assert parse_range('<=10', int) == (None, 10)
+    assert parse_range('5..', int) == (5, None)
+    assert parse_range('1..3', int) == (1, 3)
+    assert parse_range('4', int) == (4, 4)
+
+
+def test_ages_and_dates_turn_into_timestamp_ranges():
+    now = 1000000.0
+    assert parse_time_range('<=7d', now) == (now - 7 * 86400, None)
+    assert parse_time_range('>=1h', now) == (None, now - 3600)
+    low, _ = parse_time_range('<7d', now)
+    assert now - 7 * 86400 < low < now - 7 * 86400 + 0.001
+    day = datetime.datetime(2024, 1, 1).timestamp()
+    low, high = parse_time_range('2024-01-01', now)
+    assert low == day and day + 86399 < high < day + 86400
+    with pytest.raises(QueryError):
+        parse_time_range('last tuesday', now)
+
+
+def test_strict_size_bounds_leave_out_the_bound_itself():
+    assert not parse_query('size:>10MB').match_stat(SimpleNamespace(st_size=10 * 1024 ** 2, st_mtime=0, st_atime=0))
+    assert parse_query('size:>=10MB').match_stat(SimpleNamespace(st_size=10 * 1024 ** 2, st_mtime=0, st_atime=0))
+    assert not parse_query('size:<1k').match_stat(SimpleNamespace(st_size=1024, st_mtime=0, st_atime=0))
+
+
+def test_plain_keywords_are_not_queries():
+    assert not is_query('holiday photos')
+    assert not is_query('C:temp')
+    assert is_query('ext:pdf report')
+
+
+def test_name_predicates():
+    query = parse_query('report ext:pdf,DOCX "glob:*2024*" re:^[a-z]')
+    assert query.words == ['report']
+    assert query.match_name('report_2024.pdf')
+    assert query.match_name('report_2024.docx')
+    assert not query.match_name('report_2023.pdf')
+    assert not query.match_name('Report_2024.pdf')
+    assert not query.needs_stat
+
+
+def test_stat_predicates_only_apply_to_files_that_passed_the_name_ones():
+    query = parse_query('size:>1KB mtime:<1d')
+    assert query.needs_stat
+    now = datetime.datetime.now().timestamp()
+    assert query.match_stat(SimpleNamespace(st_size=4096, st_mtime=now, st_atime=now))
+    assert not query.match_stat(SimpleNamespace(st_size=10, st_mtime=now, st_atime=now))
+    assert not query.match_stat(SimpleNamespace(st_size=4096, st_mtime=now - 3 * 86400, st_atime=now))
+
+
+def test_path_predicates_narrow_the_walk(tmp_path):
+    query = parse_query('path:projects/peanut', str(tmp_path))
+    start = os.path.join(str(tmp_path), 'projects', 'peanut')
+    assert query.start_directories(str(tmp_path)) == [start]
+    assert query.match_path(os.path.join(start, 'main.py'))
+    assert not query.match_path(os.path.join(str(tmp_path), 'other', 'main.py'))
+
+
+def test_invalid_queries_raise_query_errors():
+    with pytest.raises(QueryError):
+        parse_query('re:[unclosed')
+    with pytest.raises(QueryError):
+        parse_query('"unbalanced')
@@ -0,0 +1,45 @@
+from main import ResultList
+
+
+class Scrollbar:
+    def set(self, first, last):
+        self.position = (first, last)
+
+
+def result_list(paths=()):
+    # the selection logic without any widgets, so no display is needed
+    results = ResultList.__new__(ResultList)
+    results.paths = []
+    results.selection = bytearray()
+    results.top = 0
+    results.rows = []
+    results.scrollbar = Scrollbar()
+    results.extend(list(paths))
+    return results
+
+
+def test_the_selection_grows_one_byte_per_eight_results():
+    results = result_list([f'file{i}' for i in range(9)])
+    assert len(results.selection) == 2
+    results.extend(['file9'])
+    assert len(results.selection) == 2
+    results.extend([f'more{i}' for i in range(7)])
+    assert len(results.selection) == 3
+
+
+def test_toggled_rows_are_returned_in_result_order():
+    results = result_list([f'file{i}' for i in range(20)])
+    results.top = 8  # rows are counted from the first one on screen
+    for row in (9, 0, 2):
+        results.toggle_row(row)
+    results.toggle_row(2)
+    assert results.get_selected() == ['file8', 'file17']
+
+
+def test_select_all_sets_exactly_one_bit_per_result():
+    results = result_list([f'file{i}' for i in range(11)])
+    results.select_all()
+    assert results.selection == bytearray([0xff, 0b111])
+    assert results.get_selected() == [f'file{i}' for i in range(11)]
+    results.clear()
+    assert results.get_selected() == [] and results.scrollbar.position == (0.0, 1.0)
@@ -0,0 +1,123 @@
+import os
+import threading
+
+from scanner import DirectoryScanner, ScanPolicy, ScanVisitor
+
+
+class RecordingVisitor(ScanVisitor):
+    def __init__(self, remove=()):
+        self.remove = set(remove)
+        self.files = []
+        self.left = []
+
+    def visit_file(self, file_path, st):
+        self.files.append(file_path)
+        if file_path in self.remove:
+            os.remove(file_path)
+            return True
+        return False
+
+    def leave_directory(self, directory, entry_count, is_root):
+        self.left.append(directory)
+        return False
+
+
+def make_tree(tmp_path, paths):
+    for path in paths:
+        path = tmp_path / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('x')
+    return str(tmp_path)
+
+
+def test_one_walk_serves_every_visitor(db_handler, tmp_path, monkeypatch):
+    root = make_tree(tmp_path / 'root', ['a.txt', 'sub/b.txt', 'sub/deeper/c.txt'])
+    listed = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: listed.append(path) or real_scandir(path))
+    first, second = RecordingVisitor(), RecordingVisitor()
+    scanner = DirectoryScanner(db_handler, [first, second])
+    scanner.scan(root)
+
+    assert sorted(listed) == sorted({root, os.path.join(root, 'sub'), os.path.join(root, 'sub', 'deeper')})
+    assert sorted(first.files) == sorted(second.files) and len(first.files) == 3
+    assert scanner.files_scanned == 3 and scanner.directories_scanned == 3
+    # a directory is left only after everything below it
+    assert first.left == [os.path.join(root, 'sub', 'deeper'), os.path.join(root, 'sub'), root]
+
+
+def test_a_file_removed_by_one_visitor_is_not_shown_to_the_next(db_handler, tmp_path):
+    root = make_tree(tmp_path / 'root', ['a.txt', 'b.txt'])
+    removed = os.path.join(root, 'a.txt')
+    first, second = RecordingVisitor(remove=[removed]), RecordingVisitor()
+    scanner = DirectoryScanner(db_handler, [first, second])
+    scanner.scan(root)
+    assert second.files == [os.path.join(root, 'b.txt')]
+    assert scanner.items_removed == 1 and scanner.entry_counts[root] == 1
+
+
+def test_a_cancelled_scan_stops_walking_and_skips_finish(db_handler, tmp_path):
+    root = make_tree(tmp_path / 'root', [f'{i}/file.txt' for i in range(5)])
+    cancel_event = threading.Event()
+    progress = []
+
+    class CancelAfterFirstFile(RecordingVisitor):
+        finished = False
+
+        def visit_file(self, file_path, st):
+            cancel_event.set()
+            return super().visit_file(file_path, st)
+
+        def finish(self):
+            self.finished = True
+
+    visitor = CancelAfterFirstFile()
+    scanner = DirectoryScanner(db_handler, [visitor], cancel_event=cancel_event,
+                               on_progress=lambda s, directory: progress.append(s.files_scanned))
+    scanner.scan(root)
+    assert len(visitor.files) == 1 and not visitor.finished
+    # the last progress report is always sent, with the final counts
+    assert progress[-1] == 1
+
+
+def scan_with(db_handler, root, **policy):
+    visitor = RecordingVisitor()
+    listed = []
+    scanner = DirectoryScanner(db_handler, [visitor], policy=ScanPolicy(root, **policy),
+                               on_progress=lambda s, directory: listed.append(directory))
+    scanner.scan(root)
+    return sorted(os.path.relpath(path, root).replace(os.sep, '/') for path in visitor.files), scanner
+
+
+def test_globs_pick_files_and_prune_whole_folders(db_handler, tmp_path):
+    root = make_tree(tmp_path / 'root', ['a.pdf', 'b.txt', 'docs/c.pdf', 'node_modules/d.pdf', 'x/cache/e.pdf'])
+    files, scanner = scan_with(db_handler, root, include_globs=['*.pdf'], exclude_globs=['node_modules', 'x/cache'])
+    assert files == ['a.pdf', 'docs/c.pdf']
+    # pruned folders are never listed
+    assert scanner.directories_scanned == 3
+
+
+def test_max_depth_stops_the_walk(db_handler, tmp_path):
+    root = make_tree(tmp_path / 'root', ['a.txt', 'one/b.txt', 'one/two/c.txt'])
+    assert scan_with(db_handler, root, max_depth=1)[0] == ['a.txt', 'one/b.txt']
+    assert scan_with(db_handler, root, max_depth=0)[0] == ['a.txt']
+
+
+def test_followed_symlinks_visit_each_target_once(db_handler, tmp_path):
+    root = make_tree(tmp_path / 'root', ['inside/a.txt'])
+    make_tree(tmp_path / 'outside', ['b.txt'])
+    os.symlink(tmp_path / 'outside', os.path.join(root, 'link1'))
+    os.symlink(tmp_path / 'outside', os.path.join(root, 'link2'))
+    os.symlink(os.path.join(root, 'inside'), os.path.join(root, 'back_inside'))
+    assert scan_with(db_handler, root)[0] == ['inside/a.txt']
+    files = scan_with(db_handler, root, follow_symlinks=True)[0]
+    assert len(files) == 2 and 'inside/a.txt' in files and files[1].endswith('/b.txt')
+
+
+def test_paths_below_a_pruned_folder_are_not_allowed(tmp_path):
+    root = str(tmp_path)
+    policy = ScanPolicy(root, exclude_globs=['node_modules'], max_depth=2)
+    assert policy.allows_path(os.path.join(root, 'src', 'app'))
+    assert not policy.allows_path(os.path.join(root, 'node_modules', 'pkg'))
+    assert not policy.allows_path(os.path.join(root, 'a', 'b', 'c'))
+    assert not policy.allows_path(str(tmp_path.parent))
@@ -0,0 +1,100 @@
+import time
+import datetime
+import threading
+
+from scheduler import Scheduler
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_a_run_missed_in_the_past_is_caught_up_straight_away():
+    scheduler = Scheduler()
+    ran = threading.Event()
+    scheduler.at('test:missed', datetime.datetime.now() - datetime.timedelta(hours=3), ran.set)
+    assert ran.wait(1)
+    assert scheduler.next_run('test:missed') is None
+
+
+def test_missed_intervals_collapse_into_one_run():
+    scheduler = Scheduler()
+    runs = []
+    scheduler.every('test:interval', 60, runs.append, 'run', first_run=time.time() - 3600)
+    assert wait_for(lambda: runs)
+    time.sleep(0.2)
+    assert runs == ['run']
+    assert scheduler.next_run('test:interval') > datetime.datetime.now()
+
+
+def test_a_job_never_overlaps_with_itself():
+    scheduler = Scheduler(workers=2)
+    lock = threading.Lock()
+    state = {'running': 0, 'most': 0, 'runs': 0}
+
+    def slow_job():
+        with lock:
+            state['running'] += 1
+            state['most'] = max(state['most'], state['running'])
+        time.sleep(0.2)
+        with lock:
+            state['running'] -= 1
+            state['runs'] += 1
+
+    scheduler.every('test:slow', 0.02, slow_job, first_run=time.time())
+    assert wait_for(lambda: state['runs'] >= 2)
+    scheduler.cancel('test:slow')
+    assert state['most'] == 1
+
+
+def test_cancel_all_only_touches_its_own_prefix():
+    scheduler = Scheduler()
+    later = datetime.datetime.now() + datetime.timedelta(hours=1)
+    scheduler.at('autoclean:clean', later, print)
+    scheduler.at('autodirect:reconcile:a', later, print)
+    scheduler.at('autodirect:reconcile:b', later, print)
+    scheduler.cancel_all('autodirect:')
+    assert scheduler.next_run('autoclean:clean') is not None
+    assert scheduler.next_run('autodirect:reconcile:a') is None
+
+
+def test_a_one_shot_run_due_while_the_job_runs_is_held_back_not_lost():
+    scheduler = Scheduler()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def job(name):
+        runs.append(name)
+        started.set()
+        release.wait(2)
+
+    scheduler.at('test:once', time.time(), job, 'first')
+    assert started.wait(1)
+    scheduler.at('test:once', time.time(), job, 'second')
+    time.sleep(0.1)
+    assert runs == ['first']
+    release.set()
+    assert wait_for(lambda: runs == ['first', 'second'])
+
+
+def test_a_held_back_run_can_still_be_cancelled():
+    scheduler = Scheduler()
+    release = threading.Event()
+    runs = []
+
+    def job(name):
+        runs.append(name)
+        release.wait(2)
+
+    scheduler.at('test:once', time.time(), job, 'first')
+    assert wait_for(lambda: runs)
+    scheduler.at('test:once', time.time(), job, 'second')
+    time.sleep(0.1)
+    scheduler.cancel('test:once')
+    release.set()
+    time.sleep(0.2)
+    assert runs == ['first']
@@ -0,0 +1,56 @@
+import os
+
+from watchdog.events import DirDeletedEvent, DirMovedEvent, FileCreatedEvent, FileDeletedEvent
+
+from searchindex import IndexUpdater, SearchIndex
+
+
+def make_index(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'photos' / '2024').mkdir(parents=True)
+    (root / 'photos' / '2024' / 'beach.jpg').write_text('x')
+    (root / 'photos' / 'cat.jpg').write_text('x')
+    (root / 'notes.txt').write_text('x')
+    index = SearchIndex(str(tmp_path / 'index.db'))
+    index.build(str(root))
+    return index, str(root)
+
+
+def test_built_index_finds_names_below_the_searched_folder(tmp_path):
+    index, root = make_index(tmp_path)
+    assert sorted(index.search('.jpg', root)) == [os.path.join(root, 'photos', '2024', 'beach.jpg'),
+                                                    os.path.join(root, 'photos', 'cat.jpg')]
+    assert index.search('jpg', os.path.join(root, 'photos', '2024')) == [
+        os.path.join(root, 'photos', '2024', 'beach.jpg')]
+    assert index.search('cat', str(tmp_path)) is None  # not inside an indexed root
+
+
+def test_file_events_update_the_index(tmp_path):
+    index, root = make_index(tmp_path)
+    updater = IndexUpdater(index, root)
+    os.remove(os.path.join(root, 'notes.txt'))
+    updater.on_deleted(FileDeletedEvent(os.path.join(root, 'notes.txt')))
+    open(os.path.join(root, 'todo.txt'), 'w').close()
+    updater.on_created(FileCreatedEvent(os.path.join(root, 'todo.txt')))
+    updater.on_created(FileCreatedEvent(os.path.join(root, 'todo.txt')))
+    updater.flush()
+    assert index.search('.txt', root) == [os.path.join(root, 'todo.txt')]
+
+
+def test_moving_a_folder_moves_every_file_below_it(tmp_path):
+    index, root = make_index(tmp_path)
+    updater = IndexUpdater(index, root)
+    src, dst = os.path.join(root, 'photos'), os.path.join(root, 'pictures')
+    os.rename(src, dst)
+    updater.on_moved(DirMovedEvent(src, dst))
+    updater.flush()
+    assert sorted(index.search('.jpg', root)) == [os.path.join(dst, '2024', 'beach.jpg'), os.path.join(dst, 'cat.jpg')]
+
+
+def test_deleting_a_folder_drops_its_files(tmp_path):
+    index, root = make_index(tmp_path)
+    updater = IndexUpdater(index, root)
+    updater.on_deleted(DirDeletedEvent(os.path.join(root, 'photos')))
+    updater.flush()
+    assert index.search('.jpg', root) == []
+    assert index.search('notes', root) == [os.path.join(root, 'notes.txt')]
@@ -0,0 +1,48 @@
+import settings
+from settings import SettingsStore
+
+
+def count_saves(db_handler, monkeypatch):
+    saves = []
+    save_settings = db_handler.save_settings
+    monkeypatch.setattr(db_handler, 'save_settings', lambda **kwargs: saves.append(kwargs) or save_settings(**kwargs))
+    return saves
+
+
+def test_a_burst_of_changes_is_written_once(db_handler, monkeypatch):
+    monkeypatch.setattr(settings, 'SETTINGS_WRITE_DELAY', 60)
+    saves = count_saves(db_handler, monkeypatch)
+    store = SettingsStore(db_handler)
+    store.update_autoclean(clean_empty_folders_flag=True)
+    store.update_autoclean(clean_duplicate_files_flag=True, hash_workers=4)
+    store.update_user(theme='dark')
+    # reads are served from memory before anything is written
+    assert store.get_autoclean()['hash_workers'] == 4 and saves == []
+    store.flush()
+    assert len(saves) == 1 and saves[0]['custom_folders'] is None
+
+    reloaded = SettingsStore(db_handler)
+    assert reloaded.get_autoclean()['clean_duplicate_files_flag']
+    assert reloaded.get_user()['theme'] == 'dark'
+
+
+def test_unchanged_values_are_not_written(db_handler, monkeypatch):
+    saves = count_saves(db_handler, monkeypatch)
+    store = SettingsStore(db_handler)
+    store.update_user(ui_size=store.get_user()['ui_size'])
+    store.flush()
+    assert saves == []
+
+
+def test_a_failed_write_is_retried_with_the_next_one(db_handler, monkeypatch):
+    store = SettingsStore(db_handler)
+    store.update_user(theme='dark')
+    save_settings = db_handler.save_settings
+
+    def fail(**kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(db_handler, 'save_settings', fail)
+    store.flush()
+    monkeypatch.setattr(db_handler, 'save_settings', save_settings)
+    store.flush()
+    assert SettingsStore(db_handler).get_user()['theme'] == 'dark'
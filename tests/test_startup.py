@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('customtkinter', 'tkinter', 'PIL', 'pygame', 'watchdog', 'autoclean', 'autodirect', 'multisearch')
+
+
+def modules_loaded_by(statement):
+    # a fresh interpreter, so modules imported by other tests do not count
+    script = f"import sys, json; {statement}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    output = subprocess.run([sys.executable, '-c', script], cwd=REPO, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+def test_the_cli_imports_no_ui_and_no_handlers_up_front():
+    assert modules_loaded_by('import peanut') == []
+
+
+def test_the_window_leaves_pygame_until_a_sound_is_played():
+    assert 'pygame' not in modules_loaded_by('import main')
+
+
+def test_images_are_decoded_once(monkeypatch):
+    import main
+    opened = []
+    monkeypatch.setattr(main.Image, 'open', lambda path: opened.append(path) or path)
+    monkeypatch.setattr(main.ctk, 'CTkImage', lambda **kwargs: kwargs)
+    monkeypatch.setattr(main, 'image_cache', {})
+    first = main.load_image('images/peanut.png', (20, 20))
+    assert main.load_image('images/peanut.png', (20, 20)) is first
+    main.load_image('images/peanut.png', (40, 40))
+    assert opened == ['images/peanut.png', 'images/peanut.png']
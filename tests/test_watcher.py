@@ -0,0 +1,38 @@
+import os
+
+from watchdog.events import DirCreatedEvent, DirMovedEvent, FileCreatedEvent, FileModifiedEvent, FileMovedEvent
+
+from watcher import DirtyPathJournal
+
+
+def test_events_mark_the_directories_the_next_clean_revisits(db_handler, tmp_path):
+    root = str(tmp_path)
+    journal = DirtyPathJournal(db_handler, root)
+    journal.on_any_event(FileCreatedEvent(os.path.join(root, 'a', 'new.txt')))
+    journal.on_any_event(FileModifiedEvent(os.path.join(root, 'a', 'other.txt')))
+    journal.on_any_event(DirCreatedEvent(os.path.join(root, 'b')))
+    journal.on_any_event(FileMovedEvent(os.path.join(root, 'c', 'x.txt'), os.path.join(root, 'd', 'x.txt')))
+    journal.on_any_event(DirMovedEvent(os.path.join(root, 'e'), os.path.join(root, 'f', 'e')))
+    # nothing is written until the journal is flushed
+    assert db_handler.get_dirty_paths(root) == []
+    journal.flush()
+
+    assert dict(db_handler.get_dirty_paths(root)) == {
+        os.path.join(root, 'a'): False,
+        os.path.join(root, 'b'): True,
+        os.path.join(root, 'c'): False,
+        os.path.join(root, 'd'): False,
+        # a moved directory dirties the folder it left and its whole new subtree
+        root: False,
+        os.path.join(root, 'f', 'e'): True,
+    }
+
+
+def test_a_path_stays_recursive_once_a_flush_marked_it_so(db_handler, tmp_path):
+    root = str(tmp_path)
+    journal = DirtyPathJournal(db_handler, root)
+    journal.mark(os.path.join(root, 'a'), recursive=True)
+    journal.flush()
+    journal.mark(os.path.join(root, 'a'))
+    journal.flush()
+    assert db_handler.get_dirty_paths(root) == [(os.path.join(root, 'a'), True)]
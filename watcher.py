@@ -0,0 +1,93 @@
+import os
+import threading
+import datetime
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from database import delayed_writes
+
+JOURNAL_FLUSH_DELAY = 2.0  # seconds of quiet before buffered dirty paths are written to peanut.db
+
+
+class DirtyPathJournal(FileSystemEventHandler):
+    # records which parts of an AutoClean root changed, so the next clean only revisits those
+    def __init__(self, db_handler, root_directory):
+        self.db_handler = db_handler
+        self.root_directory = root_directory
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def on_any_event(self, event):
+        if event.event_type == 'closed':
+            return
+        if event.is_directory:
+            if event.event_type == 'created':
+                self.mark(event.src_path, recursive=True)
+            elif event.event_type == 'modified':
+                self.mark(event.src_path)
+            else:
+                self.mark(os.path.dirname(event.src_path))
+        else:
+            self.mark(os.path.dirname(event.src_path))
+        if event.event_type == 'moved':
+            self.mark(event.dest_path if event.is_directory else os.path.dirname(event.dest_path),
+                      recursive=event.is_directory)
+
+    def mark(self, directory, recursive=False):
+        # a file event only dirties its own directory, a new directory dirties its whole subtree
+        with self.lock:
+            self.pending[directory] = self.pending.get(directory, False) or recursive
+            delayed_writes.schedule(self, JOURNAL_FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            delayed_writes.cancel(self)
+        if pending:
+            timestamp = datetime.datetime.now().isoformat()
+            self.db_handler.add_dirty_paths([(path, self.root_directory, int(recursive), timestamp)
+                                             for path, recursive in pending.items()])
+
+
+class DirectoryWatcher:
+    def __init__(self):
+        self.observer = None
+        self.watches = {}
+        self.lock = threading.Lock()
+
+    def watch(self, key, directory, event_handler):
+        with self.lock:
+            if key in self.watches or not os.path.isdir(directory):
+                return False
+            if self.observer is None:
+                self.observer = Observer()
+                self.observer.daemon = True
+                self.observer.start()
+            self.watches[key] = (self.observer.schedule(event_handler, directory, recursive=True), event_handler,
+                                 datetime.datetime.now())
+            return True
+
+    def unwatch(self, key):
+        with self.lock:
+            watch = self.watches.pop(key, None)
+            if watch is None:
+                return
+            # watchdog shares one ObservedWatch between every handler on the same path, so unscheduling it
+            # would silence the other features watching that folder too; only the last one unschedules
+            if any(other[0] == watch[0] for other in self.watches.values()):
+                self.observer.remove_handler_for_watch(watch[1], watch[0])
+            else:
+                self.observer.unschedule(watch[0])
+        if hasattr(watch[1], 'flush'):
+            watch[1].flush()
+
+    def unwatch_all(self, prefix):
+        for key in [key for key in list(self.watches) if key.startswith(prefix)]:
+            self.unwatch(key)
+
+    def watching_since(self, key):
+        watch = self.watches.get(key)
+        return watch[2] if watch else None
+
+
+# one observer thread per process, shared by every handler instance
+directory_watcher = DirectoryWatcher()